@@ -0,0 +1,76 @@
+"""
+Benchmark comparing the memory used for reading the add's response as whole list against streaming it,
+as the publishing does now.
+
+A synthetic tree with many small files is generated and added to the IPFS node with `only_hash`, so nothing is
+stored in the node. The peak of memory allocated by Python during the add is measured with tracemalloc.
+Requires running IPFS daemon.
+
+Usage:
+    python -m benchmarks.bench_add_memory [--files 100000] [--api /dns/localhost/tcp/5001/http]
+"""
+import argparse
+import pathlib
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import ipfshttpclient
+
+
+def generate_tree(path: pathlib.Path, files: int) -> None:
+    for i in range(files):
+        file = path / f'dir{i % 100}' / f'file{i}.html'
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.write_text(f'<p>{i}</p>')
+
+
+def add_as_list(ipfs: ipfshttpclient.Client, path: pathlib.Path) -> str:
+    """
+    Previous way of adding the publish directory.
+    """
+    return ipfs.add(path, recursive=True, pin=False, only_hash=True)[-1]['Hash']
+
+
+def add_streamed(ipfs: ipfshttpclient.Client, path: pathlib.Path) -> str:
+    last_entry = None
+    for entry in ipfs.add(path, recursive=True, pin=False, only_hash=True, stream=True):
+        last_entry = entry
+
+    return last_entry['Hash']
+
+
+def measure(func, ipfs: ipfshttpclient.Client, path: pathlib.Path) -> tuple:
+    tracemalloc.start()
+    start = time.perf_counter()
+    cid = func(ipfs, path)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return cid, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=100000, help='Number of files in the tree')
+    parser.add_argument('--api', default=ipfshttpclient.DEFAULT_ADDR, help='Multiaddr of IPFS HTTP API')
+    args = parser.parse_args()
+
+    workdir = pathlib.Path(tempfile.mkdtemp(prefix='ipfs_publish_bench_'))
+    try:
+        print('Generating synthetic tree...')
+        generate_tree(workdir / 'site', args.files)
+
+        with ipfshttpclient.connect(args.api) as ipfs:
+            print(f'{"response":<12}{"time [s]":>12}{"peak memory [MB]":>20}  root')
+            for name, func in (('list', add_as_list), ('stream', add_streamed)):
+                cid, elapsed, peak = measure(func, ipfs, workdir / 'site')
+                print(f'{name:<12}{elapsed:>12.2f}{peak / 1024 / 1024:>20.1f}  {cid}')
+    finally:
+        shutil.rmtree(str(workdir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""
+Benchmark comparing the clone strategies of repo's mirror against plain full clone, that was used for every publish
+before the mirrors were introduced.
+
+A synthetic repo is generated with small 'docs' directory (the published directory), big binary assets and history
+of several commits. For every strategy it measures the first publish (mirror is created) and following publish
+(only one new commit is fetched into existing mirror).
+
+Usage:
+    python -m benchmarks.bench_clone [--files 2000] [--assets 20] [--asset-size 5] [--commits 20]
+"""
+import argparse
+import os
+import pathlib
+import shutil
+import tempfile
+import time
+
+import git
+
+from publish import mirror
+
+PUBLISH_DIR = 'docs'
+
+
+def commit_all(repo: git.Repo, message: str) -> None:
+    repo.git.add('--all')
+    repo.git.commit('-q', '-m', message)
+
+
+def generate_repo(path: pathlib.Path, files: int, assets: int, asset_size: int, commits: int) -> git.Repo:
+    repo = git.Repo.init(str(path))
+    repo.git.config('user.name', 'Benchmark')
+    repo.git.config('user.email', 'benchmark@localhost')
+    repo.git.config('uploadpack.allowFilter', 'true')
+
+    for commit in range(commits):
+        for i in range(files // commits):
+            source = path / 'src' / f'dir{i % 50}' / f'file{commit}_{i}.txt'
+            source.parent.mkdir(parents=True, exist_ok=True)
+            source.write_text(f'{commit} {i}\n' * 50)
+
+        for i in range(assets // commits or 1):
+            asset = path / 'assets' / f'asset{commit}_{i}.bin'
+            asset.parent.mkdir(parents=True, exist_ok=True)
+            asset.write_bytes(os.urandom(asset_size * 1024 * 1024))
+
+        page = path / PUBLISH_DIR / f'page{commit}.html'
+        page.parent.mkdir(parents=True, exist_ok=True)
+        page.write_text(f'<h1>Page {commit}</h1>')
+
+        commit_all(repo, f'Commit {commit}')
+
+    return repo
+
+
+def dir_size(path: pathlib.Path) -> int:
+    return sum(entry.stat().st_size for entry in path.rglob('*') if entry.is_file())
+
+
+def measure(func) -> float:
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def bench_full_clone(url: str, workdir: pathlib.Path) -> float:
+    target = pathlib.Path(tempfile.mkdtemp(dir=str(workdir)))
+    elapsed = measure(lambda: git.Repo.clone_from(url, str(target)))
+    shutil.rmtree(str(target))
+    return elapsed
+
+
+def bench_mirror_publish(repo_mirror: mirror.RepoMirror, workdir: pathlib.Path, paths) -> float:
+    target = pathlib.Path(tempfile.mkdtemp(dir=str(workdir)))
+
+    def publish():
+        commit = repo_mirror.fetch()
+        repo_mirror.checkout(commit, target, paths)
+
+    elapsed = measure(publish)
+    shutil.rmtree(str(target))
+    repo_mirror.prune()
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=2000, help='Number of small source files')
+    parser.add_argument('--assets', type=int, default=20, help='Number of big binary assets')
+    parser.add_argument('--asset-size', type=int, default=5, help='Size of one asset in MB')
+    parser.add_argument('--commits', type=int, default=20, help='Number of commits in the history')
+    args = parser.parse_args()
+
+    workdir = pathlib.Path(tempfile.mkdtemp(prefix='ipfs_publish_bench_'))
+    try:
+        print('Generating synthetic repo...')
+        origin = generate_repo(workdir / 'origin', args.files, args.assets, args.asset_size, args.commits)
+        url = f'file://{origin.working_tree_dir}'
+
+        print(f'{"strategy":<12}{"first publish [s]":>20}{"next publish [s]":>20}{"mirror size [MB]":>20}')
+        first = bench_full_clone(url, workdir)
+        print(f'{"clone":<12}{first:>20.2f}{first:>20.2f}{"-":>20}')
+
+        for strategy in mirror.CLONE_STRATEGIES:
+            repo_mirror = mirror.RepoMirror(workdir / f'mirror_{strategy}', url, strategy=strategy)
+            paths = [PUBLISH_DIR] if strategy == 'sparse' else None
+
+            first = bench_mirror_publish(repo_mirror, workdir, paths)
+
+            (workdir / 'origin' / PUBLISH_DIR / 'new.html').write_text(f'<h1>New page for {strategy}</h1>')
+            commit_all(origin, f'New page for {strategy}')
+            following = bench_mirror_publish(repo_mirror, workdir, paths)
+
+            size = dir_size(repo_mirror.path) / 1024 / 1024
+            print(f'{strategy:<12}{first:>20.2f}{following:>20.2f}{size:>20.1f}')
+    finally:
+        shutil.rmtree(str(workdir))
+
+
+if __name__ == '__main__':
+    main()
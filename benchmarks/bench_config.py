@@ -0,0 +1,62 @@
+"""
+Benchmark of loading and saving of config with many repos. It measures the load of the config, the first access
+of one repo (as when a webhook of the repo is handled), the first save and the save after change of one repo.
+
+Usage:
+    python -m benchmarks.bench_config [--repos 10000] [--repeat 3]
+"""
+import argparse
+import os
+import pathlib
+import shutil
+import tempfile
+import time
+
+from publish import ENV_NAME_DATA_DIR, config as config_module
+
+from benchmarks.bench_startup import generate_config
+
+
+def measure(action) -> float:
+    start = time.perf_counter()
+    action()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repos', type=int, default=10000, help='Number of repos in the config')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs, the best one is reported')
+    args = parser.parse_args()
+
+    workdir = pathlib.Path(tempfile.mkdtemp(prefix='ipfs_publish_bench_'))
+    os.environ[ENV_NAME_DATA_DIR] = str(workdir / 'data')
+    try:
+        config_path = workdir / 'config.toml'
+        generate_config(config_path, args.repos)
+        print(f'Config with {args.repos} repos has {config_path.stat().st_size / 1024 / 1024:.1f} MiB')
+
+        results = {'load': [], 'access one repo': [], 'first save': [], 'save one changed repo': []}
+        for _ in range(args.repeat):
+            config = None
+
+            def load():
+                nonlocal config
+                config = config_module.Config(config_path)
+
+            results['load'].append(measure(load))
+            name = f'repo{args.repos // 2}'
+            results['access one repo'].append(measure(lambda: config.repos[name]))
+            results['first save'].append(measure(config.save))
+
+            config.repos[name].branch = 'gh-pages'
+            results['save one changed repo'].append(measure(config.save))
+
+        for name, times in results.items():
+            print(f'{name:<24}{min(times):>10.3f} s')
+    finally:
+        shutil.rmtree(str(workdir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Benchmark comparing the compiled ignore matcher with single walk of the tree against the previous implementation,
+that walked the whole tree with glob for every line of the ignore file.
+
+A synthetic tree is generated and both implementations remove files from its fresh copy based on the same ignore
+file. Patterns are written in the form that has the same meaning with glob and gitignore syntax.
+
+Usage:
+    python -m benchmarks.bench_ignore [--files 100000] [--patterns 40] [--repeat 3]
+"""
+import argparse
+import pathlib
+import shutil
+import tempfile
+import time
+
+from publish import ignore
+
+EXTENSIONS = ('html', 'css', 'js', 'map', 'txt', 'md', 'json', 'png')
+
+
+def generate_tree(path: pathlib.Path, files: int) -> None:
+    for i in range(files):
+        file = path / f'dir{i % 20}' / f'sub{i % 100}' / f'file{i}.{EXTENSIONS[i % len(EXTENSIONS)]}'
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.touch()
+
+
+def generate_patterns(count: int) -> list:
+    patterns = ['**/*.map', '**/*.md', 'dir3', 'dir7/sub7']
+    patterns += [f'**/file{i}.txt' for i in range(count - len(patterns))]
+    return patterns[:count]
+
+
+def remove_with_globs(path: pathlib.Path, patterns: list) -> None:
+    """
+    Previous implementation of removal of ignored files.
+    """
+    for pattern in patterns:
+        for path_to_delete in path.glob(pattern):
+            path_to_delete = path_to_delete.resolve()
+            if not path_to_delete.exists():
+                continue
+
+            if path_to_delete.is_file():
+                path_to_delete.unlink()
+            else:
+                shutil.rmtree(str(path_to_delete))
+
+
+def remove_with_matcher(path: pathlib.Path, patterns: list) -> None:
+    ignore.IgnoreMatcher(patterns).remove_ignored(path)
+
+
+def count_files(path: pathlib.Path) -> int:
+    return sum(1 for entry in path.rglob('*') if entry.is_file())
+
+
+def bench(func, source: pathlib.Path, workdir: pathlib.Path, patterns: list, repeat: int) -> tuple:
+    best = None
+    remaining = None
+    for _ in range(repeat):
+        target = workdir / 'target'
+        shutil.copytree(str(source), str(target))
+
+        start = time.perf_counter()
+        func(target, patterns)
+        elapsed = time.perf_counter() - start
+
+        best = elapsed if best is None else min(best, elapsed)
+        remaining = count_files(target)
+        shutil.rmtree(str(target))
+
+    return best, remaining
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=100000, help='Number of files in the tree')
+    parser.add_argument('--patterns', type=int, default=40, help='Number of lines in the ignore file')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs, the best one is reported')
+    args = parser.parse_args()
+
+    workdir = pathlib.Path(tempfile.mkdtemp(prefix='ipfs_publish_bench_'))
+    try:
+        print('Generating synthetic tree...')
+        source = workdir / 'source'
+        generate_tree(source, args.files)
+        patterns = generate_patterns(args.patterns)
+
+        print(f'{"implementation":<16}{"time [s]":>12}{"remaining files":>20}')
+        for name, func in (('glob per line', remove_with_globs), ('matcher', remove_with_matcher)):
+            elapsed, remaining = bench(func, source, workdir, patterns, args.repeat)
+            print(f'{name:<16}{elapsed:>12.2f}{remaining:>20}')
+    finally:
+        shutil.rmtree(str(workdir))
+
+
+if __name__ == '__main__':
+    main()
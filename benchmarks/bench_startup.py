@@ -0,0 +1,115 @@
+"""
+Benchmark of the CLI's startup, that measures import time of the CLI module and wall time of the `list` and `show`
+commands with config of many repos. Each command is run in fresh interpreter, the best of the runs is reported.
+
+The benchmark fails (exits with status 1) when any of the measured times exceeds its budget or when the commands load
+some of the heavy dependencies, so it can be used for catching regressions of the startup.
+
+Usage:
+    python -m benchmarks.bench_startup [--repos 200] [--repeat 5] [--max-import 0.3] [--max-command 0.6]
+"""
+import argparse
+import os
+import pathlib
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import toml
+
+from publish import ENV_NAME_CONFIG_PATH, ENV_NAME_DATA_DIR
+
+HEAVY_MODULES = ('ipfshttpclient.client', 'git.repo', 'CloudFlare.cloudflare', 'inquirer.prompt', 'click_completion',
+                 'pbr.version', 'pkg_resources', 'quart')
+"""
+Modules, whose loading slows down the CLI's startup significantly, so the commands that do not need them must not load
+them. Submodules are used, as the packages themselves are registered in sys.modules already by the lazy import.
+"""
+
+IMPORT_SCRIPT = '''
+import time
+start = time.perf_counter()
+import publish.cli
+print(time.perf_counter() - start)
+'''
+
+COMMAND_SCRIPT = '''
+import sys
+
+from publish import cli
+
+try:
+    cli.entrypoint(sys.argv[1:])
+except SystemExit:
+    pass
+
+print(','.join(name for name in {modules!r} if name in sys.modules), file=sys.stderr)
+'''
+"""
+Runs the CLI with the script's arguments and prints the loaded heavy modules, separated by comma, as the last line
+of stderr. Shared with the CLI's tests, so they check the same modules as the benchmark.
+"""
+
+
+def generate_config(path: pathlib.Path, repos: int) -> None:
+    path.write_text(toml.dumps({'host': 'localhost', 'port': 8070, 'repos': {
+        f'repo{i}': {
+            'name': f'repo{i}', 'git_repo_url': f'https://github.com/example/repo{i}', 'secret': 'secret',
+            'ipns': {'ipns_key': f'ipfs_publish_repo{i}', 'ipns_addr': f'/ipns/key{i}/'},
+            'cloudflare': {'zone_id': 'zone', 'dns_id': f'dns{i}'},
+        } for i in range(repos)
+    }}))
+
+
+def run(args: list, env: dict) -> tuple:
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', *args], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            check=True)
+    return time.perf_counter() - start, result.stdout.decode('utf-8'), result.stderr.decode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repos', type=int, default=200, help='Number of repos in the config')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of runs, the best one is reported')
+    parser.add_argument('--max-import', type=float, default=0.3, help='Budget for import of the CLI in seconds')
+    parser.add_argument('--max-command', type=float, default=0.6, help='Budget for the commands in seconds')
+    args = parser.parse_args()
+
+    failures = []
+    workdir = pathlib.Path(tempfile.mkdtemp(prefix='ipfs_publish_bench_'))
+    try:
+        config_path = workdir / 'config.toml'
+        generate_config(config_path, args.repos)
+        env = dict(os.environ, **{ENV_NAME_CONFIG_PATH: str(config_path), ENV_NAME_DATA_DIR: str(workdir / 'data')})
+
+        import_time = min(float(run([IMPORT_SCRIPT], env)[1]) for _ in range(args.repeat))
+        print(f'{"import publish.cli":<24}{import_time:>10.3f} s')
+        if import_time > args.max_import:
+            failures.append(f'import took {import_time:.3f} s, budget is {args.max_import} s')
+
+        script = COMMAND_SCRIPT.format(modules=HEAVY_MODULES)
+        for command in (['list'], ['show', 'repo0']):
+            runs = [run([script, *command], env) for _ in range(args.repeat)]
+            elapsed = min(elapsed for elapsed, _, _ in runs)
+            loaded = runs[0][2].strip().splitlines()[-1] if runs[0][2].strip() else ''
+            name = ' '.join(command)
+
+            print(f'{name:<24}{elapsed:>10.3f} s')
+            if elapsed > args.max_command:
+                failures.append(f'\'{name}\' took {elapsed:.3f} s, budget is {args.max_command} s')
+            if loaded:
+                failures.append(f'\'{name}\' loaded heavy modules: {loaded}')
+
+        for failure in failures:
+            print(f'FAILED: {failure}')
+    finally:
+        shutil.rmtree(str(workdir))
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,3 @@
-from pbr.version import VersionInfo
-
-VERSION = VersionInfo('ipfs-publish').semantic_version()
-__version__ = VERSION.release_string()
-
 APP_NAME = 'ipfs_publish'
 """
 Constant that defines the basic application then, that is used for appdata
@@ -28,6 +23,11 @@ ENV_NAME_IPFS_MULTIADDR: str = 'IPFS_PUBLISH_IPFS_MULTIADDR'
 Name of environmental variable that defines the multiaddr of the go-ipfs's daemon's API.
 """
 
+ENV_NAME_DATA_DIR: str = 'IPFS_PUBLISH_DATA_DIR'
+"""
+Name of environmental variable that defines the directory where persistent data (eq. repos' mirrors) are stored.
+"""
+
 ENV_NAME_VERBOSITY_LEVEL: str = 'IPFS_PUBLISH_VERBOSITY'
 """
 Name of environmental variable that can increase the level of logging verbosity.
@@ -57,3 +57,15 @@ IPNS_KEYS_TYPE: str = 'rsa'
 """
 Type of IPNS key to be generated
 """
+
+
+def __getattr__(name):
+    # The version is resolved only when needed, as importing pbr takes significant part of the CLI's startup
+    if name in ('VERSION', '__version__'):
+        from pbr.version import VersionInfo
+
+        version = VersionInfo('ipfs-publish').semantic_version()
+        globals().update(VERSION=version, __version__=version.release_string())
+        return globals()[name]
+
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
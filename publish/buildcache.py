@@ -0,0 +1,177 @@
+import hashlib
+import logging
+import os
+import pathlib
+import shutil
+import typing
+import uuid
+
+from publish import exceptions
+
+logger = logging.getLogger('publish.buildcache')
+
+DEFAULT_KEEP_BUILDS = 3
+"""
+Number of the last build outputs that are kept in the cache per repo.
+"""
+
+OUTPUTS_DIR = 'outputs'
+DEPENDENCIES_DIR = 'dependencies'
+
+
+def validate_cache_path(path: str) -> str:
+    """
+    Validates that the path is relative path inside of the repo and returns it normalized.
+
+    :param path:
+    :raises exceptions.ConfigException: If the path points outside of the repo
+    :return:
+    """
+    normalized = pathlib.PurePosixPath(path.strip('/'))
+    if not normalized.parts or '..' in normalized.parts:
+        raise exceptions.ConfigException(f'Cache path \'{path}\' has to be a path inside of the repo!')
+
+    return normalized.as_posix()
+
+
+def _copy_tree(source: pathlib.Path, destination: pathlib.Path) -> None:
+    # The worktree's .git file is not part of the build's output
+    shutil.copytree(str(source), str(destination), symlinks=True,
+                    ignore=lambda directory, names: ['.git'] if pathlib.Path(directory) == source else [])
+
+
+class BuildCache:
+    """
+    Per-repo cache of the build's outputs and of the build's dependency directories.
+
+    Outputs are stored under a key that is derived from the Git tree hashes of the build's input paths and from
+    the build binary, so when neither of them changed the build does not need to run at all and its previous output
+    is restored instead.
+
+    Dependency directories (eq. node_modules) are moved into every fresh checkout before the build and moved back
+    after it, so package managers do not start cold.
+    """
+
+    path: pathlib.Path = None
+    """
+    Directory of the repo's cache.
+    """
+
+    keep: int = DEFAULT_KEEP_BUILDS
+    """
+    Number of the last build outputs that are kept.
+    """
+
+    def __init__(self, path: pathlib.Path, keep: int = DEFAULT_KEEP_BUILDS):
+        self.path = path
+        self.keep = keep
+
+    @staticmethod
+    def compute_key(tree_hashes: str, build_bin: str) -> str:
+        """
+        Returns key of the build based on the tree hashes of its inputs and the build binary.
+
+        :param tree_hashes:
+        :param build_bin:
+        :return:
+        """
+        digest = hashlib.sha256()
+        digest.update(build_bin.encode('utf-8'))
+        digest.update(b'\0')
+        digest.update(tree_hashes.encode('utf-8'))
+        return digest.hexdigest()
+
+    def restore_output(self, key: str, destination: pathlib.Path) -> bool:
+        """
+        Replaces the destination with the cached output of the build, if there is any.
+
+        :param key:
+        :param destination:
+        :return: Whether the output was found in the cache
+        """
+        cached = self.path / OUTPUTS_DIR / key
+        if not cached.is_dir():
+            return False
+
+        logger.info(f'Restoring build output {key} into {destination}')
+        if destination.exists():
+            shutil.rmtree(str(destination))
+
+        _copy_tree(cached, destination)
+        os.utime(str(cached))
+        return True
+
+    def store_output(self, key: str, source: pathlib.Path) -> None:
+        """
+        Stores the build's output into the cache and removes the outputs that are over the limit.
+
+        :param key:
+        :param source:
+        :return:
+        """
+        outputs = self.path / OUTPUTS_DIR
+        outputs.mkdir(parents=True, exist_ok=True)
+
+        # Copying into temporary directory so partially copied output is never used
+        tmp_path = outputs / f'.tmp-{uuid.uuid4().hex}'
+        _copy_tree(source, tmp_path)
+
+        target = outputs / key
+        if target.exists():
+            shutil.rmtree(str(target))
+        tmp_path.rename(target)
+
+        entries = sorted((entry for entry in outputs.iterdir() if not entry.name.startswith('.')),
+                         key=lambda x: x.stat().st_mtime)
+        for entry in entries[:-self.keep] if self.keep else entries:
+            logger.debug(f'Removing cached build output {entry.name}')
+            shutil.rmtree(str(entry))
+
+    def restore_dependencies(self, repo_path: pathlib.Path, paths: typing.Iterable[str]) -> typing.List[str]:
+        """
+        Moves the persisted dependency directories into the checked out repo.
+
+        :param repo_path:
+        :param paths:
+        :return: Paths that are not part of the repo, hence should be saved after the build
+        """
+        managed_paths = []
+        for path in paths:
+            cached = self.path / DEPENDENCIES_DIR / path
+            target = repo_path / path
+
+            if target.exists() or target.is_symlink():
+                logger.warning(f'Path \'{path}\' is part of the repo, it is not cached')
+                continue
+
+            managed_paths.append(path)
+            if cached.exists():
+                logger.debug(f'Restoring dependency directory \'{path}\' from cache')
+                target.parent.mkdir(parents=True, exist_ok=True)
+                shutil.move(str(cached), str(target))
+
+        return managed_paths
+
+    def save_dependencies(self, repo_path: pathlib.Path, paths: typing.Iterable[str]) -> None:
+        """
+        Moves the dependency directories from the checked out repo into the cache, hence they are not published.
+
+        :param repo_path:
+        :param paths:
+        :return:
+        """
+        for path in paths:
+            source = repo_path / path
+            cached = self.path / DEPENDENCIES_DIR / path
+
+            if not source.is_dir() or source.is_symlink():
+                continue
+
+            if cached.exists():
+                shutil.rmtree(str(cached))
+
+            cached.parent.mkdir(parents=True, exist_ok=True)
+            shutil.move(str(source), str(cached))
+
+    def remove(self) -> None:
+        shutil.rmtree(str(self.path), ignore_errors=True)
@@ -0,0 +1,238 @@
+import logging
+import pathlib
+import re
+import time
+import typing
+
+from publish import config as config_module
+
+logger = logging.getLogger('publish.buildlog')
+
+DEFAULT_MAX_BYTES = 10 * 1024 * 1024
+"""
+Default maximal size of one log file, when reached the log is rotated.
+"""
+
+DEFAULT_BACKUP_COUNT = 2
+"""
+Default number of rotated files kept for one job's log.
+"""
+
+DEFAULT_KEEP_JOBS = 20
+"""
+Default number of the last jobs' logs that are kept per repo.
+"""
+
+READ_CHUNK_SIZE = 64 * 1024
+"""
+Size of chunks in which the output of binaries is read and written into the log.
+"""
+
+TAIL_LINE_SIZE = 256
+"""
+Estimated size of one line, used to limit how much of the log is read when returning its tail.
+"""
+
+FOLLOW_POLL_INTERVAL = 0.5
+"""
+Number of seconds between checks for new data in the followed log.
+"""
+
+
+class BuildLog:
+    """
+    Log file of one publishing job, where the output of the repo's binaries is streamed.
+
+    The log is size capped, when the file reaches max_bytes it is rotated (eq. renamed to '<job>.log.1' etc.) and only
+    backup_count of rotated files is kept. When the job finishes a '<job>.done' marker is created next to the log.
+    """
+
+    path: pathlib.Path = None
+    """
+    Path of the current log file.
+    """
+
+    def __init__(self, path: pathlib.Path, max_bytes: int = DEFAULT_MAX_BYTES,
+                 backup_count: int = DEFAULT_BACKUP_COUNT):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._file: typing.Optional[typing.BinaryIO] = None
+
+    @staticmethod
+    def _settings(config: config_module.Config) -> dict:
+        return config['logs'] or {}
+
+    @staticmethod
+    def repo_dir(config: config_module.Config, repo_name: str) -> pathlib.Path:
+        return config.data_dir / 'logs' / repo_name
+
+    @classmethod
+    def for_job(cls, config: config_module.Config, repo_name: str, job_id: str) -> 'BuildLog':
+        """
+        Returns log of the job, configured based on the 'logs' section of the config.
+
+        :param config:
+        :param repo_name:
+        :param job_id:
+        :return:
+        """
+        settings = cls._settings(config)
+        return cls(cls.repo_dir(config, repo_name) / f'{job_id}.log', settings.get('max_size', DEFAULT_MAX_BYTES),
+                   settings.get('backups', DEFAULT_BACKUP_COUNT))
+
+    @classmethod
+    def latest(cls, config: config_module.Config, repo_name: str) -> typing.Optional['BuildLog']:
+        """
+        Returns log of the last job of the repo, or None if there is no log.
+
+        :param config:
+        :param repo_name:
+        :return:
+        """
+        logs = sorted(cls.repo_dir(config, repo_name).glob('*.log'), key=lambda x: x.stat().st_mtime)
+        if not logs:
+            return None
+
+        return cls.for_job(config, repo_name, logs[-1].stem)
+
+    @classmethod
+    def cleanup(cls, config: config_module.Config, repo_name: str) -> None:
+        """
+        Removes logs of old jobs, so only configured number of the last jobs' logs is kept.
+
+        :param config:
+        :param repo_name:
+        :return:
+        """
+        keep = cls._settings(config).get('keep', DEFAULT_KEEP_JOBS)
+        logs = sorted(cls.repo_dir(config, repo_name).glob('*.log'), key=lambda x: x.stat().st_mtime)
+
+        for old_log in logs[:-keep] if keep else logs:
+            for path in old_log.parent.glob(f'{old_log.stem}.*'):
+                path.unlink()
+
+    @property
+    def job_id(self) -> str:
+        return self.path.stem
+
+    @property
+    def done_marker(self) -> pathlib.Path:
+        return self.path.with_suffix('.done')
+
+    @property
+    def finished(self) -> bool:
+        return self.done_marker.exists()
+
+    def _rotate(self) -> None:
+        self._file.close()
+
+        for index in range(self.backup_count - 1, 0, -1):
+            source = self.path.with_name(f'{self.path.name}.{index}')
+            if source.exists():
+                source.replace(self.path.with_name(f'{self.path.name}.{index + 1}'))
+
+        if self.backup_count > 0:
+            self.path.replace(self.path.with_name(f'{self.path.name}.1'))
+
+        self._file = self.path.open('wb')
+
+    def write(self, data: bytes) -> None:
+        """
+        Appends data to the log, rotating it when it would exceed max_bytes.
+
+        :param data:
+        :return:
+        """
+        if self._file is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._file = self.path.open('ab')
+
+        if self._file.tell() + len(data) > self.max_bytes and self._file.tell() > 0:
+            self._rotate()
+
+        self._file.write(data)
+        self._file.flush()
+
+    def close(self) -> None:
+        """
+        Closes the log and marks the job as finished.
+
+        :return:
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+        if self.path.parent.exists():
+            self.done_marker.touch()
+
+    def read(self, offset: int = 0) -> typing.Tuple[bytes, int]:
+        """
+        Reads the current log file from the offset and returns the data with offset where the reading ended.
+        If the log was rotated since the offset was obtained, it is read from the beginning.
+
+        :param offset:
+        :return:
+        """
+        try:
+            with self.path.open('rb') as f:
+                f.seek(0, 2)
+                if f.tell() < offset:
+                    offset = 0
+
+                f.seek(offset)
+                data = f.read(READ_CHUNK_SIZE)
+                return data, offset + len(data)
+        except FileNotFoundError:
+            return b'', offset
+
+    def tail(self, lines: int = 50) -> typing.Tuple[bytes, int]:
+        """
+        Returns last lines of the current log file with the offset of the end of the file.
+
+        :param lines: Number of the last lines, no lines are returned when it is not positive
+        :return:
+        """
+        try:
+            with self.path.open('rb') as f:
+                f.seek(0, 2)
+                size = f.tell()
+                if lines <= 0:
+                    return b'', size
+
+                f.seek(max(size - lines * TAIL_LINE_SIZE, 0))
+                data = f.read(size)
+        except FileNotFoundError:
+            return b'', 0
+
+        return b''.join(data.splitlines(keepends=True)[-lines:]), size
+
+    def follow(self, offset: int, poll_interval: float = FOLLOW_POLL_INTERVAL) -> typing.Iterator[bytes]:
+        """
+        Yields data appended to the log after the offset until the job finishes.
+
+        :param offset:
+        :param poll_interval:
+        :return:
+        """
+        while True:
+            finished = self.finished
+            data, offset = self.read(offset)
+
+            if data:
+                yield data
+            elif finished:
+                return
+            else:
+                time.sleep(poll_interval)
+
+
+def is_valid_job_id(job_id: str) -> bool:
+    """
+    Validates that job ID has format generated by the scheduler, so it can be safely used as part of path.
+
+    :param job_id:
+    :return:
+    """
+    return re.match(r'^[0-9a-f]{32}$', job_id) is not None
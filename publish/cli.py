@@ -1,3 +1,4 @@
+import asyncio
 import logging
 import os
 import pathlib
@@ -6,13 +7,29 @@ import traceback
 import typing
 
 import click
-import click_completion
 
-from publish import publishing, exceptions, __version__, helpers, config as config_module, \
-    ENV_NAME_PASS_EXCEPTIONS
+from publish import publishing, mirror, buildcache, buildlog, exceptions, retention, helpers, importing, \
+    config as config_module, ENV_NAME_PASS_EXCEPTIONS
 
 logger = logging.getLogger('publish.cli')
-click_completion.init()
+
+COMPLETION_ENV_NAME = '_IPFS_PUBLISH_COMPLETE'
+"""
+Name of environmental variable that is set by the shell when it asks for completions.
+"""
+
+if COMPLETION_ENV_NAME in os.environ:
+    import click_completion
+    click_completion.init()
+
+
+def print_version(ctx, param, value):
+    if not value or ctx.resilient_parsing:
+        return
+
+    from publish import __version__
+    click.echo(f'{ctx.find_root().info_name}, version {__version__}')
+    ctx.exit()
 
 
 def entrypoint(args: typing.Sequence[str], obj: typing.Optional[dict] = None):
@@ -38,7 +55,8 @@ def entrypoint(args: typing.Sequence[str], obj: typing.Optional[dict] = None):
 @click.option('--quiet', '-q', is_flag=True, help="Don't print anything")
 @click.option('--verbose', '-v', count=True, help="Prints additional info. More Vs, more info! (-vvv...)")
 @click.option('--config', '-c', type=click.Path(dir_okay=False), help="Path to specific config file")
-@click.version_option(__version__)
+@click.option('--version', is_flag=True, callback=print_version, expose_value=False, is_eager=True,
+              help='Show the version and exit.')
 @click.pass_context
 def cli(ctx, quiet, verbose, config):
     """
@@ -69,13 +87,15 @@ def cli(ctx, quiet, verbose, config):
               help='Binary which should be executed before clean up of ignored files & publishing.')
 @click.option('--after-publish-bin', '-a', help='Binary which should be executed after publishing.')
 @click.option('--publish-dir', '-d', help='Directory that should be published. Default is root of the repo.')
+@click.option('--clone-strategy', type=click.Choice(mirror.CLONE_STRATEGIES),
+              help='How the repo should be fetched and checked out. Default: full')
 @click.pass_context
 def add(ctx, **kwargs):
     """
     Command that add new repo into the list of publishing repos. The values can be either specified using
     CLI's options, or using interactive bootstrap.
 
-    If there is HTTP server running, it needs to be restarted in order the changes to be applied.
+    If there is HTTP server running, it picks up the new repo automatically.
     """
     config: config_module.Config = ctx.obj['config']
 
@@ -95,6 +115,38 @@ def add(ctx, **kwargs):
         click.echo(f'Your IPNS address: {click.style(new_repo.ipns_addr, fg="yellow")}')
 
 
+@cli.command('import', short_help='Import repos from file')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--concurrency', '-j', type=int, default=importing.DEFAULT_CONCURRENCY,
+              help=f'Number of repos validated at the same time. Default: {importing.DEFAULT_CONCURRENCY}')
+@click.pass_context
+def import_repos(ctx, path, concurrency):
+    """
+    Command that adds repos specified in TOML file, without any interactive questions. The file has 'repos'
+    array of tables with the repos' options, where only 'git_repo_url' is required, and optional 'defaults' table
+    with options for all the repos:
+
+    \b
+    [defaults]
+    republish = true
+    [[repos]]
+    git_repo_url = "https://github.com/org/site"
+    branch = "gh-pages"
+
+    All the repos are validated first and nothing is imported if any of them is invalid.
+    """
+    config: config_module.Config = ctx.obj['config']
+
+    repos = importing.import_repos(config, importing.load_specs(pathlib.Path(path)), concurrency)
+    for repo in repos:
+        config.repos[repo.name] = repo
+    config.save()
+
+    click.secho(f'\nSuccessfully imported {len(repos)} repos!', fg='green')
+    for repo in repos:
+        click.echo(f'{repo.name}: {click.style(repo.webhook_url, fg="yellow")}')
+
+
 @cli.command('list', short_help='List all enabled repos')
 @click.pass_context
 def listing(ctx):
@@ -103,8 +155,8 @@ def listing(ctx):
     """
     config = ctx.obj['config']
 
-    for repo in config.repos.values():
-        click.echo(repo.name)
+    for name in config.repos:
+        click.echo(name)
 
 
 @cli.command(short_help='Shows details for a repo')
@@ -128,7 +180,9 @@ def show(ctx, name):
     print_attribute('IPNS lifetime', repo.ipns_lifetime)
     print_attribute('IPNS ttl', repo.ipns_ttl)
     print_attribute('IPNS address', repo.ipns_addr)
+    print_attribute('Clone strategy', repo.clone_strategy)
     print_attribute('Last IPFS address', repo.last_ipfs_addr)
+    print_attribute('Last published commit', repo.last_commit_sha)
     print_attribute('Webhook address', f'{repo.webhook_url}')
 
 
@@ -155,21 +209,38 @@ def rm(ctx, name, keep_pinned=False, keep_ipns=False):
     if not keep_ipns:
         config.ipfs.key_rm(repo.ipns_key)
 
-    if not keep_pinned and repo.last_ipfs_addr:
-        config.ipfs.pin_rm(repo.last_ipfs_addr)
+    if not keep_pinned:
+        cids = [version['cid'] for version in repo.versions]
+        if repo.last_ipfs_addr and repo.last_ipfs_addr not in cids:
+            cids.append(repo.last_ipfs_addr)
+
+        settings = config['retention'] or {}
+        retention.unpin_in_batches(config.ipfs, cids,
+                                   settings.get('unpin_batch_size', retention.DEFAULT_UNPIN_BATCH_SIZE),
+                                   settings.get('unpin_pause', retention.DEFAULT_UNPIN_PAUSE))
+
+    repo.mirror.remove()
+    buildcache.BuildCache(repo.build_cache_path).remove()
+    if repo.manifest_path.exists():
+        repo.manifest_path.unlink()
 
     del config.repos[name]
     config.save()
+    config.state.remove(name)
 
     click.echo('Repo successfully removed!')
 
 
 @cli.command(short_help='Publish repo')
+@click.option('--force', '-f', is_flag=True, help='Publish even when the last published commit did not change')
 @click.argument('name')
 @click.pass_context
-def publish(ctx, name):
+def publish(ctx, name, force=False):
     """
     Will immediately publish repo based on its configuration.
+
+    When the tip of the tracked branch is the commit that was already published, the publish is skipped unless
+    the --force flag is used.
     """
     config: config_module.Config = ctx.obj['config']
     repo: publishing.GenericRepo = config.repos.get(name)
@@ -178,10 +249,53 @@ def publish(ctx, name):
         click.secho('Unknown repo!', fg='red')
         exit(1)
 
-    repo.publish_repo()
-    config.save()
+    result = asyncio.run(repo.publish_repo(force=force))
+    if result is None:
+        click.echo('The last commit is already published, skipping! Use --force to publish anyway.')
+        return
+
+    click.echo(f'Repo successfully published as {result.cid}!')
+    for node in result.nodes:
+        click.secho(f'  {node}', fg='green' if node.success else 'red')
+    if result.ipns_duration is not None:
+        click.echo(f'  IPNS published in {result.ipns_duration:.2f}s')
+
+
+@cli.command(short_help='Shows build log of a repo')
+@click.option('--job', '-j', help='ID of the job whose log should be shown. Default: the last job')
+@click.option('--lines', '-n', type=click.IntRange(min=0), default=50,
+              help='Number of the last lines to show. Default: 50')
+@click.option('--follow', '-f', is_flag=True, help='Keep printing the new output until the job finishes')
+@click.argument('name')
+@click.pass_context
+def logs(ctx, name, job=None, lines=50, follow=False):
+    """
+    Prints the output of the repo's build and after-publish binaries.
+
+    The logs are written by the publishes invoked by the server as well as by the publish command, so with the
+    --follow flag it is possible to tail a build that is currently running.
+    """
+    config: config_module.Config = ctx.obj['config']
+
+    if name not in config.repos:
+        click.secho('Unknown repo!', fg='red')
+        exit(1)
+
+    if job is not None and not buildlog.is_valid_job_id(job):
+        click.secho('Invalid job ID!', fg='red')
+        exit(1)
+
+    log = buildlog.BuildLog.for_job(config, name, job) if job else buildlog.BuildLog.latest(config, name)
+    if log is None or not log.path.exists():
+        click.secho('No log found!', fg='red')
+        exit(1)
+
+    data, offset = log.tail(lines)
+    click.echo(data, nl=False)
 
-    click.echo('Repo successfully published!')
+    if follow:
+        for data in log.follow(offset):
+            click.echo(data, nl=False)
 
 
 @cli.command(short_help='Starts HTTP server')
@@ -195,7 +309,8 @@ def server(ctx, host=None, port=None):
     Webserver expose endpoint for the Webhook calls. Republishing service serves for refreshing IPNS entry, that have
     limited lifetime.
 
-    When any configuration of the ipfs_publish is changed this command needs to be restarted.
+    The server watches the config file and applies changes of the repos' configuration without restart. Changes of
+    the global options (eq. host, port or IPFS connection) still need the restart.
     """
     from publish import http
     config: config_module.Config = ctx.obj['config']
@@ -1,19 +1,102 @@
+from __future__ import annotations
+
+import asyncio
 import logging
+import threading
+import time
 import typing
 
-import CloudFlare
-import inquirer
+from publish import exceptions, helpers, config as config_module
 
-from publish import exceptions
+CloudFlare = helpers.lazy_import('CloudFlare')
+inquirer = helpers.lazy_import('inquirer')
 
 logger = logging.getLogger('publish.cloudflare')
 
+TOKEN_VERIFY_TTL = 600
+"""
+Number of seconds for which the successful verification of the CloudFlare's token is cached.
+"""
+
+DEFAULT_RATE_LIMIT = 4.0
+"""
+Default maximal number of requests per second made to CloudFlare's API. CloudFlare allows 1200 requests per 5 minutes.
+"""
+
+DEFAULT_CONCURRENCY = 4
+"""
+Default number of concurrent requests made to CloudFlare's API.
+"""
+
+DEFAULT_BATCH_DELAY = 1.0
+"""
+Default number of seconds for which the DNS updates are collected before they are sent together.
+"""
+
+_client: typing.Optional[CloudFlare.CloudFlare] = None
+_token_verified_at: typing.Optional[float] = None
+_records_content: typing.Dict[typing.Tuple[str, str], str] = {}
+_lock = threading.Lock()
+_queue: typing.Optional['DnsUpdateQueue'] = None
+
+
+def get_client() -> CloudFlare.CloudFlare:
+    """
+    Returns CloudFlare's client shared by all the repos.
+
+    :return:
+    """
+    global _client
+
+    with _lock:
+        if _client is None:
+            _client = CloudFlare.CloudFlare()
+
+        return _client
+
+
+def is_token_verified() -> bool:
+    return _token_verified_at is not None and time.monotonic() - _token_verified_at < TOKEN_VERIFY_TTL
+
+
+def verify_token() -> None:
+    """
+    Verifies that the CloudFlare's token is valid. Successful verification is cached for TOKEN_VERIFY_TTL seconds.
+
+    :raises exceptions.PublishingException: If the token is not valid
+    :return:
+    """
+    global _token_verified_at
+
+    if is_token_verified():
+        return
+
+    try:
+        get_client().user.tokens.verify()
+    except CloudFlare.exceptions.CloudFlareAPIError:
+        raise exceptions.PublishingException('CloudFlare access not configured!')
+
+    _token_verified_at = time.monotonic()
+
+
+def clear_cache() -> None:
+    """
+    Forgets the token's verification and the known content of the DNS records.
+
+    :return:
+    """
+    global _token_verified_at
+
+    with _lock:
+        _token_verified_at = None
+        _records_content.clear()
+
 
 def bootstrap_cloudflare() -> typing.Tuple[typing.Optional[str], typing.Optional[str]]:
     if not inquirer.shortcuts.confirm('Do you want to update DNSLink on Cloudflare?', default=True):
         return None, None
 
-    cf = CloudFlare.CloudFlare()
+    cf = get_client()
     try:
         cf.user.tokens.verify()
     except CloudFlare.exceptions.CloudFlareAPIError:
@@ -45,6 +128,175 @@ def bootstrap_cloudflare() -> typing.Tuple[typing.Optional[str], typing.Optional
     return zone_id, dns_id
 
 
+class RateLimiter:
+    """
+    Token bucket that limits the number of requests per second.
+    """
+
+    rate: float = DEFAULT_RATE_LIMIT
+    """
+    Number of requests per second.
+    """
+
+    burst: int = 1
+    """
+    Number of requests that can be made at once after a pause.
+    """
+
+    def __init__(self, rate: float = DEFAULT_RATE_LIMIT, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class DnsUpdateQueue:
+    """
+    Queue of pending DNSLink updates, that are sent to CloudFlare together in batches.
+
+    Updates are collected for `batch_delay` seconds. Multiple updates of the same record are coalesced, so only
+    the last CID is written. The batch is then flushed per zone with concurrent requests, that are limited by shared
+    rate limiter, so many repos published at once do not hit CloudFlare's rate limits.
+    """
+
+    batch_delay: float = DEFAULT_BATCH_DELAY
+    """
+    Number of seconds for which the updates are collected.
+    """
+
+    def __init__(self, rate_limit: float = DEFAULT_RATE_LIMIT, concurrency: int = DEFAULT_CONCURRENCY,
+                 batch_delay: float = DEFAULT_BATCH_DELAY):
+        self.loop = asyncio.get_event_loop()
+        self.batch_delay = batch_delay
+        self._limiter = RateLimiter(rate_limit, concurrency)
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._pending: typing.Dict[typing.Tuple[str, str], typing.Tuple[str, typing.List[asyncio.Future]]] = {}
+        self._flush_task: typing.Optional[asyncio.Future] = None
+
+    @classmethod
+    def from_config(cls, config: config_module.Config) -> 'DnsUpdateQueue':
+        settings = config['cloudflare'] or {}
+        return cls(settings.get('rate_limit', DEFAULT_RATE_LIMIT), settings.get('concurrency', DEFAULT_CONCURRENCY),
+                   settings.get('batch_delay', DEFAULT_BATCH_DELAY))
+
+    def update(self, zone_id: str, dns_id: str, cid: str) -> asyncio.Future:
+        """
+        Queues update of the record's DNSLink to the CID.
+
+        :param zone_id:
+        :param dns_id:
+        :param cid:
+        :return: Future that is resolved with the written CID when the record is updated. When the update is coalesced
+                 with a later update of the same record, it is resolved with the later CID.
+        """
+        future = self.loop.create_future()
+        key = (zone_id, dns_id)
+
+        if key not in self._pending and _records_content.get(key) == f'dnslink={cid}':
+            logger.info('CloudFlare DNSLink already points to the CID, skipping')
+            future.set_result(cid)
+            return future
+
+        _, waiters = self._pending.get(key, (None, []))
+        waiters.append(future)
+        self._pending[key] = (cid, waiters)
+
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._run())
+
+        return future
+
+    async def _run(self) -> None:
+        try:
+            while self._pending:
+                await asyncio.sleep(self.batch_delay)
+
+                pending, self._pending = self._pending, {}
+                await self._flush(pending)
+        finally:
+            self._flush_task = None
+
+    async def _call(self, func: typing.Callable, *args, **kwargs) -> typing.Any:
+        await self._limiter.acquire()
+        return await self.loop.run_in_executor(None, lambda: func(*args, **kwargs))
+
+    async def _flush(self, pending: typing.Dict[typing.Tuple[str, str], typing.Tuple[str, typing.List[asyncio.Future]]]):
+        logger.info(f'Updating {len(pending)} CloudFlare DNSLink records')
+
+        try:
+            if not is_token_verified():
+                await self._call(verify_token)
+        except Exception as e:
+            for _, waiters in pending.values():
+                _resolve(waiters, error=e)
+            return
+
+        zones: typing.Dict[str, list] = {}
+        for (zone_id, dns_id), (cid, waiters) in pending.items():
+            zones.setdefault(zone_id, []).append((dns_id, cid, waiters))
+
+        await asyncio.gather(*(self._update_record(zone_id, dns_id, cid, waiters)
+                               for zone_id, records in zones.items() for dns_id, cid, waiters in records))
+
+    async def _update_record(self, zone_id: str, dns_id: str, cid: str, waiters: typing.List[asyncio.Future]) -> None:
+        content = f'dnslink={cid}'
+
+        async with self._semaphore:
+            try:
+                # Patching only the content does not need the record to be fetched first
+                await self._call(get_client().zones.dns_records.patch, zone_id, dns_id, data={'content': content})
+            except Exception as e:
+                logger.warning(f'Update of CloudFlare DNS record {dns_id} failed: {e}')
+                _resolve(waiters, error=exceptions.PublishingException(f'Update of DNSLink failed: {e}'))
+                return
+
+        with _lock:
+            _records_content[(zone_id, dns_id)] = content
+
+        _resolve(waiters, cid)
+
+
+def _resolve(waiters: typing.List[asyncio.Future], result: typing.Any = None,
+             error: typing.Optional[Exception] = None) -> None:
+    for waiter in waiters:
+        if waiter.done():
+            continue
+
+        if error is not None:
+            waiter.set_exception(error)
+        else:
+            waiter.set_result(result)
+
+
+def get_dns_queue(config: config_module.Config) -> DnsUpdateQueue:
+    """
+    Returns DNS update queue of the running event loop.
+
+    :param config:
+    :return:
+    """
+    global _queue
+
+    if _queue is None or _queue.loop is not asyncio.get_event_loop():
+        _queue = DnsUpdateQueue.from_config(config)
+
+    return _queue
+
+
 # TODO: Verify that cf.user.tokens.verify() works with Email & Token
 # TODO: Verify that ENV configured token does not leak to scripts
 class CloudFlareMixin:
@@ -63,22 +315,23 @@ class CloudFlareMixin:
         if (dns_id or zone_id) and not (dns_id and zone_id):
             raise exceptions.ConfigException('You have to set both dns_id and zone_id! Only one does not make sense.')
 
-        self.cf = CloudFlare.CloudFlare()
         self.dns_id = dns_id
         self.zone_id = zone_id
 
-    def update_dns(self, cid: str):
+    @property
+    def cf(self) -> CloudFlare.CloudFlare:
+        return get_client()
+
+    async def update_dns(self, cid: str):
+        """
+        Updates the DNSLink in the TXT record to the CID through the shared DNS update queue. When the record's last
+        known content is already the DNSLink, no request to CloudFlare is made.
+
+        :param cid:
+        :return:
+        """
         if not self.dns_id or not self.zone_id:
             raise exceptions.ConfigException('dns_id and zone_id not set. Not possible to update DNS!')
 
-        try:
-            self.cf.user.tokens.verify()
-        except CloudFlare.exceptions.CloudFlareAPIError:
-            raise exceptions.PublishingException('CloudFlare access not configured!')
-
         logger.info('Publishing new CID to CloudFlare DNSLink')
-
-        record = self.cf.zones.dns_records.get(self.zone_id, self.dns_id)
-        record['content'] = f'dnslink={cid}'
-        self.cf.zones.dns_records.put(self.zone_id, self.dns_id, data=record)
-
+        await get_dns_queue(self.config).update(self.zone_id, self.dns_id, cid)
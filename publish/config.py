@@ -1,19 +1,30 @@
+import asyncio
+import collections.abc
 import json
 import logging
 import os
 import pathlib
 import pprint
+import threading
 import typing
 
+import appdirs
 import click
-import inquirer
-import ipfshttpclient
 import toml
 
-from publish import ENV_NAME_CONFIG_PATH, exceptions, ENV_NAME_IPFS_HOST, ENV_NAME_IPFS_PORT, ENV_NAME_IPFS_MULTIADDR
+from publish import ENV_NAME_CONFIG_PATH, exceptions, ENV_NAME_IPFS_HOST, ENV_NAME_IPFS_PORT, \
+    ENV_NAME_IPFS_MULTIADDR, ENV_NAME_DATA_DIR, APP_NAME, helpers, state as state_module
+
+inquirer = helpers.lazy_import('inquirer')
+ipfshttpclient = helpers.lazy_import('ipfshttpclient')
 
 logger = logging.getLogger('publish.config')
 
+DEFAULT_WATCH_INTERVAL = 2
+"""
+Default number of seconds between checks whether the config file changed.
+"""
+
 
 class Config:
     DEFAULT_CONFIG_PATH = os.path.expanduser('~/.ipfs_publish.toml')
@@ -23,39 +34,127 @@ class Config:
             raise exceptions.ConfigException('The config was not found on this path! {}'.format(path))
 
         data = toml.load(path)
-        logger.debug(f'Loaded configuration:\n{pprint.pformat(data)}')
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f'Loaded configuration:\n{pprint.pformat(data)}')
+
         self.data, self.repos = self._load_data(data)
 
         self.loaded_path = path
+        self._loaded_signature = self._file_signature()
         self._ipfs = None
+        self._replicas = None
+        self._state = None
+        self._save_lock = threading.Lock()
+        self._migrate_state()
 
-    def _load_data(self,
-                   data):  # type: (typing.Dict[str, typing.Any]) -> typing.Tuple[dict, typing.Dict[str, publishing.Repo]]
-        from publish import publishing
-
+    def _load_data(self, data):  # type: (typing.Dict[str, typing.Any]) -> typing.Tuple[dict, RepoRegistry]
         self._verify_data(data)
-
-        repos: typing.Dict[str, publishing.GenericRepo] = {}
-        for value in data.pop('repos', {}).values():
-            repo_class = publishing.get_repo_class(value['git_repo_url'])
-            repo = repo_class.from_toml_dict(value, self)
-            repos[repo.name] = repo
-
-        return data, repos
+        return data, RepoRegistry(self, data.pop('repos', {}))
 
     def _verify_data(self, data):
         if not data.get('host') or not data.get('port'):
             raise exceptions.ConfigException('\'host\' and \'port\' are required items in configuration file!')
 
+    def _migrate_state(self):
+        # State of configs from older versions is migrated from the TOML config, which happens when the repo is built.
+        # The config is then saved without the state, so the repos are not built again on the next load.
+        names = self.repos.names_with_legacy_state()
+        if not names:
+            return
+
+        for name in names:
+            self.repos[name]
+
+        try:
+            self.save()
+        except OSError as e:
+            logger.warning(f'Config could not be saved after migration of the repos\' state: {e}')
+
     def save(self):
-        data = json.loads(json.dumps(self.data))
-        data['repos'] = {}
+        """
+        Saves the configuration into the TOML file. The file is written atomically, so it is never left partially
+        written. Runtime state of the repos is not part of the file, it is saved into the state store.
+
+        Only the repos that were built and whose configuration changed are serialized again, the rest is written
+        from the cached serialization of their tables.
+
+        :return:
+        """
+        with self._save_lock:
+            data = json.loads(json.dumps(self.data))
+            content = toml.dumps(data) + '\n' + self.repos.dumps()
+
+            tmp_path = self.loaded_path.with_name(f'.{self.loaded_path.name}.tmp')
+            with tmp_path.open('w') as f:
+                f.write(content)
+                f.flush()
+                os.fsync(f.fileno())
+
+            os.replace(str(tmp_path), str(self.loaded_path))
+            self._loaded_signature = self._file_signature()
+
+    def _file_signature(self):  # type: () -> typing.Tuple[int, int]
+        stat = self.loaded_path.stat()
+        return stat.st_mtime_ns, stat.st_size
+
+    @property
+    def is_changed(self):  # type: () -> bool
+        """
+        Whether the config file was changed since it was loaded or saved.
+
+        :return:
+        """
+        try:
+            return self._file_signature() != self._loaded_signature
+        except FileNotFoundError:
+            return False
+
+    def reload(self):  # type: () -> typing.Tuple[typing.List[str], typing.List[str], typing.List[str]]
+        """
+        Loads the config file again and applies only the differences. New repos are added, removed repos are dropped
+        and repos with changed configuration are updated in place, so running publishes keep working with them.
+        The repos' runtime state and the cached IPFS client are kept.
+
+        :raises exceptions.ConfigException: If the new config is not valid, in which case nothing is changed
+        :return: Names of added, removed and updated repos
+        """
+        signature = self._file_signature()
+        try:
+            data, repos = self._load_data(toml.load(self.loaded_path))
+
+            removed = [name for name in self.repos if name not in repos]
+            added = [name for name in repos if name not in self.repos]
+            updated = [name for name in repos if name in self.repos and repos.table(name) != self.repos.table(name)]
+
+            # Only the added and changed repos are built, which validates them before anything is changed
+            built = {name: repos[name] for name in added + updated}
+        except (toml.TomlDecodeError, KeyError, exceptions.IpfsPublishException) as e:
+            # The signature is updated, so the invalid file is not loaded again until it changes
+            self._loaded_signature = signature
+            raise exceptions.ConfigException(f'Config could not be reloaded: {e}')
+
+        for name in removed:
+            del self.repos[name]
+
+        for name, repo in built.items():
+            current = self.repos[name] if self.repos.is_built(name) else None
 
-        for repo in self.repos.values():
-            data['repos'][repo.name] = repo.to_toml_dict()
+            if current is not None and type(current) is type(repo):
+                current.update_config(repo)
+                repo = current
+            elif current is not None:
+                repo.versions = current.versions
+                for attr in state_module.STATE_ATTRIBUTES:
+                    setattr(repo, attr, getattr(current, attr))
 
-        with self.loaded_path.open('w') as f:
-            toml.dump(data, f)
+            self.repos.set_table(name, repos.table(name), repo)
+
+        if (self['ipfs'] or {}).get('replicas') != (data.get('ipfs') or {}).get('replicas'):
+            self._replicas = None
+
+        self.data = data
+        self._loaded_signature = signature
+        return added, removed, updated
 
     def __getitem__(self, item):
         return self.data.get(item)  # TODO: [Q] Is this good idea? Return None instead of KeyError?
@@ -68,33 +167,90 @@ class Config:
         return 'http://{}{}'.format(self['host'], f':{self["port"]}' if self['port'] != 80 else '')
 
     @property
-    def ipfs(self):  # type: () -> ipfshttpclient.Client
-        if self._ipfs is None:
-            if self['ipfs'] is not None:
-                host = os.environ.get(ENV_NAME_IPFS_HOST) or self['ipfs'].get('host')
-                port = os.environ.get(ENV_NAME_IPFS_PORT) or self['ipfs'].get('port')
-                multiaddr = os.environ.get(ENV_NAME_IPFS_MULTIADDR) or self['ipfs'].get('multiaddr')
-            else:
-                multiaddr = os.environ.get(ENV_NAME_IPFS_MULTIADDR)
-                host = os.environ.get(ENV_NAME_IPFS_HOST)
-                port = os.environ.get(ENV_NAME_IPFS_PORT)
+    def data_dir(self):  # type: () -> pathlib.Path
+        """
+        Directory where persistent data like repos' mirrors are stored. It is created if it does not exist.
+
+        :return:
+        """
+        path = pathlib.Path(os.environ.get(ENV_NAME_DATA_DIR) or self['data_dir'] or appdirs.user_data_dir(APP_NAME))
+        path = path.expanduser()
+        path.mkdir(parents=True, exist_ok=True)
+        return path
+
+    @property
+    def state(self):  # type: () -> state_module.StateStore
+        """
+        Store of the repos' runtime state, placed in the data directory.
+
+        :return:
+        """
+        if self._state is None:
+            self._state = state_module.StateStore(self.data_dir / state_module.STATE_FILENAME)
+
+        return self._state
 
-            # Hack to allow cross-platform Docker to reference the Docker host's machine with $HOST_ADDR
-            if host and host.startswith('$'):
-                logger.info(f'Resolving host name from environment variable {host}')
-                host = os.environ[host[1:]]
+    @property
+    def ipfs_multiaddr(self):  # type: () -> str
+        """
+        Multiaddr of the IPFS HTTP API, resolved from the environment variables and the 'ipfs' section of the config.
+
+        :return:
+        """
+        if self['ipfs'] is not None:
+            host = os.environ.get(ENV_NAME_IPFS_HOST) or self['ipfs'].get('host')
+            port = os.environ.get(ENV_NAME_IPFS_PORT) or self['ipfs'].get('port')
+            multiaddr = os.environ.get(ENV_NAME_IPFS_MULTIADDR) or self['ipfs'].get('multiaddr')
+        else:
+            multiaddr = os.environ.get(ENV_NAME_IPFS_MULTIADDR)
+            host = os.environ.get(ENV_NAME_IPFS_HOST)
+            port = os.environ.get(ENV_NAME_IPFS_PORT)
+
+        # Hack to allow cross-platform Docker to reference the Docker host's machine with $HOST_ADDR
+        if host and host.startswith('$'):
+            logger.info(f'Resolving host name from environment variable {host}')
+            host = os.environ[host[1:]]
+
+        if host == 'localhost':
+            host = '127.0.0.1'
+
+        if not multiaddr:
+            multiaddr = f'/ip4/{host}/tcp/{port}/http'
 
-            if host == 'localhost':
-                host = '127.0.0.1'
+        return multiaddr
 
-            if not multiaddr:
-                multiaddr = f'/ip4/{host}/tcp/{port}/http'
+    def connect_ipfs(self):  # type: () -> ipfshttpclient.Client
+        """
+        Creates new client with its own connection to the IPFS HTTP API.
+
+        :return:
+        """
+        return ipfshttpclient.connect(self.ipfs_multiaddr)
 
+    @property
+    def ipfs(self):  # type: () -> ipfshttpclient.Client
+        if self._ipfs is None:
+            multiaddr = self.ipfs_multiaddr
             logger.info(f'Connecting and caching to IPFS host \'{multiaddr}\'')
             self._ipfs = ipfshttpclient.connect(multiaddr)
 
         return self._ipfs
 
+    @property
+    def replicas(self):  # type: () -> replication.ReplicaPool
+        """
+        Pool of clients of the replica IPFS nodes from the 'replicas' list of the 'ipfs' section, to which the pins
+        of the published versions are replicated.
+
+        :return:
+        """
+        from publish import replication
+
+        if self._replicas is None:
+            self._replicas = replication.ReplicaPool((self['ipfs'] or {}).get('replicas') or [])
+
+        return self._replicas
+
     @classmethod
     def get_instance(cls, path=None):  # type: (typing.Optional[pathlib.Path]) -> Config
         """
@@ -138,3 +294,167 @@ class Config:
             toml.dump({'host': host, 'port': port, 'ipfs': {'multiaddr': ipfs_multiaddr }}, f)
 
         click.echo('Bootstrap successful! Let\'s continue with your original command.\n')
+
+
+class _RepoEntry:
+    __slots__ = ('table', 'repo', 'serialized')
+
+    def __init__(self, table=None, repo=None):  # type: (typing.Optional[dict], typing.Optional[publishing.GenericRepo]) -> None
+        self.table = table
+        self.repo = repo
+        self.serialized = None
+
+
+class RepoRegistry(collections.abc.MutableMapping):
+    """
+    Repos of the config indexed by their names. Repos are kept as the raw tables of the TOML config and their
+    instances are built only when they are accessed, so loading of config with thousands of repos stays fast
+    and handling of one repo does not pay for building all the others.
+
+    Serialization of every repo's table is cached, so saving of the config serializes again only the repos
+    that were built and whose configuration changed.
+    """
+
+    def __init__(self, config, tables=None):  # type: (Config, typing.Optional[typing.Dict[str, dict]]) -> None
+        self.config = config
+        self._entries: typing.Dict[str, _RepoEntry] = {}
+
+        for key, table in (tables or {}).items():
+            self._entries[table.get('name') or key] = _RepoEntry(table)
+
+    def __getitem__(self, name):  # type: (str) -> publishing.GenericRepo
+        entry = self._entries[name]
+        if entry.repo is None:
+            entry.repo = self._build(name, entry.table)
+
+        return entry.repo
+
+    def __setitem__(self, name, repo):  # type: (str, publishing.GenericRepo) -> None
+        self._entries[name] = _RepoEntry(repo=repo)
+
+    def __delitem__(self, name):  # type: (str) -> None
+        del self._entries[name]
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def is_built(self, name):  # type: (str) -> bool
+        entry = self._entries.get(name)
+        return entry is not None and entry.repo is not None
+
+    def table(self, name):  # type: (str) -> dict
+        """
+        Returns the repo's table as it was loaded from or last saved to the TOML config.
+
+        :param name:
+        :return:
+        """
+        entry = self._entries[name]
+        if entry.table is None:
+            entry.table = entry.repo.to_toml_dict()
+
+        return entry.table
+
+    def set_table(self, name, table, repo=None):  # type: (str, dict, typing.Optional[publishing.GenericRepo]) -> None
+        """
+        Replaces the repo's table (and its instance, if it was already built) with new one, eq. after reload.
+
+        :param name:
+        :param table:
+        :param repo:
+        :return:
+        """
+        self._entries[name] = _RepoEntry(table, repo)
+
+    def names_with_legacy_state(self):  # type: () -> typing.List[str]
+        """
+        Returns names of repos whose tables contain runtime state saved by older versions into the TOML config.
+
+        :return:
+        """
+        legacy_keys = set(state_module.STATE_ATTRIBUTES) | {'versions'}
+
+        names = []
+        for name, entry in self._entries.items():
+            if entry.table is None:
+                continue
+
+            keys = set(entry.table)
+            for value in entry.table.values():
+                if isinstance(value, dict):
+                    keys.update(value)
+
+            if keys & legacy_keys:
+                names.append(name)
+
+        return names
+
+    def dumps(self):  # type: () -> str
+        """
+        Serializes all the repos into the TOML config's 'repos' tables.
+
+        :return:
+        """
+        fragments = []
+        for name, entry in self._entries.items():
+            if entry.repo is not None:
+                table = entry.repo.to_toml_dict()
+                if table != entry.table:
+                    entry.table = table
+                    entry.serialized = None
+
+            if entry.serialized is None:
+                entry.serialized = toml.dumps({'repos': {name: entry.table}})
+
+            fragments.append(entry.serialized)
+
+        return '\n'.join(fragments)
+
+    def _build(self, name, table):  # type: (str, dict) -> publishing.GenericRepo
+        from publish import publishing
+
+        if 'git_repo_url' not in table:
+            raise exceptions.ConfigException(f'Repo \'{name}\' does not have \'git_repo_url\'!')
+
+        repo_class = publishing.get_repo_class(table['git_repo_url'])
+        repo = repo_class.from_toml_dict(table, self.config)
+
+        repo_state = self.config.state.load(name)
+        if repo_state is not None:
+            repo.load_state(repo_state)
+        elif repo.has_state:
+            logger.info(f'Migrating state of repo \'{name}\' into the state store')
+            repo.save_state()
+
+        return repo
+
+
+async def watch(config: Config, interval: float = DEFAULT_WATCH_INTERVAL) -> None:
+    """
+    Watches the config file and reloads the config when it changes, until cancelled. The reload is run in the event
+    loop's executor, so the requests are served while large config is parsed.
+
+    :param config:
+    :param interval: Number of seconds between the checks
+    :return:
+    """
+    loop = asyncio.get_event_loop()
+    while True:
+        await asyncio.sleep(interval)
+
+        if not config.is_changed:
+            continue
+
+        try:
+            added, removed, updated = await loop.run_in_executor(None, config.reload)
+        except exceptions.ConfigException as e:
+            logger.error(f'{e}, keeping the previous configuration')
+            continue
+
+        logger.info(f'Config reloaded, added repos: {added}, removed repos: {removed}, updated repos: {updated}')
@@ -20,6 +20,13 @@ class RepoException(IpfsPublishException):
     pass
 
 
+class BuildCancelledException(RepoException):
+    """
+    Exception raised when the repo's build was cancelled, because newer publish superseded it.
+    """
+    pass
+
+
 class PublishingException(IpfsPublishException):
     """
     Exception related to anything which goes wrong during publishing of repo.
@@ -32,3 +39,10 @@ class HttpException(IpfsPublishException):
     Exception related to handling HTTP requests.
     """
     pass
+
+
+class QueueFullException(IpfsPublishException):
+    """
+    Exception raised when the publishing queue is full and no more publishes can be accepted.
+    """
+    pass
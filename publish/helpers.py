@@ -1,6 +1,8 @@
+import importlib.util
 import logging
 import os
 import sys
+import types
 
 #######################################################################
 # Logging
@@ -58,6 +60,28 @@ def setup_logging(verbosity: int) -> None:
 #######################################################################
 # Misc
 
+def lazy_import(name: str) -> types.ModuleType:
+    """
+    Returns module that is executed only when its attribute is accessed for the first time. Used for the heavy
+    dependencies, so commands that do not need them start fast.
+
+    Modules that use it have to postpone evaluation of annotations, otherwise the annotations load the module.
+
+    :param name:
+    :return:
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
 def flatten(obj: dict):
     """
     Flatten nested dictionaries, it does not namespace the keys, so possible
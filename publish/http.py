@@ -4,16 +4,43 @@ import logging
 import sys
 import typing
 
-from quart import Quart, request, abort
+from quart import Quart, request, abort, jsonify
 from quart.json import dumps
 
-from publish import config as config_module, publishing, exceptions
+from publish import config as config_module, publishing, exceptions, jobs, buildlog, mirror, republishing, retention
 
 app = Quart(__name__)
 logging.basicConfig(stream=sys.stderr, level=logging.DEBUG)
 
 logger = logging.getLogger('publish.http')
 
+DEFAULT_WAIT_TIMEOUT = 60
+"""
+Default number of seconds the job's wait endpoint waits for the job to finish.
+"""
+
+MAX_WAIT_TIMEOUT = 300
+"""
+Maximal number of seconds the job's wait endpoint waits for the job to finish.
+"""
+
+_background_tasks: typing.List[asyncio.Future] = []
+
+
+@app.before_serving
+async def start_background_tasks():
+    config = config_module.Config.get_instance()
+    _background_tasks.append(asyncio.ensure_future(retention.run_gc_schedule(config)))
+    _background_tasks.append(asyncio.ensure_future(republishing.Republisher.from_config(config).run()))
+    _background_tasks.append(asyncio.ensure_future(
+        config_module.watch(config, config['watch_interval'] or config_module.DEFAULT_WATCH_INTERVAL)))
+
+
+@app.after_serving
+async def stop_background_tasks():
+    while _background_tasks:
+        _background_tasks.pop().cancel()
+
 
 @app.route('/publish/<repo_name>', methods=['POST'])
 async def publish_endpoint(repo_name):
@@ -30,10 +57,192 @@ async def publish_endpoint(repo_name):
     repo = config.repos[repo_name]
     handler = handler_dispatcher(repo)
 
-    resp = await handler.handle_request(request)
+    return await handler.handle_request(request)
+
+
+def get_authorized_repo(repo_name: typing.Optional[str]) -> publishing.GenericRepo:
+    """
+    Returns the repo, when the request has the repo's secret as 'secret' GET argument, otherwise aborts the request.
+
+    :param repo_name:
+    :return:
+    """
+    config = config_module.Config.get_instance()
+    if repo_name is None or repo_name not in config.repos:
+        abort(400)
+
+    repo = config.repos[repo_name]
+    if not hmac.compare_digest(request.args.get('secret', ''), repo.secret or ''):
+        logger.warning(f'Request for repo \'{repo_name}\' did not have valid secret parameter!')
+        abort(403)
+
+    return repo
+
+
+@app.route('/logs/<repo_name>', methods=['GET'])
+async def logs_endpoint(repo_name):
+    """
+    Endpoint that returns tail of the repo's build log. It requires the repo's secret as 'secret' GET argument.
+
+    Optional GET arguments are 'job' with ID of the job (default is the last job), 'lines' with number of the last
+    lines to return and 'follow', that streams the new output until the job finishes.
+
+    :param repo_name:
+    :return:
+    """
+    config = config_module.Config.get_instance()
+    get_authorized_repo(repo_name)
+
+    job_id = request.args.get('job')
+    if job_id is not None and not buildlog.is_valid_job_id(job_id):
+        abort(400)
+
+    try:
+        lines = int(request.args.get('lines', 50))
+    except ValueError:
+        abort(400)
+
+    if lines < 0:
+        abort(400)
+
+    log = buildlog.BuildLog.for_job(config, repo_name, job_id) if job_id else buildlog.BuildLog.latest(config, repo_name)
+    if log is None or not log.path.exists():
+        abort(404)
+
+    data, offset = log.tail(lines)
+    headers = {'Content-Type': 'text/plain; charset=utf-8'}
+
+    if 'follow' not in request.args:
+        return data, 200, headers
+
+    async def stream(data, offset):
+        yield data
+
+        while True:
+            finished = log.finished
+            data, offset = log.read(offset)
+
+            if data:
+                yield data
+            elif finished:
+                return
+            else:
+                await asyncio.sleep(buildlog.FOLLOW_POLL_INTERVAL)
+
+    return stream(data, offset), 200, headers
+
+
+@app.route('/jobs', methods=['GET'])
+async def jobs_endpoint():
+    """
+    Endpoint that lists the repo's queued (in the expected order of start), running and recently finished (the newest
+    first) publishing jobs. It requires the repo's name as 'repo' and its secret as 'secret' GET arguments.
+
+    :return:
+    """
+    repo = get_authorized_repo(request.args.get('repo'))
+    scheduler = jobs.get_scheduler()
+
+    def records(job_list: typing.Iterable[jobs.Job]) -> typing.List[dict]:
+        return [job.to_dict() for job in job_list if job.repo.name == repo.name]
+
+    return jsonify({
+        'queued': records(sorted(scheduler.queued, key=lambda x: (x.finish_tag, x.submitted_at))),
+        'running': records(scheduler.running.values()),
+        'finished': records(reversed(scheduler.finished)),
+    })
+
+
+@app.route('/jobs/history', methods=['GET'])
+async def jobs_history_endpoint():
+    """
+    Endpoint that returns the persistent history of the repo's finished jobs, the newest first. It requires the repo's
+    name as 'repo' and its secret as 'secret' GET arguments, optional GET argument 'limit' is number of the returned
+    jobs.
+
+    :return:
+    """
+    repo = get_authorized_repo(request.args.get('repo'))
+    scheduler = jobs.get_scheduler()
+    if scheduler.store is None:
+        abort(404)
+
+    try:
+        limit = int(request.args.get('limit', 20))
+    except ValueError:
+        abort(400)
+
+    loop = asyncio.get_event_loop()
+    records = await loop.run_in_executor(None, scheduler.store.load_jobs, repo.name, limit)
+    return jsonify({'jobs': records})
+
+
+async def get_authorized_job(job_id: str) -> typing.Tuple[typing.Optional[jobs.Job], dict]:
+    """
+    Returns the job (None when it is only in the persistent history) and its record, when the request has secret
+    of the job's repo as 'secret' GET argument, otherwise aborts the request.
+
+    :param job_id:
+    :return:
+    """
+    if not buildlog.is_valid_job_id(job_id):
+        abort(400)
+
+    scheduler = jobs.get_scheduler()
+    job = scheduler.get_job(job_id)
+    if job is not None:
+        record = job.to_dict()
+    elif scheduler.store is not None:
+        record = await asyncio.get_event_loop().run_in_executor(None, scheduler.store.load_job, job_id)
+    else:
+        record = None
+
+    if record is None or record['repo'] not in config_module.Config.get_instance().repos:
+        abort(404)
 
-    config.save()
-    return resp
+    get_authorized_repo(record['repo'])
+    return job, record
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+async def job_endpoint(job_id):
+    """
+    Endpoint that returns the job's status, stage, timings and the published CID. It requires secret of the job's
+    repo as 'secret' GET argument.
+
+    :param job_id:
+    :return:
+    """
+    _, record = await get_authorized_job(job_id)
+    return jsonify(record)
+
+
+@app.route('/jobs/<job_id>/wait', methods=['GET'])
+async def job_wait_endpoint(job_id):
+    """
+    Endpoint that waits until the job finishes and returns its record. It requires secret of the job's repo
+    as 'secret' GET argument. Optional GET argument 'timeout' is number of seconds to wait (at most MAX_WAIT_TIMEOUT),
+    when the job does not finish in time, its current record is returned with 202 status.
+
+    :param job_id:
+    :return:
+    """
+    try:
+        timeout = min(float(request.args.get('timeout', DEFAULT_WAIT_TIMEOUT)), MAX_WAIT_TIMEOUT)
+    except ValueError:
+        abort(400)
+
+    job, record = await get_authorized_job(job_id)
+    if job is None or job.status in jobs.FINISHED_STATUSES:
+        return jsonify(record)
+
+    try:
+        # Shielded, so the timeout does not cancel the job's future that others may wait for
+        await asyncio.wait_for(asyncio.shield(job.done), timeout)
+    except asyncio.TimeoutError:
+        return jsonify(job.to_dict()), 202
+
+    return jsonify(job.to_dict())
 
 
 def handler_dispatcher(repo: typing.Union[publishing.GenericRepo, publishing.GithubRepo]) -> 'GenericHandler':
@@ -60,19 +269,29 @@ class GenericHandler:
     def __init__(self, repo: publishing.GenericRepo):
         self.repo = repo
 
-    async def handle_request(self, req: request) -> str:
+    def enqueue_publish(self, commit: typing.Optional[str] = None) -> jobs.Job:
+        """
+        Enqueues the repo's publish into the scheduler.
+
+        :param commit: SHA of the commit that should be published, if None the tip of the tracked branch is published
+        :return:
+        """
+        try:
+            return jobs.get_scheduler().submit(self.repo, commit)
+        except exceptions.QueueFullException as e:
+            logger.warning(str(e))
+            abort(503)
+
+    async def handle_request(self, req: request):
         secret = req.args.get('secret')
 
-        if secret != self.repo.secret:
+        if not hmac.compare_digest(secret or '', self.repo.secret or ''):
             logger.warning(f'Request for generic repo \'{self.repo.name}\' did not have valid secret parameter!')
             abort(403)
 
-        loop = asyncio.get_event_loop()
+        job = self.enqueue_publish()
 
-        # noinspection PyAsyncCall
-        loop.run_in_executor(None, self.repo.publish_repo)
-
-        return 'OK'
+        return jsonify({'job_id': job.id, 'status': job.status})
 
 
 class GithubHandler(GenericHandler):
@@ -93,7 +312,7 @@ class GithubHandler(GenericHandler):
 
         return True
 
-    async def handle_request(self, req: request) -> str:
+    async def handle_request(self, req: request):
         header_signature = req.headers.get('X-Hub-Signature')
         if header_signature is None:
             logger.warning(f'Request for GitHub repo \'{self.repo.name}\' did not have X-Hub-Signature header!')
@@ -108,6 +327,11 @@ class GithubHandler(GenericHandler):
             logger.warning(f'Request for GitHub repo \'{self.repo.name}\' did not have valid signature!')
             abort(403)
 
+        delivery_id = req.headers.get('X-GitHub-Delivery')
+        if jobs.get_scheduler().is_duplicate(self.repo, delivery_id):
+            logger.info(f'Request for GitHub repo \'{self.repo.name}\' is repeated delivery - ignoring it')
+            return jsonify({'job_id': None, 'status': jobs.STATUS_SKIPPED})
+
         # Ping-Pong messages
         event = req.headers.get('X-GitHub-Event', 'ping')
         if event == 'ping':
@@ -117,21 +341,37 @@ class GithubHandler(GenericHandler):
             logger.warning(f'Request for GitHub repo \'{self.repo.name}\' was not result of push event!')
             abort(501)
 
-        if self.repo.branch:
-            if request.is_json:
-                data = await request.get_json()
-            else:
-                data = await request.form
-
-            expected_ref = f'refs/heads/{self.repo.branch}'
-            if data['ref'] != expected_ref:
-                logger.debug(f'Received push-event for \'{self.repo.name}\', but for branch \'{data["ref"]}\' '
+        if request.is_json:
+            data = await request.get_json()
+        else:
+            data = await request.form
+
+        ref = data.get('ref', '')
+        if not ref.startswith('refs/heads/'):
+            logger.debug(f'Received push-event for \'{self.repo.name}\', but for \'{ref}\' which is not a branch '
+                         f'- ignoring the event')
+            abort(204, 'Everything OK, but the push was not to a branch. Build skipped.')
+
+        branch = self.repo.branch or (data.get('repository') or {}).get('default_branch')
+        if branch:
+            expected_ref = f'refs/heads/{branch}'
+            if ref != expected_ref:
+                logger.debug(f'Received push-event for \'{self.repo.name}\', but for branch \'{ref}\' '
                              f'instead of expected \'{expected_ref}\' - ignoring the event')
                 abort(204, 'Everything OK, but not following this branch. Build skipped.')
 
-        loop = asyncio.get_event_loop()
+        if data.get('deleted'):
+            logger.debug(f'Received push-event for \'{self.repo.name}\' that deleted the branch - ignoring the event')
+            abort(204, 'Everything OK, but the branch was deleted. Build skipped.')
+
+        commit = data.get('after')
+        if not mirror.is_commit_sha(commit):
+            commit = None
+        elif commit == self.repo.last_commit_sha:
+            logger.info(f'Commit {commit} of repo \'{self.repo.name}\' is already published - ignoring the event')
+            return jsonify({'job_id': None, 'status': jobs.STATUS_SKIPPED})
 
-        # noinspection PyAsyncCall
-        loop.run_in_executor(None, self.repo.publish_repo)
+        job = self.enqueue_publish(commit)
+        jobs.get_scheduler().remember_delivery(self.repo, delivery_id)
 
-        return 'OK'
+        return jsonify({'job_id': job.id, 'status': job.status})
@@ -0,0 +1,213 @@
+import logging
+import os
+import pathlib
+import re
+import shutil
+import typing
+
+logger = logging.getLogger('publish.ignore')
+
+
+def _translate_class(pattern: str, index: int) -> typing.Tuple[str, int]:
+    """
+    Translates bracket expression starting at the index into regex and returns it with index after its end.
+    If the bracket is not closed, it is treated as a literal.
+
+    :param pattern:
+    :param index: Index of the opening bracket
+    :return:
+    """
+    end = index + 1
+    if end < len(pattern) and pattern[end] in '!^':
+        end += 1
+    if end < len(pattern) and pattern[end] == ']':
+        end += 1
+
+    end = pattern.find(']', end)
+    if end == -1:
+        return re.escape('['), index + 1
+
+    content = pattern[index + 1:end]
+    negated = content[0] in '!^'
+    if negated:
+        content = content[1:]
+
+    content = ''.join(char if char == '-' else re.escape(char) for char in content)
+
+    # Character classes must never match the path separator
+    if negated:
+        content = '^/' + content
+
+    return f'[{content}]', end + 1
+
+
+def translate(pattern: str) -> str:
+    """
+    Translates gitignore's pattern (without negation and trailing slash) into regex that matches POSIX paths
+    relative to the root of the repo.
+
+    :param pattern:
+    :return:
+    """
+    anchored = '/' in pattern
+    if pattern.startswith('/'):
+        pattern = pattern[1:]
+
+    parts = []
+    index, length = 0, len(pattern)
+    while index < length:
+        char = pattern[index]
+
+        if char == '*':
+            stars_end = index
+            while stars_end < length and pattern[stars_end] == '*':
+                stars_end += 1
+
+            is_component_start = index == 0 or pattern[index - 1] == '/'
+            if stars_end - index == 2 and is_component_start and stars_end == length:
+                parts.append('.*')
+            elif stars_end - index == 2 and is_component_start and pattern[stars_end] == '/':
+                parts.append('(?:.*/)?')
+                stars_end += 1
+            else:
+                parts.append('[^/]*')
+
+            index = stars_end
+        elif char == '?':
+            parts.append('[^/]')
+            index += 1
+        elif char == '[':
+            regex, index = _translate_class(pattern, index)
+            parts.append(regex)
+        elif char == '\\' and index + 1 < length:
+            parts.append(re.escape(pattern[index + 1]))
+            index += 2
+        else:
+            parts.append(re.escape(char))
+            index += 1
+
+    regex = ''.join(parts)
+    return regex if anchored else f'(?:.*/)?{regex}'
+
+
+class IgnoreMatcher:
+    """
+    Matcher of paths compiled from the gitignore-style patterns of the ignore file.
+
+    All patterns are compiled into single regex (one for files and one for directories, as patterns with trailing
+    slash match only directories), where the patterns are alternated in reverse order. Hence the first alternative
+    that matches the path is the last matching pattern of the file, which decides if the path is ignored or
+    re-included by negation.
+    """
+
+    patterns: typing.List[str] = None
+    """
+    Patterns of the ignore file, without empty lines and comments.
+    """
+
+    def __init__(self, lines: typing.Iterable[str]):
+        self.patterns = []
+        self._negated = []
+        file_regexes = []
+        dir_regexes = []
+
+        for line in lines:
+            pattern = self._clean_line(line)
+            if not pattern:
+                continue
+
+            negated = pattern.startswith('!')
+            if negated:
+                pattern = pattern[1:]
+            elif pattern.startswith('\\!') or pattern.startswith('\\#'):
+                pattern = pattern[1:]
+
+            dir_only = pattern.endswith('/')
+            pattern = pattern.rstrip('/')
+            if not pattern:
+                continue
+
+            regex = f'(?P<p{len(self._negated)}>{translate(pattern)})'
+            self.patterns.append(line.strip())
+            self._negated.append(negated)
+
+            dir_regexes.append(regex)
+            if not dir_only:
+                file_regexes.append(regex)
+
+        self._file_regex = self._compile(file_regexes)
+        self._dir_regex = self._compile(dir_regexes)
+
+    @classmethod
+    def from_file(cls, path: pathlib.Path) -> 'IgnoreMatcher':
+        return cls(path.read_text().splitlines())
+
+    @staticmethod
+    def _clean_line(line: str) -> typing.Optional[str]:
+        """
+        Strips the line's trailing whitespaces (unless escaped) and returns None for comments.
+
+        :param line:
+        :return:
+        """
+        if line.startswith('#'):
+            return None
+
+        stripped = line.rstrip()
+        if stripped.endswith('\\') and len(stripped) < len(line):
+            stripped += line[len(stripped)]
+
+        return stripped
+
+    @staticmethod
+    def _compile(regexes: typing.List[str]) -> typing.Optional[typing.Pattern]:
+        if not regexes:
+            return None
+
+        return re.compile('|'.join(reversed(regexes)), re.DOTALL)
+
+    def match(self, path: str, is_dir: bool = False) -> bool:
+        """
+        Returns whether the path is ignored.
+
+        :param path: POSIX path relative to the root of the repo
+        :param is_dir: Whether the path is directory
+        :return:
+        """
+        regex = self._dir_regex if is_dir else self._file_regex
+        if regex is None:
+            return False
+
+        result = regex.fullmatch(path)
+        if result is None:
+            return False
+
+        return not self._negated[int(result.lastgroup[1:])]
+
+    def remove_ignored(self, root: pathlib.Path) -> None:
+        """
+        Walks the directory once and removes all ignored files and directories. Ignored directories are removed
+        as whole without descending into them, hence (same as with gitignore) their content can't be re-included.
+
+        Symlinks are never followed, they are removed as files, so nothing outside of the root can be removed.
+
+        :param root:
+        :return:
+        """
+        stack = ['']
+        while stack:
+            relative_dir = stack.pop()
+
+            with os.scandir(root / relative_dir) as entries:
+                for entry in entries:
+                    relative_path = relative_dir + entry.name
+                    is_dir = entry.is_dir(follow_symlinks=False)
+
+                    if self.match(relative_path, is_dir):
+                        logger.debug(f'Removing ignored path {relative_path}')
+                        if is_dir:
+                            shutil.rmtree(entry.path)
+                        else:
+                            pathlib.Path(entry.path).unlink()
+                    elif is_dir:
+                        stack.append(relative_path + '/')
@@ -0,0 +1,143 @@
+import concurrent.futures
+import logging
+import pathlib
+import typing
+
+import toml
+
+from publish import publishing, exceptions, IPNS_KEYS_NAME_PREFIX, config as config_module
+
+logger = logging.getLogger('publish.importing')
+
+DEFAULT_CONCURRENCY = 8
+"""
+Default number of repos that are validated at the same time.
+"""
+
+SPEC_KEYS = (set(publishing.GenericRepo._TOML_MAPPING) - {'ipns_addr'}) | {'ipns', 'ipns_ttl'}
+"""
+Keys allowed in the repo's spec, besides the repo's options there is 'ipns' flag that disables IPNS publishing.
+"""
+
+RepoSpec = typing.Dict[str, typing.Any]
+"""
+Specification of imported repo, dict with the repo's options, only 'git_repo_url' is required.
+"""
+
+
+def load_specs(path: pathlib.Path) -> typing.List[RepoSpec]:
+    """
+    Loads the repos' specs from TOML file with 'repos' array of tables. Values of the optional 'defaults' table
+    are used for the options that are not specified by the repo's spec.
+
+    :param path:
+    :return:
+    """
+    try:
+        data = toml.load(path)
+    except toml.TomlDecodeError as e:
+        raise exceptions.ConfigException(f'Repos file {path} is not valid TOML: {e}')
+
+    repos = data.get('repos')
+    if not isinstance(repos, list):
+        raise exceptions.ConfigException(f'Repos file {path} does not have \'repos\' array of tables!')
+
+    defaults = data.get('defaults', {})
+    return [dict(defaults, **spec) for spec in repos]
+
+
+def validate_spec(spec: RepoSpec) -> RepoSpec:
+    """
+    Validates the spec, including the access to the Git repo and existence of its branch, and returns it with
+    resolved name, branch and IPNS key.
+
+    :param spec:
+    :raises exceptions.RepoException: If the spec is not valid
+    :return:
+    """
+    unknown = set(spec) - SPEC_KEYS
+    if unknown:
+        raise exceptions.RepoException(f'Unknown options: {", ".join(sorted(unknown))}')
+
+    spec = dict(spec)
+    url = spec.get('git_repo_url')
+    if not url or not publishing.validate_url(url):
+        raise exceptions.RepoException(f'Invalid Git repo URL \'{url}\'!')
+
+    spec['name'] = (spec.get('name') or publishing.get_name_from_url(url)).lower()
+
+    refs = publishing.ls_remote(url)
+    spec['branch'] = spec.get('branch') or publishing.get_default_branch(url)
+    if spec['branch'] not in refs.branches:
+        raise exceptions.RepoException(f'Branch \'{spec["branch"]}\' does not exist!')
+
+    for option in ('ipns_lifetime', 'ipns_ttl'):
+        if option in spec and not publishing.validate_time_span(spec[option]):
+            raise exceptions.RepoException(f'Invalid {option} \'{spec[option]}\'! Supported units are: h(our), '
+                                           f'm(inute), s(seconds)!')
+
+    if spec.pop('ipns', True):
+        spec.setdefault('ipns_key', f'{IPNS_KEYS_NAME_PREFIX}_{spec["name"]}')
+    elif 'ipns_key' in spec:
+        raise exceptions.RepoException('IPNS key is specified for repo with disabled IPNS!')
+
+    if spec.get('ipns_key') is None and not spec.get('after_publish_bin') and not spec.get('zone_id'):
+        raise exceptions.RepoException('Repo does not publish to IPNS, does not update DNSLink on CloudFlare and does '
+                                       'not have after publish binary!')
+
+    return spec
+
+
+def import_repos(config: config_module.Config, specs: typing.Sequence[RepoSpec],
+                 concurrency: int = DEFAULT_CONCURRENCY) -> typing.List[publishing.GenericRepo]:
+    """
+    Creates repos from the specs. The specs are validated concurrently and when all of them are valid, IPNS keys
+    for all the repos are generated. Nothing is created when some of the specs is invalid.
+
+    The repos are not added to the config, so it can be saved once with all of them.
+
+    :param config:
+    :param specs:
+    :param concurrency: Number of the specs that are validated at the same time
+    :raises exceptions.RepoException: With errors of all the invalid specs
+    :return:
+    """
+
+    def validate(spec: RepoSpec) -> typing.Union[RepoSpec, exceptions.IpfsPublishException]:
+        try:
+            return validate_spec(spec)
+        except exceptions.IpfsPublishException as e:
+            return e
+
+    logger.info(f'Validating {len(specs)} repos')
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(validate, specs))
+
+    errors = []
+    names = set()
+    repos = []
+    for index, (spec, result) in enumerate(zip(specs, results), start=1):
+        if isinstance(result, exceptions.IpfsPublishException):
+            errors.append(f'Repo #{index} ({spec.get("git_repo_url")}): {str(result).strip()}')
+        elif result['name'] in names or not publishing.validate_name(result['name'], config):
+            errors.append(f'Repo #{index} ({spec.get("git_repo_url")}): Repo with name \'{result["name"]}\' '
+                          f'already exists!')
+        else:
+            names.add(result['name'])
+
+            # The repos are built before the IPNS keys are generated, as building validates the rest of the options
+            try:
+                repo_class = publishing.get_repo_class(result['git_repo_url'])
+                secret = result.pop('secret', None) or publishing.generate_secret()
+                repos.append(repo_class(config=config, secret=secret, **result))
+            except exceptions.IpfsPublishException as e:
+                errors.append(f'Repo #{index} ({spec.get("git_repo_url")}): {str(e).strip()}')
+
+    if errors:
+        raise exceptions.RepoException('Repos were not imported, some of them are invalid:\n' + '\n'.join(errors))
+
+    ipns_addrs = publishing.generate_ipns_keys(config, [repo.ipns_key for repo in repos if repo.ipns_key], concurrency)
+    for repo in repos:
+        repo.ipns_addr = ipns_addrs.get(repo.ipns_key)
+
+    return repos
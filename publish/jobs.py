@@ -0,0 +1,376 @@
+import asyncio
+import collections
+import itertools
+import logging
+import sqlite3
+import time
+import typing
+import uuid
+
+from publish import publishing, replication, exceptions, config as config_module, state as state_module
+
+logger = logging.getLogger('publish.jobs')
+
+DELIVERIES_HISTORY_SIZE = 100
+"""
+Number of last webhook's delivery IDs remembered per repo, in order to drop repeated deliveries.
+"""
+
+DEFAULT_CONCURRENCY = 4
+"""
+Default maximal number of publishes that run at the same time.
+"""
+
+DEFAULT_MAX_QUEUED = 100
+"""
+Default maximal number of publishes that wait in the queue.
+"""
+
+DEFAULT_JOB_COST = 60.0
+"""
+Estimated duration of publish (in seconds) for repos that were not published yet by the scheduler.
+"""
+
+COST_SMOOTHING = 0.3
+"""
+Smoothing factor of the exponential moving average of publishes' durations, that estimates cost of the repo's publish.
+"""
+
+DEFAULT_RECENT_JOBS = 100
+"""
+Default number of the last finished jobs kept in memory.
+"""
+
+DEFAULT_HISTORY_SIZE = 1000
+"""
+Default number of the last finished jobs kept in the persistent history.
+"""
+
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_FINISHED = 'finished'
+STATUS_FAILED = 'failed'
+STATUS_CANCELLED = 'cancelled'
+STATUS_SKIPPED = 'skipped'
+
+FINISHED_STATUSES = (STATUS_FINISHED, STATUS_FAILED, STATUS_CANCELLED, STATUS_SKIPPED)
+
+
+class Job:
+    """
+    One publish of a repo handled by the Scheduler.
+    """
+
+    id: str = None
+    """
+    Unique identifier of the job.
+    """
+
+    repo: publishing.GenericRepo = None
+    """
+    Repo that is published by the job.
+    """
+
+    commit: typing.Optional[str] = None
+    """
+    SHA of the commit that should be published, if None the tip of the repo's tracked branch is published.
+    """
+
+    status: str = STATUS_QUEUED
+    """
+    Current status of the job, one of STATUS_* constants.
+    """
+
+    start_tag: float = 0.0
+    finish_tag: float = 0.0
+    """
+    Virtual start and finish times of the job used for weighted fair queuing.
+    """
+
+    def __init__(self, repo: publishing.GenericRepo, commit: typing.Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.repo = repo
+        self.commit = commit
+        self.status = STATUS_QUEUED
+        self.error: typing.Optional[str] = None
+        self.result: typing.Optional[replication.PublishResult] = None
+        self.submitted_at = time.time()
+        self.started_at: typing.Optional[float] = None
+        self.finished_at: typing.Optional[float] = None
+        self.stage: typing.Optional[str] = None
+        self.stages: typing.List[typing.Tuple[str, float]] = []
+        self.done = asyncio.get_event_loop().create_future()
+        self.superseded = asyncio.Event()
+
+    @property
+    def duration(self) -> typing.Optional[float]:
+        if self.started_at is None or self.finished_at is None:
+            return None
+
+        return self.finished_at - self.started_at
+
+    def start(self) -> None:
+        self.status = STATUS_RUNNING
+        self.started_at = time.time()
+
+    def enter_stage(self, stage: str) -> None:
+        self.stage = stage
+        self.stages.append((stage, time.time()))
+
+    def finish(self, error: typing.Optional[Exception] = None, skipped: bool = False) -> None:
+        if isinstance(error, exceptions.BuildCancelledException):
+            self.status = STATUS_CANCELLED
+        elif skipped:
+            self.status = STATUS_SKIPPED
+        else:
+            self.status = STATUS_FAILED if error is not None else STATUS_FINISHED
+
+        self.error = str(error) if error is not None else None
+        self.finished_at = time.time()
+
+        if not self.done.done():
+            self.done.set_result(self.status)
+
+    def to_dict(self) -> state_module.JobRecord:
+        """
+        Serialize the job into JSON serializable record, that is returned by the HTTP API and saved into the history.
+
+        :return:
+        """
+        stages = []
+        for index, (stage, started_at) in enumerate(self.stages):
+            ended_at = self.stages[index + 1][1] if index + 1 < len(self.stages) else self.finished_at
+            stages.append({'stage': stage, 'started_at': started_at,
+                           'duration': ended_at - started_at if ended_at is not None else None})
+
+        record = {
+            'id': self.id,
+            'repo': self.repo.name,
+            'commit': self.commit,
+            'status': self.status,
+            'stage': self.stage,
+            'error': self.error,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+            'duration': self.duration,
+            'stages': stages,
+            'cid': None,
+            'nodes': [],
+            'ipns_duration': None,
+        }
+
+        if self.result is not None:
+            record.update(commit=self.result.commit or self.commit, cid=self.result.cid,
+                          ipns_duration=self.result.ipns_duration,
+                          nodes=[{'node': node.node, 'duration': node.duration, 'error': node.error}
+                                 for node in self.result.nodes])
+
+        return record
+
+
+class Scheduler:
+    """
+    Scheduler of the repos' publishes, running inside of the HTTP server's event loop.
+
+    It limits the number of publishes running at the same time (globally) and runs at most one publish per repo.
+    Publish requests for a repo that already has a queued publish are collapsed into it. Queued publishes are
+    dispatched using weighted fair queuing, where cost of a publish is the estimated duration of the repo's publishes,
+    so repos with long builds do not starve the small ones.
+
+    When a publish is queued for a repo that is being published, the running build is cancelled as it was superseded.
+    """
+
+    concurrency: int = DEFAULT_CONCURRENCY
+    """
+    Maximal number of publishes that run at the same time.
+    """
+
+    max_queued: int = DEFAULT_MAX_QUEUED
+    """
+    Maximal number of publishes waiting in the queue, when reached new publishes are rejected.
+    """
+
+    history_size: int = DEFAULT_HISTORY_SIZE
+    """
+    Number of the last finished jobs kept in the persistent history.
+    """
+
+    def __init__(self, concurrency: int = DEFAULT_CONCURRENCY, max_queued: int = DEFAULT_MAX_QUEUED,
+                 store: typing.Optional[state_module.StateStore] = None, recent_jobs: int = DEFAULT_RECENT_JOBS,
+                 history_size: int = DEFAULT_HISTORY_SIZE):
+        if concurrency < 1:
+            raise exceptions.ConfigException('Scheduler\'s concurrency has to be at least 1!')
+
+        self.concurrency = concurrency
+        self.max_queued = max_queued
+        self.store = store
+        self.history_size = history_size
+
+        self.queued: typing.List[Job] = []
+        self.running: typing.Dict[str, Job] = {}
+        self.finished: typing.Deque[Job] = collections.deque(maxlen=recent_jobs)
+        self._virtual_time = 0.0
+        self._finish_tags: typing.Dict[str, float] = {}
+        self._costs: typing.Dict[str, float] = {}
+        self._deliveries: typing.Dict[str, typing.Deque[str]] = collections.defaultdict(
+            lambda: collections.deque(maxlen=DELIVERIES_HISTORY_SIZE))
+
+    def is_duplicate(self, repo: publishing.GenericRepo, delivery_id: typing.Optional[str]) -> bool:
+        """
+        Checks whether the webhook's delivery for the repo was already handled.
+
+        :param repo:
+        :param delivery_id:
+        :return:
+        """
+        return delivery_id is not None and delivery_id in self._deliveries[repo.name]
+
+    def remember_delivery(self, repo: publishing.GenericRepo, delivery_id: typing.Optional[str]) -> None:
+        """
+        Remembers the webhook's delivery for the repo, it should be called only once the publish was enqueued,
+        so redelivery of rejected request is not dropped.
+
+        :param repo:
+        :param delivery_id:
+        :return:
+        """
+        if delivery_id is not None and delivery_id not in self._deliveries[repo.name]:
+            self._deliveries[repo.name].append(delivery_id)
+
+    def get_job(self, job_id: str) -> typing.Optional[Job]:
+        """
+        Returns queued, running or recently finished job. Older jobs are only in the persistent history.
+
+        :param job_id:
+        :return:
+        """
+        return next((job for job in itertools.chain(self.queued, self.running.values(), self.finished)
+                     if job.id == job_id), None)
+
+    def get_queued_job(self, repo: publishing.GenericRepo) -> typing.Optional[Job]:
+        return next((job for job in self.queued if job.repo.name == repo.name), None)
+
+    def submit(self, repo: publishing.GenericRepo, commit: typing.Optional[str] = None) -> Job:
+        """
+        Enqueues publish of the repo. Has to be called from within the running event loop.
+
+        :param repo:
+        :param commit: SHA of the commit that should be published, if None the tip of the tracked branch is published
+        :raises exceptions.QueueFullException: If the queue is full
+        :return: Job of the publish, if the repo has already queued publish this job is returned
+        """
+        queued_job = self.get_queued_job(repo)
+        if queued_job is not None:
+            logger.info(f'Publish of repo \'{repo.name}\' is already queued, collapsing the requests')
+            queued_job.commit = commit
+            self._supersede_running(queued_job)
+            return queued_job
+
+        if len(self.queued) >= self.max_queued:
+            raise exceptions.QueueFullException(f'Publishing queue is full, rejecting publish of \'{repo.name}\'!')
+
+        job = Job(repo, commit)
+        job.start_tag = max(self._virtual_time, self._finish_tags.get(repo.name, 0.0))
+        job.finish_tag = job.start_tag + self._costs.get(repo.name, DEFAULT_JOB_COST) / max(repo.weight, 0.01)
+        self._finish_tags[repo.name] = job.finish_tag
+
+        logger.info(f'Queuing publish of repo \'{repo.name}\' as job {job.id}')
+        self.queued.append(job)
+
+        self._supersede_running(job)
+        self._dispatch()
+
+        return job
+
+    def _supersede_running(self, job: Job) -> None:
+        """
+        Cancels the running publish of the job's repo, unless it publishes the same commit as the job.
+
+        :param job:
+        :return:
+        """
+        running_job = self.running.get(job.repo.name)
+        if running_job is None or running_job.superseded.is_set():
+            return
+
+        if job.commit is not None and job.commit == running_job.commit:
+            return
+
+        logger.info(f'Job {running_job.id} was superseded by job {job.id}')
+        running_job.superseded.set()
+
+    def _dispatch(self) -> None:
+        """
+        Starts queued jobs with the lowest virtual finish time until the concurrency limit is reached.
+
+        :return:
+        """
+        while len(self.running) < self.concurrency:
+            candidates = [job for job in self.queued if job.repo.name not in self.running]
+            if not candidates:
+                return
+
+            job = min(candidates, key=lambda x: (x.finish_tag, x.submitted_at))
+            self.queued.remove(job)
+            self.running[job.repo.name] = job
+            self._virtual_time = max(self._virtual_time, job.start_tag)
+
+            asyncio.ensure_future(self._run(job))
+
+    async def _run(self, job: Job) -> None:
+        loop = asyncio.get_event_loop()
+        logger.info(f'Starting job {job.id} publishing repo \'{job.repo.name}\'')
+        job.start()
+
+        try:
+            job.result = await job.repo.publish_repo(cancel=job.superseded, job_id=job.id, commit=job.commit,
+                                                     stage=job.enter_stage)
+            job.finish(skipped=job.result is None)
+        except exceptions.BuildCancelledException as e:
+            logger.info(f'Build of job {job.id} was cancelled')
+            job.finish(e)
+        except Exception as e:
+            logger.exception(f'Publishing of repo \'{job.repo.name}\' failed!')
+            job.finish(e)
+        finally:
+            # Cancelled and skipped publishes would underestimate the cost of the repo's publish
+            if job.status not in (STATUS_CANCELLED, STATUS_SKIPPED) and job.duration is not None:
+                previous_cost = self._costs.get(job.repo.name)
+                self._costs[job.repo.name] = job.duration if previous_cost is None \
+                    else COST_SMOOTHING * job.duration + (1 - COST_SMOOTHING) * previous_cost
+
+            del self.running[job.repo.name]
+            self.finished.append(job)
+            self._dispatch()
+
+            if self.store is not None:
+                await loop.run_in_executor(None, self._save_record, job.to_dict())
+
+    def _save_record(self, record: state_module.JobRecord) -> None:
+        try:
+            self.store.save_job(record, self.history_size)
+        except sqlite3.Error:
+            logger.exception(f'Record of job {record["id"]} could not be saved into the history!')
+
+
+_scheduler: typing.Optional[Scheduler] = None
+
+
+def get_scheduler() -> Scheduler:
+    """
+    Returns the scheduler configured based on the 'scheduler' section of the config.
+
+    :return:
+    """
+    global _scheduler
+
+    if _scheduler is None:
+        config = config_module.Config.get_instance()
+        settings = config['scheduler'] or {}
+        _scheduler = Scheduler(settings.get('concurrency', DEFAULT_CONCURRENCY),
+                               settings.get('max_queued', DEFAULT_MAX_QUEUED), config.state,
+                               settings.get('recent_jobs', DEFAULT_RECENT_JOBS),
+                               settings.get('history_size', DEFAULT_HISTORY_SIZE))
+
+    return _scheduler
@@ -0,0 +1,249 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import typing
+
+from publish import exceptions, helpers, uploading
+
+ipfshttpclient = helpers.lazy_import('ipfshttpclient')
+
+logger = logging.getLogger('publish.manifest')
+
+MAX_CHANGED_RATIO = 0.5
+"""
+When bigger portion of the files than this ratio changed, the whole directory is added at once as patching
+the previous tree would be slower.
+"""
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path: pathlib.Path) -> str:
+    """
+    Returns SHA256 hex digest of the file's content.
+
+    :param path:
+    :return:
+    """
+    digest = hashlib.sha256()
+    with path.open('rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def scan_directory(directory: pathlib.Path) -> typing.Tuple[typing.Dict[str, os.stat_result], typing.Set[str]]:
+    """
+    Walks the directory and returns stats of all files and set of all subdirectories, both keyed with POSIX path
+    relative to the directory.
+
+    :param directory:
+    :raises exceptions.PublishingException: If symlink is found, as it can't be represented in the manifest
+    :return:
+    """
+    files = {}
+    dirs = set()
+
+    for root, dir_names, file_names in os.walk(str(directory)):
+        relative_root = pathlib.Path(root).relative_to(directory)
+
+        for name in dir_names + file_names:
+            path = pathlib.Path(root) / name
+            relative_path = (relative_root / name).as_posix()
+
+            if path.is_symlink():
+                raise exceptions.PublishingException(f'Symlinks are not supported by delta publishing: {path}')
+
+            if path.is_dir():
+                dirs.add(relative_path)
+            else:
+                files[relative_path] = path.stat()
+
+    return files, dirs
+
+
+class Manifest:
+    """
+    Persisted manifest of the last published directory. It maps every file's path (relative to the published
+    directory) to its size, mtime, content hash and CID, which allows to add to IPFS only the files that changed
+    since the last publish and patch them into the previous root directory.
+    """
+
+    path: pathlib.Path = None
+    """
+    Path where the manifest is persisted.
+    """
+
+    root: typing.Optional[str] = None
+    """
+    CID of the root directory that the manifest describes.
+    """
+
+    files: typing.Dict[str, dict] = None
+    """
+    Mapping of the files' paths to dict with 'size', 'mtime', 'hash' and 'cid' keys.
+    """
+
+    dirs: typing.Set[str] = None
+    """
+    Paths of all the directories in the published directory.
+    """
+
+    def __init__(self, path: pathlib.Path, root: typing.Optional[str] = None,
+                 files: typing.Optional[typing.Dict[str, dict]] = None, dirs: typing.Optional[typing.Set[str]] = None):
+        self.path = path
+        self.root = root
+        self.files = files or {}
+        self.dirs = dirs or set()
+
+    @classmethod
+    def load(cls, path: pathlib.Path) -> 'Manifest':
+        """
+        Loads the manifest from the path, if it does not exist (or is corrupted) empty manifest is returned.
+
+        :param path:
+        :return:
+        """
+        try:
+            data = json.loads(path.read_text())
+        except (OSError, ValueError):
+            return cls(path)
+
+        return cls(path, data.get('root'), data.get('files'), set(data.get('dirs', [])))
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix('.tmp')
+        tmp_path.write_text(json.dumps({'root': self.root, 'files': self.files, 'dirs': sorted(self.dirs)}))
+        tmp_path.replace(self.path)
+
+    def _lookup(self, relative_path: str, path: pathlib.Path, stat: os.stat_result) -> typing.Tuple[str, dict]:
+        """
+        Returns content hash of the file and its previous manifest's entry if the content did not change.
+
+        :param relative_path:
+        :param path:
+        :param stat:
+        :return:
+        """
+        entry = self.files.get(relative_path)
+        if entry is None or entry.get('cid') is None:
+            return hash_file(path), None
+
+        if entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            return entry['hash'], entry
+
+        content_hash = hash_file(path)
+        if entry['hash'] == content_hash:
+            return content_hash, entry
+
+        return content_hash, None
+
+    def add_directory(self, ipfs: ipfshttpclient.Client, directory: pathlib.Path,
+                      base_root: typing.Optional[str] = None,
+                      progress: typing.Optional[uploading.ProgressCallback] = None) -> str:
+        """
+        Adds the directory to IPFS without pinning and returns the CID of its root. The manifest is updated to
+        describe the new root.
+
+        If base_root matches the manifest's root, only the changed files are added and the new root is created by
+        patching the base root, otherwise the whole directory is added.
+
+        :param ipfs:
+        :param directory:
+        :param base_root: CID of the root that is expected to be still present in the IPFS node
+        :param progress: Callback called for every entry added to IPFS
+        :return:
+        """
+        files, dirs = scan_directory(directory)
+
+        entries = {}
+        changed = []
+        for relative_path, stat in files.items():
+            content_hash, entry = self._lookup(relative_path, directory / relative_path, stat)
+            entries[relative_path] = {'size': stat.st_size, 'mtime': stat.st_mtime, 'hash': content_hash,
+                                      'cid': entry['cid'] if entry is not None else None}
+
+            if entry is None:
+                changed.append(relative_path)
+
+        removed_files = set(self.files) - set(files)
+        changes_count = len(changed) + len(removed_files) + len(dirs ^ self.dirs)
+
+        if self.root is None or self.root != base_root \
+                or changes_count > MAX_CHANGED_RATIO * max(len(files), 1):
+            root = self._add_whole(ipfs, directory, entries, progress)
+        else:
+            logger.info(f'Delta publishing {len(changed)} changed files of {len(files)} files')
+            try:
+                root = self._patch(ipfs, directory, entries, changed, removed_files, dirs)
+            except ipfshttpclient.exceptions.Error as e:
+                logger.warning(f'Patching of the previous root failed, adding whole directory: {e}')
+                root = self._add_whole(ipfs, directory, entries, progress)
+
+        self.root = root
+        self.files = entries
+        self.dirs = dirs
+        return root
+
+    def _add_whole(self, ipfs: ipfshttpclient.Client, directory: pathlib.Path, entries: typing.Dict[str, dict],
+                   progress: typing.Optional[uploading.ProgressCallback] = None) -> str:
+        """
+        Adds the whole directory and fills the CIDs of entries from the add's response.
+
+        :param ipfs:
+        :param directory:
+        :param entries:
+        :param progress:
+        :return:
+        """
+        def fill_entry(item: dict) -> None:
+            # Names are prefixed with the name of the added directory
+            parts = item['Name'].split('/', 1)
+            if len(parts) == 2 and parts[1] in entries:
+                entries[parts[1]]['cid'] = item['Hash']
+
+            if progress is not None:
+                progress(item)
+
+        return uploading.add_directory(ipfs, directory, pin=False, progress=fill_entry)
+
+    def _patch(self, ipfs: ipfshttpclient.Client, directory: pathlib.Path, entries: typing.Dict[str, dict],
+               changed: typing.List[str], removed_files: typing.Set[str], dirs: typing.Set[str]) -> str:
+        """
+        Creates the new root by patching the manifest's root with links to the changed files.
+
+        :param ipfs:
+        :param directory:
+        :param entries:
+        :param changed:
+        :param removed_files:
+        :param dirs:
+        :return:
+        """
+        root = self.root
+
+        # Removing only the top-most removed directories, their content is removed with them
+        removed_dirs = self.dirs - dirs
+        for removed_dir in sorted(removed_dirs):
+            if pathlib.PurePosixPath(removed_dir).parent.as_posix() not in removed_dirs:
+                root = ipfs.object.patch.rm_link(root, removed_dir)['Hash']
+
+        for removed_file in sorted(removed_files):
+            if pathlib.PurePosixPath(removed_file).parent.as_posix() not in removed_dirs:
+                root = ipfs.object.patch.rm_link(root, removed_file)['Hash']
+
+        for new_dir in sorted(dirs - self.dirs):
+            root = ipfs.object.patch.add_link(root, new_dir, uploading.EMPTY_DIR_CID, create=True)['Hash']
+
+        for relative_path in changed:
+            cid = ipfs.add(directory / relative_path, pin=False)['Hash']
+            entries[relative_path]['cid'] = cid
+            root = ipfs.object.patch.add_link(root, relative_path, cid, create=True)['Hash']
+
+        return root
@@ -0,0 +1,299 @@
+from __future__ import annotations
+
+import logging
+import os
+import pathlib
+import re
+import shutil
+import subprocess
+import threading
+import typing
+
+from publish import exceptions, helpers
+
+git = helpers.lazy_import('git')
+
+logger = logging.getLogger('publish.mirror')
+
+FETCHED_REF = 'refs/ipfs_publish/head'
+"""
+Local ref inside of the mirror, that points to the last fetched commit of the tracked branch.
+"""
+
+STRATEGY_CONFIG_KEY = 'ipfspublish.strategy'
+"""
+Key in the mirror's Git config, where the clone strategy that the mirror was created with is stored.
+"""
+
+CLONE_STRATEGIES = ('full', 'shallow', 'blobless', 'sparse')
+"""
+Supported clone strategies:
+ - full: the whole history with all blobs is fetched
+ - shallow: only the tip commit of the tracked branch is fetched (eq. depth 1)
+ - blobless: the whole history is fetched without blobs, which are fetched on demand during checkout
+ - sparse: same as blobless, but only configured paths are checked out, hence only their blobs are fetched
+"""
+
+PARTIAL_CLONE_FILTER = 'blob:none'
+
+COMMIT_SHA_REGEX = re.compile(r'[0-9a-f]{40}|[0-9a-f]{64}')
+"""
+Regex of full SHA-1 or SHA-256 commit's hash.
+"""
+
+LS_REMOTE_TIMEOUT = 60
+"""
+Number of seconds after which listing of the remote's refs is aborted.
+"""
+
+
+def ls_remote(url: str, *patterns: str, symref: bool = False) -> str:
+    """
+    Runs `git ls-remote` against the remote repo and returns its output. Git is not allowed to prompt for
+    credentials, so private or unreachable remote fails instead of blocking the caller.
+
+    :param url:
+    :param patterns: Patterns of the refs that should be listed, all refs are listed when none is given
+    :param symref: Whether the symbolic refs (eq. remote's HEAD) should be listed with their targets
+    :raises exceptions.RepoException: If the remote could not be listed in time
+    :return:
+    """
+    try:
+        result = subprocess.run(['git', '-c', 'core.askpass=echo', 'ls-remote', *(['--symref'] if symref else []),
+                                 '--', url, *patterns],
+                                capture_output=True, timeout=LS_REMOTE_TIMEOUT,
+                                env=dict(os.environ, GIT_TERMINAL_PROMPT='0'))
+    except subprocess.TimeoutExpired:
+        raise exceptions.RepoException(f'Listing of the remote repo {url} timed out!')
+
+    if result.returncode != 0:
+        raise exceptions.RepoException(f'Error while listing the remote repo! {result.stderr.decode("utf-8")}')
+
+    return result.stdout.decode('utf-8')
+
+
+_locks: typing.Dict[str, threading.Lock] = {}
+_locks_guard = threading.Lock()
+
+
+def is_commit_sha(value: typing.Optional[str]) -> bool:
+    return value is not None and COMMIT_SHA_REGEX.fullmatch(value) is not None
+
+
+def _get_lock(path: pathlib.Path) -> threading.Lock:
+    """
+    Returns lock that guards the mirror on the path, so two publishes of the same repo do not fetch concurrently.
+
+    :param path:
+    :return:
+    """
+    with _locks_guard:
+        return _locks.setdefault(str(path), threading.Lock())
+
+
+class RepoMirror:
+    """
+    Persistent bare mirror of a Git repo stored in the data directory.
+
+    The mirror is created only once, for later publishes only the tracked branch is fetched into it, so the amount
+    of transferred data depends on the size of the push and not on the size of the whole repo. Working trees for
+    the publishing are checked out from the mirror as Git's worktrees, hence no objects are copied.
+    """
+
+    path: pathlib.Path = None
+    """
+    Path to the bare repo of the mirror.
+    """
+
+    url: str = None
+    """
+    URL of the remote Git repo that is mirrored.
+    """
+
+    branch: typing.Optional[str] = None
+    """
+    Tracked branch, if None the remote's default branch (eq. remote's HEAD) is tracked.
+    """
+
+    strategy: str = 'full'
+    """
+    Clone strategy of the mirror, see CLONE_STRATEGIES.
+    """
+
+    def __init__(self, path: pathlib.Path, url: str, branch: typing.Optional[str] = None, strategy: str = 'full'):
+        if strategy not in CLONE_STRATEGIES:
+            raise exceptions.ConfigException(f'Unknown clone strategy \'{strategy}\'! '
+                                             f'Supported are: {", ".join(CLONE_STRATEGIES)}')
+
+        self.path = path
+        self.url = url
+        self.branch = branch
+        self.strategy = strategy
+
+    @property
+    def exists(self) -> bool:
+        return (self.path / 'HEAD').exists()
+
+    @property
+    def is_partial(self) -> bool:
+        return self.strategy in ('blobless', 'sparse')
+
+    def _open(self) -> git.Repo:
+        """
+        Opens the mirror's repo, if the mirror does not exist yet it is initialized.
+
+        If the mirror was created with different clone strategy, it is recreated as the history of shallow
+        or partial mirror can't be simply converted.
+
+        :return:
+        """
+        if self.exists:
+            repo = git.Repo(str(self.path))
+
+            with repo.config_reader() as reader:
+                strategy = reader.get_value('ipfspublish', 'strategy', 'full')
+
+            if strategy != self.strategy:
+                logger.info(f'Clone strategy changed from \'{strategy}\' to \'{self.strategy}\', recreating mirror')
+                self.remove()
+
+        if not self.exists:
+            logger.info(f'Initializing mirror of \'{self.url}\' in {self.path}')
+            self.path.mkdir(parents=True, exist_ok=True)
+            repo = git.Repo.init(str(self.path), bare=True)
+            repo.create_remote('origin', self.url)
+            repo.git.config(STRATEGY_CONFIG_KEY, self.strategy)
+            return repo
+
+        if repo.remotes.origin.url != self.url:
+            logger.info(f'Git URL of the mirror changed, updating it to \'{self.url}\'')
+            repo.remotes.origin.set_url(self.url)
+
+        return repo
+
+    @property
+    def source_ref(self) -> str:
+        return f'refs/heads/{self.branch}' if self.branch else 'HEAD'
+
+    def remote_head(self) -> str:
+        """
+        Returns SHA of the tracked branch's tip in the remote repo, without fetching anything.
+
+        :raises exceptions.RepoException: If the remote can't be listed or the branch does not exist
+        :return:
+        """
+        for line in ls_remote(self.url, self.source_ref).splitlines():
+            sha, ref = line.split('\t', 1)
+            if ref == self.source_ref:
+                return sha
+
+        raise exceptions.RepoException(f'The remote repo does not have \'{self.source_ref}\' ref!')
+
+    def fetch(self, commit: typing.Optional[str] = None) -> str:
+        """
+        Fetches the tracked branch into the mirror and returns the SHA of the commit that should be checked out.
+
+        :param commit: Specific commit that is requested, if it is not reachable from the fetched branch (eq. the
+                       branch was force-pushed since), it is fetched directly.
+        :raises exceptions.RepoException: If the fetch failed or the commit is not valid SHA
+        :return: The requested commit if specified otherwise SHA of the branch's tip
+        """
+        if commit is not None and not is_commit_sha(commit):
+            raise exceptions.RepoException(f'\'{commit}\' is not valid commit\'s SHA!')
+
+        source = self.source_ref
+
+        with _get_lock(self.path):
+            repo = self._open()
+            logger.info(f'Fetching \'{source}\' of \'{self.url}\' into mirror {self.path}')
+
+            args = ['--no-tags']
+            if self.strategy == 'shallow':
+                args.append('--depth=1')
+            elif self.is_partial:
+                args.append(f'--filter={PARTIAL_CLONE_FILTER}')
+
+            try:
+                repo.git.fetch(*args, 'origin', f'+{source}:{FETCHED_REF}')
+
+                if commit is not None and not self._has_commit(repo, commit):
+                    logger.info(f'Commit {commit} is not part of the fetched branch, fetching it directly')
+                    repo.git.fetch(*args, 'origin', commit)
+            except git.GitCommandError as e:
+                raise exceptions.RepoException(f'Error while fetching the repo into its mirror! {e.stderr}')
+
+            return commit or repo.git.rev_parse(FETCHED_REF)
+
+    @staticmethod
+    def _has_commit(repo: git.Repo, commit: str) -> bool:
+        try:
+            repo.git.cat_file('-e', f'{commit}^{{commit}}')
+        except git.GitCommandError:
+            return False
+
+        return True
+
+    def checkout(self, commit: str, path: pathlib.Path, paths: typing.Optional[typing.Sequence[str]] = None) -> None:
+        """
+        Checks out working tree of the commit into the path, which has to be empty directory.
+
+        :param commit:
+        :param path:
+        :param paths: If specified only these paths (relative to the root of the repo) are checked out. Paths that
+                      do not exist in the commit are skipped.
+        :return:
+        """
+        with _get_lock(self.path):
+            repo = self._open()
+
+            if paths is None:
+                logger.info(f'Checking out commit {commit} from mirror into {path}')
+                repo.git.worktree('add', '--detach', str(path), commit)
+                return
+
+            repo.git.worktree('add', '--no-checkout', '--detach', str(path), commit)
+
+        worktree = git.Repo(str(path))
+        existing_paths = worktree.git.ls_tree('--name-only', commit, '--', *paths).splitlines()
+        logger.info(f'Checking out paths {existing_paths} of commit {commit} from mirror into {path}')
+
+        if existing_paths:
+            worktree.git.checkout(commit, '--', *existing_paths)
+
+    def tree_hashes(self, commit: str, paths: typing.Optional[typing.Sequence[str]] = None) -> str:
+        """
+        Returns Git's hashes of the paths in the commit (in ls-tree's format), that identify their content.
+        Paths that do not exist in the commit are skipped.
+
+        :param commit:
+        :param paths: Paths relative to the root of the repo, if None the hash of the commit's root tree is returned
+        :return:
+        """
+        with _get_lock(self.path):
+            repo = git.Repo(str(self.path))
+
+            if not paths:
+                return repo.git.rev_parse(f'{commit}^{{tree}}')
+
+            return repo.git.ls_tree('--full-tree', commit, '--', *paths)
+
+    def prune(self) -> None:
+        """
+        Removes administrative files of worktrees that were already deleted.
+
+        :return:
+        """
+        if not self.exists:
+            return
+
+        with _get_lock(self.path):
+            git.Repo(str(self.path)).git.worktree('prune')
+
+    def remove(self) -> None:
+        """
+        Deletes the whole mirror.
+
+        :return:
+        """
+        logger.info(f'Removing mirror {self.path}')
+        shutil.rmtree(str(self.path), ignore_errors=True)
@@ -1,24 +1,33 @@
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
 import datetime
+import functools
 import logging
 import os
 import pathlib
 import re
 import secrets
 import shutil
+import signal
 import string
-import subprocess
 import tempfile
+import threading
+import time
 import typing
+import uuid
 
 import click
-import git
-import inquirer
-import ipfshttpclient
 
-from publish import cloudflare
+from publish import cloudflare, buildcache, buildlog, ignore, replication, retention, state as state_module, \
+    uploading, mirror as mirror_module, manifest as manifest_module
 from publish import config as config_module, exceptions, PUBLISH_IGNORE_FILENAME, DEFAULT_LENGTH_OF_SECRET, \
     IPNS_KEYS_NAME_PREFIX, IPNS_KEYS_TYPE, helpers
 
+inquirer = helpers.lazy_import('inquirer')
+ipfshttpclient = helpers.lazy_import('ipfshttpclient')
+
 logger = logging.getLogger('publish.publishing')
 
 repo_class = typing.Union[typing.Type['GithubRepo'], typing.Type['GenericRepo']]
@@ -26,6 +35,21 @@ repo_instance = typing.Union['GithubRepo', 'GenericRepo']
 
 DEFAULT_BRANCH_PLACEHOLDER = '<default branch>'
 
+PROCESS_KILL_TIMEOUT = 5
+"""
+Number of seconds that terminated binary has to exit, before it is killed.
+"""
+
+STAGE_CHECKING = 'checking'
+STAGE_CLONING = 'cloning'
+STAGE_BUILDING = 'building'
+STAGE_ADDING = 'adding'
+STAGE_REPLICATING = 'replicating'
+STAGE_PUBLISHING = 'publishing'
+"""
+Stages of the repo's publish, the last one covers IPNS, DNSLink and the after-publish binary.
+"""
+
 
 def get_name_from_url(url: str) -> str:
     """
@@ -58,6 +82,11 @@ Regex validating lifetime syntax, examples:
 1h 2m -> FALSE
 """
 
+IPNS_REPUBLISH_AT = 0.5
+"""
+Fraction of the IPNS record's lifetime after which the record should be published again.
+"""
+
 LIFETIME_SYNTAX_CHECK_REGEX = f'^{LIFETIME_SYNTAX_REGEX}+?$'
 LIFETIME_MAPPING = {
     'h': 'hours',
@@ -115,6 +144,52 @@ def validate_url(url):
     return re.match(regex, url) is not None
 
 
+class RemoteRefs:
+    """
+    Refs of remote Git repo, as listed by `git ls-remote --symref`.
+    """
+
+    branches: typing.FrozenSet[str] = frozenset()
+    """
+    Names of the repo's branches.
+    """
+
+    default_branch: typing.Optional[str] = None
+    """
+    Branch that the remote's HEAD points to, None if it could not be determined.
+    """
+
+    def __init__(self, branches: typing.Iterable[str], default_branch: typing.Optional[str] = None):
+        self.branches = frozenset(branches)
+        self.default_branch = default_branch
+
+    @classmethod
+    def parse(cls, output: str) -> 'RemoteRefs':
+        branches, default_branch = [], None
+        for line in output.splitlines():
+            ref, _, name = line.partition('\t')
+
+            if ref.startswith('ref: refs/heads/') and name == 'HEAD':
+                default_branch = ref[len('ref: refs/heads/'):]
+            elif name.startswith('refs/heads/'):
+                branches.append(name[len('refs/heads/'):])
+
+        return cls(branches, default_branch)
+
+
+@functools.lru_cache(maxsize=1024)
+def ls_remote(url: str) -> RemoteRefs:
+    """
+    Lists refs of the remote Git repo. The result is cached per URL, so validation of the repo, of its branch
+    and resolving of its default branch fetch the refs only once.
+
+    :param url:
+    :raises exceptions.RepoException: If the refs could not be fetched
+    :return:
+    """
+    return RemoteRefs.parse(mirror_module.ls_remote(url, symref=True))
+
+
 def validate_repo(url: str) -> bool:
     """
     Validate Git repository which is supposed to be placed on passed URL.
@@ -129,11 +204,13 @@ def validate_repo(url: str) -> bool:
     if not validate_url(url):
         return False
 
-    result = subprocess.run('git -c core.askpass=\'echo\' ls-remote ' + url, shell=True, capture_output=True)
-    if result.returncode != 0:
-        logger.error(f'Error while fetching Git\'s remote refs! {result.stderr.decode("utf-8")}')
+    try:
+        ls_remote(url)
+    except exceptions.RepoException as e:
+        logger.error(str(e))
+        return False
 
-    return result.returncode == 0
+    return True
 
 
 def validate_branch(git_url: str, name: str) -> bool:
@@ -147,20 +224,7 @@ def validate_branch(git_url: str, name: str) -> bool:
     if name == DEFAULT_BRANCH_PLACEHOLDER:
         return True
 
-    result = subprocess.run('git -c core.askpass=\'echo\' ls-remote ' + git_url, shell=True, capture_output=True)
-    if result.returncode != 0:
-        raise exceptions.RepoException(f'Error while fetching Git\'s remote refs! {result.stderr.decode("utf-8")}')
-
-    refs_list = result.stdout.decode("utf-8").split('\n')
-    regex = re.compile(r'refs/heads/(.*)')
-
-    for entry in refs_list:
-        match = regex.search(entry)
-
-        if match is not None and match.group(1) == name:
-            return True
-
-    return False
+    return name in ls_remote(git_url).branches
 
 
 def get_default_branch(gir_url: str) -> str:
@@ -169,18 +233,40 @@ def get_default_branch(gir_url: str) -> str:
     :param gir_url:
     :return:
     """
-    result = subprocess.run(f'git -c core.askpass=\'echo\' ls-remote --symref {gir_url} HEAD',
-                            shell=True, capture_output=True)
-    if result.returncode != 0:
-        raise exceptions.RepoException(f'Error while fetching Git\'s remote refs! {result.stderr.decode("utf-8")}')
+    default_branch = ls_remote(gir_url).default_branch
 
-    refs_list = result.stdout.decode("utf-8")
-    match = re.findall(r'refs/heads/([\w_-]*)\t', refs_list, re.MULTILINE)
-
-    if len(match) != 1:
+    if default_branch is None:
         raise exceptions.RepoException('We can\'t determine which is the default branch, please specify it manually!')
 
-    return match[0]
+    return default_branch
+
+
+def generate_secret() -> str:
+    return ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(DEFAULT_LENGTH_OF_SECRET))
+
+
+async def terminate_process(process: asyncio.subprocess.Process) -> None:
+    """
+    Terminates the process together with all its children (the process is expected to be a session leader).
+    If the process does not exit in PROCESS_KILL_TIMEOUT, it is killed.
+
+    :param process:
+    :return:
+    """
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        return
+
+    try:
+        await asyncio.wait_for(process.wait(), PROCESS_KILL_TIMEOUT)
+    except asyncio.TimeoutError:
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+        await process.wait()
 
 
 def is_github_url(url: str) -> bool:
@@ -237,10 +323,20 @@ class GenericRepo(cloudflare.CloudFlareMixin):
         'branch': None,
         'secret': None,
         'publish_dir': None,
-        'last_ipfs_addr': None,
         'pin': None,
+        'delta_publish': None,
+        'weight': None,
+        'upload_concurrency': None,
+        'clone_strategy': 'git',
+        'sparse_paths': 'git',
         'build_bin': 'execute',
         'after_publish_bin': 'execute',
+        'timeout': 'execute',
+        'build_cache': 'execute',
+        'build_inputs': 'execute',
+        'cache_paths': 'execute',
+        'keep_versions': 'retention',
+        'keep_days': 'retention',
         'republish': 'ipns',
         'ipns_key': 'ipns',
         'ipns_addr': 'ipns',
@@ -249,7 +345,8 @@ class GenericRepo(cloudflare.CloudFlareMixin):
         'dns_id': 'cloudflare'
     }
     """
-    Mapping that maps the repo's properties into TOML's config sections.
+    Mapping that maps the repo's properties into TOML's config sections. The runtime state (state.STATE_ATTRIBUTES and
+    versions) is not part of the TOML config, it is stored in the state store.
     """
 
     name: str = None
@@ -288,21 +385,79 @@ class GenericRepo(cloudflare.CloudFlareMixin):
     Defines the lifetime of IPNS entries
     """
 
+    ipns_published_at: typing.Optional[float] = None
+    """
+    Stores the time (UNIX timestamp) when the IPNS entry was last published, used for planning of its republishing
+    """
+
+    ipns_published_addr: typing.Optional[str] = None
+    """
+    Stores the IPFS address to which the last published IPNS entry points
+    """
+
     pin: bool = True
     """
     Defines if the published content is pinned to the IPFS node
     """
 
+    delta_publish: bool = False
+    """
+    Defines if only the files changed since the last publish should be added to IPFS, based on the repo's manifest
+    """
+
+    weight: float = 1
+    """
+    Defines the repo's weight for fair queuing of publishes, repo with higher weight gets bigger share of publishing
+    """
+
+    upload_concurrency: typing.Optional[int] = None
+    """
+    Defines number of concurrent connections used for adding the publish directory to IPFS, if None the global
+    'upload_concurrency' of the 'ipfs' config's section is used
+    """
+
     last_ipfs_addr: typing.Optional[str] = None
     """
     Stores the last IPFS address of the published address in format "/ipfs/<hash>/" 
     """
 
+    last_commit_sha: typing.Optional[str] = None
+    """
+    Stores SHA of the last published commit, publishes of the same commit are skipped
+    """
+
+    versions: typing.List[retention.Version] = None
+    """
+    Stores the published versions that are retained, ordered from the oldest
+    """
+
+    keep_versions: typing.Optional[int] = None
+    """
+    Defines number of the last published versions that are kept pinned
+    """
+
+    keep_days: typing.Optional[float] = None
+    """
+    Defines number of days for which the published versions are kept pinned. If neither keep_versions nor keep_days is
+    defined, the global keep_pinned_previous_versions option decides whether all or only the last version is kept.
+    """
+
     publish_dir: str = '/'
     """
     Defines a path inside the repo that will be published. Default is the root of the repo.
     """
 
+    clone_strategy: str = 'full'
+    """
+    Defines how the repo is fetched into its mirror and checked out, see mirror.CLONE_STRATEGIES.
+    """
+
+    sparse_paths: typing.Optional[typing.List[str]] = None
+    """
+    Additional paths (beside publish_dir) that are checked out for the 'sparse' clone strategy, eq. paths that are
+    needed by the build binary.
+    """
+
     build_bin: typing.Optional[str] = None
     """
     Binary that is invoked prior the publishing to IPFS.
@@ -314,11 +469,42 @@ class GenericRepo(cloudflare.CloudFlareMixin):
     the IPFS address that it was published under. 
     """
 
+    timeout: typing.Optional[str] = None
+    """
+    Defines the maximal wall-clock time that build and after-publish binaries can run (eq. 30m), if None no limit.
+    """
+
+    build_cache: bool = False
+    """
+    Defines if the output of the build is cached, so the build is skipped when its inputs did not change.
+    """
+
+    build_inputs: typing.Optional[typing.List[str]] = None
+    """
+    Paths inside the repo that are the build's inputs, their Git tree hashes (with the build binary) are the key of
+    the build's cache. If None the whole repo is the build's input.
+    """
+
+    cache_paths: typing.Optional[typing.List[str]] = None
+    """
+    Paths of directories created by the build (eq. node_modules), that are persisted between the builds.
+    """
+
     def __init__(self, config: config_module.Config, name: str, git_repo_url: str, secret: str,
                  branch: typing.Optional[str] = None,
                  ipns_addr: typing.Optional[str] = None, ipns_key: typing.Optional[str] = None, ipns_lifetime='24h',
-                 republish=False, pin=True, last_ipfs_addr=None, publish_dir: str = '/',
-                 build_bin=None, after_publish_bin=None, ipns_ttl='15m', **kwargs):
+                 ipns_published_at: typing.Optional[float] = None, ipns_published_addr: typing.Optional[str] = None,
+                 republish=False, pin=True, last_ipfs_addr=None,
+                 last_commit_sha=None,
+                 versions: typing.Optional[typing.List[retention.Version]] = None,
+                 keep_versions: typing.Optional[int] = None, keep_days: typing.Optional[float] = None,
+                 publish_dir: str = '/',
+                 build_bin=None, after_publish_bin=None, ipns_ttl='15m', clone_strategy: str = 'full',
+                 sparse_paths: typing.Optional[typing.List[str]] = None, delta_publish=False,
+                 weight: float = 1, timeout: typing.Optional[str] = None, build_cache=False,
+                 upload_concurrency: typing.Optional[int] = None,
+                 build_inputs: typing.Optional[typing.List[str]] = None,
+                 cache_paths: typing.Optional[typing.List[str]] = None, **kwargs):
         self.name = name
         self.git_repo_url = git_repo_url
         self.branch = branch
@@ -327,18 +513,44 @@ class GenericRepo(cloudflare.CloudFlareMixin):
 
         # IPFS setting
         self.pin = pin
+        self.delta_publish = delta_publish
+        self.weight = weight
+        self.upload_concurrency = upload_concurrency
         self.republish = republish
         self.ipns_key = ipns_key
         self.last_ipfs_addr = last_ipfs_addr
+        self.last_commit_sha = last_commit_sha
+        self.versions = versions or []
+        self.keep_versions = keep_versions
+        self.keep_days = keep_days
         self.ipns_lifetime = ipns_lifetime
+        self.ipns_published_at = ipns_published_at
+        self.ipns_published_addr = ipns_published_addr
         self.ipns_addr = ipns_addr
         self.ipns_ttl = ipns_ttl
 
+        # Git setting
+        if clone_strategy not in mirror_module.CLONE_STRATEGIES:
+            raise exceptions.ConfigException(f'Unknown clone strategy \'{clone_strategy}\'! '
+                                             f'Supported are: {", ".join(mirror_module.CLONE_STRATEGIES)}')
+
+        self.clone_strategy = clone_strategy
+        self.sparse_paths = sparse_paths
+
         # Build etc. setting
         self.publish_dir = publish_dir
         self.build_bin = build_bin
         self.after_publish_bin = after_publish_bin
 
+        if timeout is not None and not validate_time_span(timeout):
+            raise exceptions.ConfigException('Passed timeout is not valid! Supported units are: h(our), m(inute), '
+                                             's(seconds)!')
+        self.timeout = timeout
+
+        self.build_cache = build_cache
+        self.build_inputs = build_inputs
+        self.cache_paths = [buildcache.validate_cache_path(path) for path in cache_paths] if cache_paths else None
+
         super().__init__(**kwargs)
 
     @property
@@ -349,64 +561,458 @@ class GenericRepo(cloudflare.CloudFlareMixin):
         """
         return f'{self.config.webhook_base}/publish/{self.name}?secret={self.secret}'
 
-    def _run_bin(self, cwd: pathlib.Path, cmd: str, *args):
+    @property
+    def timeout_seconds(self) -> typing.Optional[float]:
+        return convert_lifetime(self.timeout).total_seconds() if self.timeout else None
+
+    @property
+    def mirror(self) -> mirror_module.RepoMirror:
         """
-        Execute binary with arguments in specified directory.
+        Returns the persistent mirror of the repo, that is placed in the data directory.
+        :return:
+        """
+        return mirror_module.RepoMirror(self.config.data_dir / 'mirrors' / self.name, self.git_repo_url, self.branch,
+                                        self.clone_strategy)
+
+    @property
+    def manifest_path(self) -> pathlib.Path:
+        """
+        Returns path where the manifest of the last published directory is stored.
+        :return:
+        """
+        return self.config.data_dir / 'manifests' / f'{self.name}.json'
+
+    @property
+    def effective_upload_concurrency(self) -> int:
+        if self.upload_concurrency is not None:
+            return self.upload_concurrency
+
+        return (self.config['ipfs'] or {}).get('upload_concurrency', 1)
+
+    @property
+    def build_cache_path(self) -> pathlib.Path:
+        """
+        Returns path where the cached build outputs and dependency directories of the repo are stored.
+        :return:
+        """
+        return self.config.data_dir / 'build_cache' / self.name
+
+    @property
+    def checkout_paths(self) -> typing.Optional[typing.List[str]]:
+        """
+        Returns paths that should be checked out for 'sparse' clone strategy, None means whole repo.
+        :return:
+        """
+        publish_dir = self.publish_dir.strip('/')
+        if self.clone_strategy != 'sparse' or not publish_dir:
+            return None
+
+        return [publish_dir, PUBLISH_IGNORE_FILENAME] + [path.strip('/') for path in self.sparse_paths or []]
+
+    async def _run_bin(self, cwd: pathlib.Path, cmd: str, *args, cancel: typing.Optional[asyncio.Event] = None,
+                       log: typing.Optional[buildlog.BuildLog] = None):
+        """
+        Execute binary with arguments in specified directory as asyncio's subprocess.
 
         :param cwd: Directory in which the binary will be invoked
         :param cmd: Binary definition invoked with shell
         :param args:
-        :raises exceptions.RepoException: If the binary exited with non-zero status
+        :param cancel: Event that when set, terminates the binary
+        :param log: Log where the output of the binary is streamed, if None the output is discarded
+        :raises exceptions.RepoException: If the binary exited with non-zero status or timed out
+        :raises exceptions.BuildCancelledException: If the binary was terminated because of the cancel event
         :return:
         """
-        os.chdir(str(cwd))
         full_cmd = f'{cmd} {" ".join(args)}'
         logger.info(f'Running shell command "{full_cmd}" with cwd={cwd}')
 
-        r = subprocess.run(full_cmd, shell=True, capture_output=True)
+        output = asyncio.subprocess.PIPE if log is not None else asyncio.subprocess.DEVNULL
+        process = await asyncio.create_subprocess_shell(full_cmd, cwd=str(cwd), stdout=output,
+                                                        stderr=asyncio.subprocess.STDOUT, start_new_session=True)
+        if log is not None:
+            log.write(f'$ {full_cmd}\n'.encode('utf-8'))
+
+        streaming = asyncio.ensure_future(self._stream_output(process, log))
+        waiters = {streaming}
+        if cancel is not None:
+            waiters.add(asyncio.ensure_future(cancel.wait()))
+
+        try:
+            done, _ = await asyncio.wait(waiters, timeout=self.timeout_seconds, return_when=asyncio.FIRST_COMPLETED)
+        except asyncio.CancelledError:
+            await terminate_process(process)
+            raise
+        finally:
+            for waiter in waiters - {streaming}:
+                waiter.cancel()
+
+        if streaming not in done:
+            await terminate_process(process)
+            await streaming
+
+            if cancel is not None and cancel.is_set():
+                raise exceptions.BuildCancelledException(f'\'{cmd}\' binary was cancelled!')
+
+            raise exceptions.RepoException(f'\'{cmd}\' binary did not finish in {self.timeout}!')
 
-        if r.returncode != 0:
-            r.stderr and logger.debug(f'STDERR: {r.stderr.decode("utf-8")}')
-            r.stdout and logger.debug(f'STDOUT: {r.stdout.decode("utf-8")}')
-            raise exceptions.RepoException(f'\'{cmd}\' binary exited with non-zero code!')
+        if process.returncode != 0:
+            log_info = f' See its output in log: {log.path}' if log is not None else ''
+            raise exceptions.RepoException(f'\'{cmd}\' binary exited with non-zero code!{log_info}')
 
-    def publish_repo(self) -> None:
+    @staticmethod
+    async def _stream_output(process: asyncio.subprocess.Process, log: typing.Optional[buildlog.BuildLog]) -> int:
+        """
+        Streams the output of the process into the log in chunks, so the output is never held in memory as whole.
+
+        :param process:
+        :param log:
+        :return: Exit code of the process
+        """
+        if log is not None:
+            while True:
+                chunk = await process.stdout.read(buildlog.READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+
+                log.write(chunk)
+
+        return await process.wait()
+
+    async def publish_repo(self, cancel: typing.Optional[asyncio.Event] = None, job_id: typing.Optional[str] = None,
+                           commit: typing.Optional[str] = None, force: bool = False,
+                           stage: typing.Optional[typing.Callable[[str], None]] = None) \
+            -> typing.Optional[replication.PublishResult]:
         """
         Main method that handles publishing of the repo to IPFS.
 
+        The blocking steps are run in the event loop's executor, the binaries are run as asyncio's subprocesses
+        and their output is streamed into the job's log.
+
+        The repo's runtime state is saved into the state store at the end of the publish, even when it failed.
+
+        :param cancel: Event that when set, cancels the build of the repo
+        :param job_id: ID of the publishing job, used for naming its log
+        :param commit: SHA of the commit that should be published, if None the tip of the tracked branch is published
+        :param force: Publish even when the commit is the same as the last published one
+        :param stage: Callback called with the STAGE_* constant when the publish enters new stage
+        :return: Result with the published IPFS address and the nodes' results, or None if the publish was skipped as
+                 the commit was already published
+        """
+        loop = asyncio.get_event_loop()
+        stage = stage or (lambda name: None)
+
+        stage(STAGE_CHECKING)
+        if not force and await loop.run_in_executor(None, self._is_published, commit):
+            logger.info(f'Commit {self.last_commit_sha} of repo \'{self.name}\' is already published, skipping')
+            return None
+
+        log = buildlog.BuildLog.for_job(self.config, self.name, job_id or uuid.uuid4().hex)
+        log.write(f'Publishing repo \'{self.name}\'\n'.encode('utf-8'))
+
+        try:
+            stage(STAGE_CLONING)
+            path, commit = await loop.run_in_executor(None, self._clone_repo, commit)
+            log.write(f'Checked out commit {commit}\n'.encode('utf-8'))
+
+            try:
+                if self.build_bin:
+                    stage(STAGE_BUILDING)
+                    await self._build(path, commit, cancel, log)
+
+                stage(STAGE_ADDING)
+                progress = uploading.ProgressCounter(lambda count: log.write(f'Added {count} entries\n'.encode('utf-8')))
+                previous_addr = self.last_ipfs_addr
+                start = time.perf_counter()
+                cid = await loop.run_in_executor(None, self._add_repo, path, progress)
+                result = replication.PublishResult(cid, commit, [
+                    replication.NodeResult(self.config.ipfs_multiaddr, time.perf_counter() - start)
+                ])
+                self._record_version(previous_addr, cid, commit)
+                log.write(f'Published as {cid}\n'.encode('utf-8'))
+
+                if self.pin and self.config.replicas:
+                    stage(STAGE_REPLICATING)
+                    result.nodes.extend(await loop.run_in_executor(None, self._replicate_pin, cid, previous_addr))
+                    for node in result.nodes[1:]:
+                        log.write(f'Replica {node}\n'.encode('utf-8'))
+
+                # IPNS publishing can take long time while the record is put into DHT, so the rest of the pipeline
+                # does not wait for it
+                stage(STAGE_PUBLISHING)
+                ipns = asyncio.ensure_future(self._publish_ipns(cid, result, log))
+                try:
+                    await self._update_dns(cid)
+
+                    if self.after_publish_bin:
+                        await self._run_bin(path, self.after_publish_bin, cid, log=log)
+                except BaseException:
+                    # The IPNS publish is waited for, but its error must not replace the original one
+                    ipns_result, = await asyncio.gather(ipns, return_exceptions=True)
+                    if isinstance(ipns_result, Exception):
+                        logger.error(f'IPNS publishing of repo \'{self.name}\' failed: {ipns_result}')
+                    raise
+
+                await ipns
+
+                # The commit is marked as published only when the whole pipeline succeeded, so a failed publish of
+                # the commit is retried
+                self.last_commit_sha = commit
+
+                # The expired versions stay pinned until the new one is published everywhere
+                await loop.run_in_executor(None, self._apply_retention)
+            finally:
+                await loop.run_in_executor(None, self._cleanup_repo, path)
+        finally:
+            # The state is saved also when the publish failed, as the new version could be already pinned
+            await loop.run_in_executor(None, self.save_state)
+            log.close()
+            buildlog.BuildLog.cleanup(self.config, self.name)
+
+        return result
+
+    async def _build(self, path: pathlib.Path, commit: str, cancel: typing.Optional[asyncio.Event],
+                     log: buildlog.BuildLog) -> None:
+        """
+        Runs the build binary in the checked out repo. When the build cache is enabled and the build's inputs did
+        not change since some of the cached builds, the build's output is restored from the cache instead.
+
+        :param path:
+        :param commit:
+        :param cancel:
+        :param log:
         :return:
         """
-        path = self._clone_repo()
+        loop = asyncio.get_event_loop()
+        cache = buildcache.BuildCache(self.build_cache_path)
+        output_path = self.publish_path(path)
+
+        key = None
+        if self.build_cache:
+            tree_hashes = await loop.run_in_executor(None, self.mirror.tree_hashes, commit, self.build_inputs)
+            key = cache.compute_key(tree_hashes, self.build_bin)
 
-        if self.build_bin:
-            self._run_bin(path, self.build_bin)
+            if await loop.run_in_executor(None, cache.restore_output, key, output_path):
+                logger.info(f'Build\'s inputs of repo \'{self.name}\' did not change, using cached build {key}')
+                log.write(f'Using cached build output {key}\n'.encode('utf-8'))
+                return
+
+        cache_paths = await loop.run_in_executor(None, cache.restore_dependencies, path, self.cache_paths or [])
+        try:
+            await self._run_bin(path, self.build_bin, cancel=cancel, log=log)
+        finally:
+            await loop.run_in_executor(None, cache.save_dependencies, path, cache_paths)
 
+        if key is not None:
+            await loop.run_in_executor(None, cache.store_output, key, output_path)
+
+    def _is_published(self, commit: typing.Optional[str] = None) -> bool:
+        """
+        Checks whether the commit (or the remote tip of the tracked branch when not specified) was already published.
+
+        :param commit:
+        :return:
+        """
+        if self.last_commit_sha is None or self.last_ipfs_addr is None:
+            return False
+
+        if commit is None:
+            try:
+                commit = self.mirror.remote_head()
+            except exceptions.RepoException as e:
+                logger.warning(f'Could not check the remote\'s tip of repo \'{self.name}\': {e}')
+                return False
+
+        return commit == self.last_commit_sha
+
+    def publish_path(self, path: pathlib.Path) -> pathlib.Path:
+        """
+        Returns path of the publish directory inside of the checked out repo.
+
+        :param path:
+        :return:
+        """
+        return path / (self.publish_dir[1:] if self.publish_dir.startswith('/') else self.publish_dir)
+
+    def _add_repo(self, path: pathlib.Path, progress: typing.Optional[uploading.ProgressCallback] = None) -> str:
+        """
+        Removes the ignored files from the checked out repo, adds its publish directory to IPFS and pins it.
+
+        :param path:
+        :param progress: Callback called for every entry added to IPFS
+        :return: IPFS address of the added directory
+        """
         self._remove_ignored_files(path)
 
         ipfs = self.config.ipfs
-        if not self.config['keep_pinned_previous_versions'] and self.last_ipfs_addr is not None:
-            logger.info(f'Unpinning hash: {self.last_ipfs_addr}')
-            ipfs.pin.rm(self.last_ipfs_addr)
-
-        publish_dir = path / (self.publish_dir[1:] if self.publish_dir.startswith('/') else self.publish_dir)
-        logger.info(f'Adding directory {publish_dir} to IPFS')
-        result = ipfs.add(publish_dir, recursive=True, pin=self.pin)
-        cid = f'/ipfs/{result[-1]["Hash"]}/'
-        self.last_ipfs_addr = cid
+        cid = f'/ipfs/{self._add_to_ipfs(ipfs, self.publish_path(path), progress)}/'
         logger.info(f'Repo successfully added to IPFS with hash: {cid}')
 
-        if self.ipns_key is not None:
-            self.publish_name(cid)
+        if self.pin:
+            self._pin(ipfs, cid, self.last_ipfs_addr)
+
+        self.last_ipfs_addr = cid
+        return cid
+
+    @staticmethod
+    def _pin(ipfs: ipfshttpclient.Client, cid: str, previous_addr: typing.Optional[str] = None) -> None:
+        """
+        Pins the added directory. When the previous version is pinned, its pin is updated to the new version
+        (without unpinning the previous one), so only the blocks that differ between the versions are walked.
+
+        :param ipfs:
+        :param cid:
+        :param previous_addr: Previously published version
+        :return:
+        """
+        if previous_addr == cid:
+            return
+
+        if previous_addr is not None:
+            try:
+                logger.info(f'Updating pin from {previous_addr} to {cid}')
+                ipfs.pin.update(previous_addr, cid, unpin=False)
+                return
+            except ipfshttpclient.exceptions.Error as e:
+                logger.warning(f'Pin of the previous version could not be updated, pinning {cid} directly: {e}')
+
+        logger.info(f'Pinning {cid}')
+        ipfs.pin.add(cid)
+
+    def _replicate_pin(self, cid: str, previous_addr: typing.Optional[str]) -> typing.List[replication.NodeResult]:
+        """
+        Pins the added directory on all the replica nodes in parallel. The replicas fetch the content from the primary
+        node over the IPFS network. Failures of the replicas do not fail the publish, they are only reported.
+
+        :param cid:
+        :param previous_addr: Previously published version
+        :return:
+        """
+        logger.info(f'Replicating pin of {cid} to {len(self.config.replicas)} IPFS replicas')
+        return self.config.replicas.run(lambda ipfs: self._pin(ipfs, cid, previous_addr))
+
+    @property
+    def retention_rules(self) -> typing.Tuple[typing.Optional[int], typing.Optional[float]]:
+        """
+        Returns the number of versions and days for which the versions are retained.
+        :return:
+        """
+        if self.keep_versions is None and self.keep_days is None:
+            return (None, None) if self.config['keep_pinned_previous_versions'] else (1, None)
+
+        return self.keep_versions, self.keep_days
+
+    def _record_version(self, previous_addr: typing.Optional[str], cid: str, commit: typing.Optional[str]) -> None:
+        """
+        Records the newly pinned version, so it is subject to the retention rules even when the rest of the publish
+        fails.
+
+        :param previous_addr: Last published version before this publish
+        :param cid:
+        :param commit:
+        :return:
+        """
+        now = time.time()
+        if not self.versions and previous_addr is not None:
+            self.versions.append({'cid': previous_addr, 'published_at': int(now)})
+
+        self.versions = [version for version in self.versions if version['cid'] != cid]
+        version = {'cid': cid, 'published_at': int(now)}
+        if commit is not None:
+            version['commit'] = commit
+        self.versions.append(version)
+
+    def _apply_retention(self) -> None:
+        """
+        Unpins the versions that expired based on the retention rules.
+
+        :return:
+        """
+        now = time.time()
+        keep_versions, keep_days = self.retention_rules
+        expired = retention.expired_versions(self.versions, keep_versions, keep_days, now)
+        if not expired:
+            return
+
+        self.versions = [version for version in self.versions if version not in expired]
+
+        settings = self.config['retention'] or {}
+        unpin = functools.partial(retention.unpin_in_batches, cids=[version['cid'] for version in expired],
+                                  batch_size=settings.get('unpin_batch_size', retention.DEFAULT_UNPIN_BATCH_SIZE),
+                                  pause=settings.get('unpin_pause', retention.DEFAULT_UNPIN_PAUSE))
+        unpin(self.config.ipfs)
+
+        if self.pin:
+            self.config.replicas.run(unpin)
+
+    def is_ipns_current(self, cid: str, now: typing.Optional[float] = None) -> bool:
+        """
+        Checks whether the last published IPNS record points to the IPFS address and whether it has still enough
+        lifetime left, so it does not need to be published again.
+
+        :param cid:
+        :param now:
+        :return:
+        """
+        if self.ipns_published_addr != cid or self.ipns_published_at is None:
+            return False
+
+        lifetime = convert_lifetime(self.ipns_lifetime).total_seconds()
+        return (now or time.time()) - self.ipns_published_at < lifetime * IPNS_REPUBLISH_AT
 
+    async def _publish_ipns(self, cid: str, result: replication.PublishResult, log: buildlog.BuildLog) -> None:
+        """
+        Publishes the IPFS address to IPNS, if configured, unless the current record already points to it.
+
+        :param cid:
+        :param result: Result of the publish, where the IPNS publish's duration is recorded
+        :param log:
+        :return:
+        """
+        if self.ipns_key is None:
+            return
+
+        if self.is_ipns_current(cid):
+            logger.info(f'IPNS record of repo \'{self.name}\' already points to {cid}, skipping')
+            log.write(b'IPNS record is up to date, skipping\n')
+            return
+
+        start = time.perf_counter()
+        await asyncio.get_event_loop().run_in_executor(None, self.publish_name, cid)
+        result.ipns_duration = time.perf_counter() - start
+        log.write(f'IPNS published in {result.ipns_duration:.2f}s\n'.encode('utf-8'))
+
+    async def _update_dns(self, cid: str) -> None:
         try:
-            self.update_dns(cid)
+            await self.update_dns(cid)
         except exceptions.ConfigException:
             pass
 
-        if self.after_publish_bin:
-            self._run_bin(path, self.after_publish_bin, cid)
+    def _add_to_ipfs(self, ipfs: ipfshttpclient.Client, publish_dir: pathlib.Path,
+                     progress: typing.Optional[uploading.ProgressCallback] = None) -> str:
+        """
+        Adds the directory to IPFS without pinning and returns CID of its root. With delta publishing only files that
+        changed since the last publish are added, otherwise the directory can be added in concurrently uploaded shards.
+
+        :param ipfs:
+        :param publish_dir:
+        :param progress: Callback called for every entry added to IPFS
+        :return:
+        """
+        if not self.delta_publish:
+            return uploading.add_directory_sharded(ipfs, self.config.connect_ipfs, publish_dir,
+                                                   self.effective_upload_concurrency, False, progress)
 
-        self._cleanup_repo(path)
+        manifest = manifest_module.Manifest.load(self.manifest_path)
+        last_root = self.last_ipfs_addr.strip('/').split('/')[-1] if self.last_ipfs_addr else None
+
+        try:
+            root = manifest.add_directory(ipfs, publish_dir, base_root=last_root, progress=progress)
+        except exceptions.PublishingException as e:
+            logger.warning(f'Delta publishing not possible, adding whole directory: {e}')
+            return uploading.add_directory(ipfs, publish_dir, False, progress)
+
+        manifest.save()
+        return root
 
     def publish_name(self, cid) -> None:
         """
@@ -418,76 +1024,98 @@ class GenericRepo(cloudflare.CloudFlareMixin):
 
         logger.info('Updating IPNS name')
         ipfs = self.config.ipfs
-        ipfs.name.publish(cid, key=self.ipns_key, ttl=self.ipns_ttl)
+        ipfs.name.publish(cid, key=self.ipns_key, lifetime=self.ipns_lifetime, ttl=self.ipns_ttl)
+        self.ipns_published_at = time.time()
+        self.ipns_published_addr = cid
         logger.info('IPNS successfully published')
 
-    def _clone_repo(self) -> pathlib.Path:
+    def _clone_repo(self, commit: typing.Optional[str] = None) -> typing.Tuple[pathlib.Path, str]:
         """
-        Method that will clone the repo defined by git_repo_url into temporary directory and returns the path.
-        :return: Path to the root of the cloned repo
+        Method that will fetch the repo defined by git_repo_url into its persistent mirror and checks out the commit
+        (or the fetched tip of the tracked branch) into temporary directory.
+
+        :param commit: SHA of the commit that should be checked out
+        :return: Path to the root of the checked out repo and SHA of the checked out commit
         """
-        path = tempfile.mkdtemp()
-        logger.info(f'Cloning repo: \'{self.git_repo_url}\' to {path}')
+        repo_mirror = self.mirror
+        commit = repo_mirror.fetch(commit)
 
-        if self.branch:
-            git.Repo.clone_from(self.git_repo_url, path, branch=self.branch)
-        else:
-            git.Repo.clone_from(self.git_repo_url, path)
+        path = pathlib.Path(tempfile.mkdtemp()).resolve()
+        logger.info(f'Checking out commit {commit} of repo: \'{self.git_repo_url}\' to {path}')
+        repo_mirror.checkout(commit, path, self.checkout_paths)
 
-        return pathlib.Path(path).resolve()
+        return path, commit
 
     def _remove_ignored_files(self, path: pathlib.Path):
         """
-        Reads the ignore file and removes the ignored files based on glob from the directory and all subdirectories.
-        Also removes the ignore file itself and .git folder.
+        Reads the ignore file and removes the ignored files, matched with gitignore's semantics, from the directory
+        and all subdirectories. Also removes the ignore file itself and .git folder.
 
         :param path:
         :return:
         """
-        shutil.rmtree(path / '.git')
+        # For checked out worktree the .git is only a file pointing to the mirror
+        git_path = path / '.git'
+        if git_path.is_dir():
+            shutil.rmtree(git_path)
+        elif git_path.exists():
+            git_path.unlink()
+
         ignore_file = path / PUBLISH_IGNORE_FILENAME
 
         if not ignore_file.exists():
             return
 
-        entries = ignore_file.read_text()
-        for entry in entries.split('\n'):
-            self._remove_glob(path, entry)
-
+        matcher = ignore.IgnoreMatcher.from_file(ignore_file)
         ignore_file.unlink()
+        matcher.remove_ignored(path)
 
-    def _remove_glob(self, path: pathlib.Path, glob: str):
+    def _cleanup_repo(self, path):
         """
-        Removes all files from path that matches the glob string.
+        Removes the checked out repo from path and prunes its worktree from the mirror.
 
         :param path:
-        :param glob:
         :return:
         """
-        for path_to_delete in path.glob(glob):
-            path_to_delete = path_to_delete.resolve()
-            if not path_to_delete.exists():
-                continue
+        logger.info(f'Cleaning up path: {path}')
+        shutil.rmtree(path)
+        self.mirror.prune()
 
-            if path not in path_to_delete.parents:
-                raise exceptions.RepoException(
-                    f'Trying to delete file outside the repo temporary directory! {path_to_delete}')
+    def update_config(self, other: 'GenericRepo') -> None:
+        """
+        Updates the repo's configuration in place from other instance of the same repo, the runtime state is kept.
 
-            if path_to_delete.is_file():
-                path_to_delete.unlink()
-            else:
-                shutil.rmtree(str(path_to_delete))
+        :param other:
+        :return:
+        """
+        for attr in self._TOML_MAPPING:
+            setattr(self, attr, getattr(other, attr))
 
-    @staticmethod
-    def _cleanup_repo(path):
+    @property
+    def has_state(self) -> bool:
+        return any(getattr(self, attr) is not None for attr in state_module.STATE_ATTRIBUTES) or bool(self.versions)
+
+    def load_state(self, state: state_module.RepoState) -> None:
         """
-        Removes the cloned repo from path.
+        Sets the repo's runtime state loaded from the state store.
 
-        :param path:
+        :param state:
         :return:
         """
-        logging.info(f'Cleaning up path: {path}')
-        shutil.rmtree(path)
+        for attr in state_module.STATE_ATTRIBUTES:
+            setattr(self, attr, state.get(attr))
+
+        self.versions = state.get('versions') or []
+
+    def save_state(self) -> None:
+        """
+        Saves the repo's runtime state into the state store.
+
+        :return:
+        """
+        state = {attr: getattr(self, attr) for attr in state_module.STATE_ATTRIBUTES}
+        state['versions'] = self.versions
+        self.config.state.save(self.name, state)
 
     def to_toml_dict(self) -> dict:
         """
@@ -539,7 +1167,8 @@ class GenericRepo(cloudflare.CloudFlareMixin):
     @classmethod
     def bootstrap_repo(cls, config: config_module.Config, name=None, git_repo_url=None, branch=None, secret=None,
                        ipns_key=None, ipns_lifetime=None, pin=None, republish=None, after_publish_bin=None,
-                       build_bin=None, publish_dir: typing.Optional[str] = None, ipns_ttl=None) -> 'GenericRepo':
+                       build_bin=None, publish_dir: typing.Optional[str] = None, ipns_ttl=None,
+                       clone_strategy=None) -> 'GenericRepo':
         """
         Method that interactively bootstraps the repository by asking interactive questions.
 
@@ -556,6 +1185,7 @@ class GenericRepo(cloudflare.CloudFlareMixin):
         :param after_publish_bin:
         :param build_bin:
         :param publish_dir:
+        :param clone_strategy:
         :return:
         """
 
@@ -576,8 +1206,7 @@ class GenericRepo(cloudflare.CloudFlareMixin):
         zone_id, dns_id = cloudflare.bootstrap_cloudflare()
 
         if secret is None:
-            secret = ''.join(
-                secrets.choice(string.ascii_uppercase + string.digits) for _ in range(DEFAULT_LENGTH_OF_SECRET))
+            secret = generate_secret()
 
         pin = cls.bootstrap_property('Pin flag', 'confirm', 'Do you want to pin the published IPFS objects?', pin,
                                      default=True)
@@ -614,7 +1243,7 @@ class GenericRepo(cloudflare.CloudFlareMixin):
                    publish_dir=publish_dir,
                    ipns_key=ipns_key, ipns_addr=ipns_addr, build_bin=build_bin, after_publish_bin=after_publish_bin,
                    republish=republish, ipns_lifetime=ipns_lifetime, ipns_ttl=ipns_ttl, dns_id=dns_id,
-                   zone_id=zone_id)
+                   zone_id=zone_id, clone_strategy=clone_strategy or 'full')
 
 
 def bootstrap_ipns(config: config_module.Config, name: str, ipns_key: str = None) -> typing.Tuple[str, str]:
@@ -670,6 +1299,42 @@ def bootstrap_ipns(config: config_module.Config, name: str, ipns_key: str = None
     return ipns_key, ipns_addr
 
 
+def generate_ipns_keys(config: config_module.Config, key_names: typing.Iterable[str],
+                       concurrency: int = 4) -> typing.Dict[str, str]:
+    """
+    Returns IPNS addresses for the key names. The node's keys are listed once, the existing keys are reused and
+    the missing ones are generated concurrently, each worker using its own connection to the IPFS API.
+
+    :param config:
+    :param key_names:
+    :param concurrency: Number of the keys generated at the same time
+    :return: Dict mapping the key names to the IPNS addresses
+    """
+    existing = {key['Name']: key['Id'] for key in config.ipfs.key.list()['Keys']}
+    missing = [name for name in dict.fromkeys(key_names) if name not in existing]
+
+    if missing:
+        logger.info(f'Generating {len(missing)} IPNS keys')
+        local = threading.local()
+        clients = []
+
+        def generate_key(name: str) -> str:
+            if not hasattr(local, 'client'):
+                local.client = config.connect_ipfs()
+                clients.append(local.client)
+
+            return local.client.key.gen(name, IPNS_KEYS_TYPE)['Id']
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+                existing.update(zip(missing, executor.map(generate_key, missing)))
+        finally:
+            for client in clients:
+                client.close()
+
+    return {name: f'/ipns/{existing[name]}/' for name in key_names}
+
+
 class GithubRepo(GenericRepo):
     """
     Special case of Repo specific to GitHub hosted repos.
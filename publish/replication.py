@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import concurrent.futures
+import logging
+import threading
+import time
+import typing
+
+from publish import helpers
+
+ipfshttpclient = helpers.lazy_import('ipfshttpclient')
+
+
+logger = logging.getLogger('publish.replication')
+
+
+class NodeResult:
+    """
+    Result of an operation on one IPFS node.
+    """
+
+    node: str = None
+    """
+    Multiaddr of the node's HTTP API.
+    """
+
+    duration: float = 0.0
+    """
+    Number of seconds the operation took on the node.
+    """
+
+    error: typing.Optional[str] = None
+    """
+    Error of the operation, None when it succeeded.
+    """
+
+    def __init__(self, node: str, duration: float, error: typing.Optional[str] = None):
+        self.node = node
+        self.duration = duration
+        self.error = error
+
+    @property
+    def success(self) -> bool:
+        return self.error is None
+
+    def __str__(self):
+        status = 'OK' if self.success else f'failed: {self.error}'
+        return f'{self.node} ({self.duration:.2f}s) {status}'
+
+
+class PublishResult:
+    """
+    Result of a publish of a repo.
+    """
+
+    cid: str = None
+    """
+    IPFS address of the published version.
+    """
+
+    commit: typing.Optional[str] = None
+    """
+    SHA of the published commit.
+    """
+
+    nodes: typing.List[NodeResult] = None
+    """
+    Results of the nodes where the version was added or pinned, the primary node is the first one.
+    """
+
+    ipns_duration: typing.Optional[float] = None
+    """
+    Number of seconds the publishing of IPNS record took, None when the record was not published.
+    """
+
+    def __init__(self, cid: str, commit: typing.Optional[str] = None,
+                 nodes: typing.Optional[typing.List[NodeResult]] = None, ipns_duration: typing.Optional[float] = None):
+        self.cid = cid
+        self.commit = commit
+        self.nodes = nodes or []
+        self.ipns_duration = ipns_duration
+
+    @property
+    def failed_nodes(self) -> typing.List[NodeResult]:
+        return [node for node in self.nodes if not node.success]
+
+
+class ReplicaPool:
+    """
+    Pool of persistent clients of the replica IPFS nodes, one client per node.
+
+    Clients are connected lazily, so a replica that is down does not prevent publishing. When an operation on
+    a node fails, its client is dropped and a new connection is made next time.
+    """
+
+    nodes: typing.List[str] = None
+    """
+    Multiaddrs of the replicas' HTTP APIs.
+    """
+
+    def __init__(self, nodes: typing.Iterable[str]):
+        self.nodes = list(nodes)
+        self._clients: typing.Dict[str, ipfshttpclient.Client] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def client(self, node: str) -> ipfshttpclient.Client:
+        with self._lock:
+            if node not in self._clients:
+                logger.info(f'Connecting to IPFS replica \'{node}\'')
+                self._clients[node] = ipfshttpclient.connect(node, session=True)
+
+            return self._clients[node]
+
+    def discard(self, node: str) -> None:
+        with self._lock:
+            client = self._clients.pop(node, None)
+
+        if client is not None:
+            client.close()
+
+    def close(self) -> None:
+        for node in self.nodes:
+            self.discard(node)
+
+    def run(self, action: typing.Callable[[ipfshttpclient.Client], typing.Any]) -> typing.List[NodeResult]:
+        """
+        Runs the action on all the replicas in parallel. Errors are not raised, they are reported in the results.
+
+        :param action: Callable that gets the node's client
+        :return: Results in the order of the nodes
+        """
+        if not self.nodes:
+            return []
+
+        def run_on_node(node: str) -> NodeResult:
+            start = time.perf_counter()
+            try:
+                action(self.client(node))
+            except ipfshttpclient.exceptions.Error as e:
+                logger.warning(f'Operation on IPFS replica \'{node}\' failed: {e}')
+                self.discard(node)
+                return NodeResult(node, time.perf_counter() - start, str(e))
+
+            return NodeResult(node, time.perf_counter() - start)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(self.nodes)) as executor:
+            return list(executor.map(run_on_node, self.nodes))
@@ -0,0 +1,161 @@
+import asyncio
+import logging
+import random
+import time
+import typing
+
+from publish import publishing, jobs, config as config_module
+
+logger = logging.getLogger('publish.republishing')
+
+DEFAULT_CONCURRENCY = 4
+"""
+Default number of IPNS records that are republished at the same time.
+"""
+
+DEFAULT_CHECK_INTERVAL = 60
+"""
+Default number of seconds between checks whether some of the records should be republished.
+"""
+
+DEFAULT_JITTER = 0.1
+"""
+Default fraction of the record's lifetime by which the republish is randomly moved earlier, so records published
+at the same time are not republished all at once.
+"""
+
+STARTUP_SPREAD = 300
+"""
+Number of seconds over which the republishes of the records without known publish time are spread after start.
+"""
+
+
+class Republisher:
+    """
+    Service that republishes the IPNS records of the repos with enabled `republish` before their lifetime ends.
+
+    Republish time of every record is planned when the record is seen for the first time or when it was published
+    since the last check (eq. by the repo's publish), at half of its lifetime moved earlier by random jitter.
+    """
+
+    concurrency: int = DEFAULT_CONCURRENCY
+    """
+    Maximal number of records that are republished at the same time.
+    """
+
+    jitter: float = DEFAULT_JITTER
+    """
+    Fraction of the lifetime by which the republish is randomly moved earlier.
+    """
+
+    check_interval: float = DEFAULT_CHECK_INTERVAL
+    """
+    Number of seconds between the checks for records to republish.
+    """
+
+    def __init__(self, config: config_module.Config, concurrency: int = DEFAULT_CONCURRENCY,
+                 jitter: float = DEFAULT_JITTER, check_interval: float = DEFAULT_CHECK_INTERVAL):
+        self.config = config
+        self.concurrency = concurrency
+        self.jitter = jitter
+        self.check_interval = check_interval
+        self._planned: typing.Dict[str, typing.Tuple[typing.Optional[float], float]] = {}
+
+    @classmethod
+    def from_config(cls, config: config_module.Config) -> 'Republisher':
+        settings = config['republish'] or {}
+        return cls(config, settings.get('concurrency', DEFAULT_CONCURRENCY), settings.get('jitter', DEFAULT_JITTER),
+                   settings.get('check_interval', DEFAULT_CHECK_INTERVAL))
+
+    @staticmethod
+    def is_republished(repo: publishing.GenericRepo) -> bool:
+        return bool(repo.republish and repo.ipns_key and repo.last_ipfs_addr)
+
+    @staticmethod
+    def may_be_republished(table: dict) -> bool:
+        """
+        Checks whether repo with the table of the TOML config has enabled republishing of its IPNS record.
+
+        :param table:
+        :return:
+        """
+        ipns = table.get('ipns') or {}
+        return bool(ipns.get('republish') and ipns.get('ipns_key'))
+
+    def next_republish(self, repo: publishing.GenericRepo, now: float) -> float:
+        """
+        Returns time when the repo's IPNS record should be republished.
+
+        :param repo:
+        :param now:
+        :return:
+        """
+        published_at = repo.ipns_published_at
+        planned = self._planned.get(repo.name)
+        if planned is not None and planned[0] == published_at:
+            return planned[1]
+
+        if published_at is None:
+            republish_at = now + random.uniform(0, STARTUP_SPREAD)
+        else:
+            lifetime = publishing.convert_lifetime(repo.ipns_lifetime).total_seconds()
+            republish_at = published_at + lifetime * (publishing.IPNS_REPUBLISH_AT - random.uniform(0, self.jitter))
+
+        self._planned[repo.name] = (published_at, republish_at)
+        return republish_at
+
+    def due_repos(self, now: typing.Optional[float] = None) -> typing.List[publishing.GenericRepo]:
+        """
+        Returns repos whose IPNS records should be republished now.
+
+        :param now:
+        :return:
+        """
+        now = now or time.time()
+        running = jobs.get_scheduler().running
+
+        due = []
+        for name in list(self.config.repos):
+            # Repos that are not built yet are filtered by their config's table, so they are not built needlessly
+            if not self.config.repos.is_built(name) and not self.may_be_republished(self.config.repos.table(name)):
+                self._planned.pop(name, None)
+                continue
+
+            repo = self.config.repos[name]
+            if not self.is_republished(repo):
+                self._planned.pop(repo.name, None)
+                continue
+
+            # The running publish updates the record on its own
+            if repo.name not in running and self.next_republish(repo, now) <= now:
+                due.append(repo)
+
+        return due
+
+    async def republish(self, repos: typing.Iterable[publishing.GenericRepo]) -> None:
+        loop = asyncio.get_event_loop()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def republish_repo(repo: publishing.GenericRepo) -> None:
+            async with semaphore:
+                logger.info(f'Republishing IPNS record of repo \'{repo.name}\'')
+                try:
+                    await loop.run_in_executor(None, repo.publish_name, repo.last_ipfs_addr)
+                    await loop.run_in_executor(None, repo.save_state)
+                except Exception:
+                    logger.exception(f'Republishing of IPNS record of repo \'{repo.name}\' failed!')
+
+        await asyncio.gather(*(republish_repo(repo) for repo in repos))
+
+    async def run(self) -> None:
+        """
+        Periodically republishes the due IPNS records, until cancelled.
+
+        :return:
+        """
+        while True:
+            due = self.due_repos()
+            if due:
+                await self.republish(due)
+
+            await asyncio.sleep(self.check_interval)
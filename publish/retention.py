@@ -0,0 +1,140 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import functools
+import logging
+import time
+import typing
+
+from publish import exceptions, helpers, config as config_module
+
+ipfshttpclient = helpers.lazy_import('ipfshttpclient')
+
+logger = logging.getLogger('publish.retention')
+
+DEFAULT_UNPIN_BATCH_SIZE = 20
+"""
+Default number of versions that are unpinned with one call.
+"""
+
+DEFAULT_UNPIN_PAUSE = 1.0
+"""
+Default number of seconds between unpinning of two batches, so the IPFS node is not overloaded.
+"""
+
+Version = typing.Dict[str, typing.Any]
+"""
+Published version of repo, dict with 'cid', 'commit' and 'published_at' (UNIX timestamp) keys.
+"""
+
+
+def expired_versions(versions: typing.List[Version], keep_versions: typing.Optional[int] = None,
+                     keep_days: typing.Optional[float] = None, now: typing.Optional[float] = None) \
+        -> typing.List[Version]:
+    """
+    Returns versions that are not retained by any of the rules. The versions have to be ordered from the oldest,
+    the newest version is always retained. When no rule is specified, all versions are retained.
+
+    :param versions:
+    :param keep_versions: Number of the last versions that are retained
+    :param keep_days: Versions published in this number of days are retained
+    :param now:
+    :return:
+    """
+    if keep_versions is None and keep_days is None:
+        return []
+
+    now = now or time.time()
+    expired = []
+    for index, version in enumerate(versions[:-1]):
+        is_recent = keep_versions is not None and index >= len(versions) - keep_versions
+        is_new = keep_days is not None and now - version['published_at'] <= keep_days * 24 * 60 * 60
+
+        if not is_recent and not is_new:
+            expired.append(version)
+
+    return expired
+
+
+def unpin_in_batches(ipfs: ipfshttpclient.Client, cids: typing.Sequence[str],
+                     batch_size: int = DEFAULT_UNPIN_BATCH_SIZE, pause: float = DEFAULT_UNPIN_PAUSE) -> None:
+    """
+    Unpins the CIDs in batches with pause between them. Errors (eq. CID that is not pinned) are only logged.
+
+    :param ipfs:
+    :param cids:
+    :param batch_size:
+    :param pause: Number of seconds between the batches
+    :return:
+    """
+    for start in range(0, len(cids), batch_size):
+        if start > 0:
+            time.sleep(pause)
+
+        batch = cids[start:start + batch_size]
+        logger.info(f'Unpinning {len(batch)} expired versions')
+
+        try:
+            ipfs.pin.rm(*batch)
+        except ipfshttpclient.exceptions.Error:
+            # Whole batch fails when one of the CIDs is not pinned
+            for cid in batch:
+                try:
+                    ipfs.pin.rm(cid)
+                except ipfshttpclient.exceptions.Error as e:
+                    logger.warning(f'Version {cid} could not be unpinned: {e}')
+
+
+def parse_time_of_day(value: str) -> datetime.time:
+    try:
+        return datetime.datetime.strptime(value, '%H:%M').time()
+    except ValueError:
+        raise exceptions.ConfigException(f'Invalid time \'{value}\' of the GC schedule, expected format is HH:MM!')
+
+
+def seconds_until_next_run(times: typing.Iterable[str], now: typing.Optional[datetime.datetime] = None) -> float:
+    """
+    Returns number of seconds until the nearest of the times of day.
+
+    :param times: Times of day in HH:MM format (local time)
+    :param now:
+    :return:
+    """
+    now = now or datetime.datetime.now()
+    runs = []
+    for value in times:
+        run = datetime.datetime.combine(now.date(), parse_time_of_day(value))
+        if run <= now:
+            run += datetime.timedelta(days=1)
+
+        runs.append(run)
+
+    if not runs:
+        raise exceptions.ConfigException('GC schedule does not have any times!')
+
+    return (min(runs) - now).total_seconds()
+
+
+async def run_gc_schedule(config: config_module.Config) -> None:
+    """
+    Runs the IPFS node's repo GC at the times of day configured in the 'gc' section of the config, until cancelled.
+
+    :param config:
+    :return:
+    """
+    times = (config['gc'] or {}).get('at')
+    if not times:
+        return
+
+    loop = asyncio.get_event_loop()
+    while True:
+        delay = seconds_until_next_run(times)
+        logger.info(f'Next IPFS repo GC will run in {delay:.0f} seconds')
+        await asyncio.sleep(delay)
+
+        logger.info('Running IPFS repo GC')
+        try:
+            await loop.run_in_executor(None, functools.partial(config.ipfs.repo.gc, quiet=True))
+        except ipfshttpclient.exceptions.Error:
+            logger.exception('IPFS repo GC failed!')
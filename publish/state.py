@@ -0,0 +1,188 @@
+import json
+import logging
+import pathlib
+import sqlite3
+import threading
+import time
+import typing
+
+logger = logging.getLogger('publish.state')
+
+STATE_FILENAME = 'state.sqlite3'
+"""
+Name of the database file of the state store in the data directory.
+"""
+
+STATE_ATTRIBUTES = ('last_ipfs_addr', 'last_commit_sha', 'ipns_published_at', 'ipns_published_addr')
+"""
+Repo's attributes that are runtime state, hence they are stored in the state store instead of the TOML config.
+"""
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS repos (
+    name TEXT PRIMARY KEY,
+    last_ipfs_addr TEXT,
+    last_commit_sha TEXT,
+    ipns_published_at REAL,
+    ipns_published_addr TEXT,
+    updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS versions (
+    repo TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    cid TEXT NOT NULL,
+    commit_sha TEXT,
+    published_at INTEGER NOT NULL,
+    PRIMARY KEY (repo, position)
+);
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    repo TEXT NOT NULL,
+    finished_at REAL NOT NULL,
+    record TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS jobs_finished_at ON jobs (finished_at);
+'''
+
+RepoState = typing.Dict[str, typing.Any]
+"""
+State of repo, dict with STATE_ATTRIBUTES keys and 'versions' key with list of the retained versions.
+"""
+
+JobRecord = typing.Dict[str, typing.Any]
+"""
+Record of finished publishing job, JSON serializable dict with at least 'id', 'repo' and 'finished_at' keys.
+"""
+
+
+class StateStore:
+    """
+    Embedded SQLite database with the runtime state of the repos (last published CID and commit, IPNS publish times
+    and the published versions), so the TOML config holds only the user's configuration and does not need to be
+    rewritten after every publish. It also keeps the history of the finished publishing jobs.
+
+    Every repo's state is one row, that is updated atomically together with its versions. The database is in WAL mode,
+    so the CLI can read it while the server writes.
+    """
+
+    path: pathlib.Path = None
+    """
+    Path to the database file.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(str(path), timeout=30, check_same_thread=False, isolation_level=None)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def load(self, name: str) -> typing.Optional[RepoState]:
+        """
+        Returns state of the repo or None if it is not stored.
+
+        :param name:
+        :return:
+        """
+        with self._lock:
+            row = self._connection.execute(f'SELECT {", ".join(STATE_ATTRIBUTES)} FROM repos WHERE name = ?',
+                                           (name,)).fetchone()
+            if row is None:
+                return None
+
+            versions = self._connection.execute('SELECT cid, commit_sha, published_at FROM versions WHERE repo = ? '
+                                                'ORDER BY position', (name,)).fetchall()
+
+        return dict(zip(STATE_ATTRIBUTES, row), versions=[_version(*version) for version in versions])
+
+    def save(self, name: str, state: RepoState) -> None:
+        """
+        Atomically replaces the state of the repo.
+
+        :param name:
+        :param state:
+        :return:
+        """
+        values = [state.get(attr) for attr in STATE_ATTRIBUTES]
+        versions = [(name, position, version['cid'], version.get('commit'), version['published_at'])
+                    for position, version in enumerate(state.get('versions') or [])]
+
+        with self._lock, self._transaction() as connection:
+            connection.execute(f'INSERT OR REPLACE INTO repos (name, {", ".join(STATE_ATTRIBUTES)}, updated_at) '
+                               f'VALUES (?, {", ".join("?" * len(STATE_ATTRIBUTES))}, ?)', [name] + values + [time.time()])
+            connection.execute('DELETE FROM versions WHERE repo = ?', (name,))
+            connection.executemany('INSERT INTO versions (repo, position, cid, commit_sha, published_at) '
+                                   'VALUES (?, ?, ?, ?, ?)', versions)
+
+    def remove(self, name: str) -> None:
+        with self._lock, self._transaction() as connection:
+            connection.execute('DELETE FROM repos WHERE name = ?', (name,))
+            connection.execute('DELETE FROM versions WHERE repo = ?', (name,))
+
+    def save_job(self, record: JobRecord, history_size: int) -> None:
+        """
+        Saves record of finished job, only the last `history_size` records are kept.
+
+        :param record:
+        :param history_size:
+        :return:
+        """
+        with self._lock, self._transaction() as connection:
+            connection.execute('INSERT OR REPLACE INTO jobs (id, repo, finished_at, record) VALUES (?, ?, ?, ?)',
+                               (record['id'], record['repo'], record['finished_at'], json.dumps(record)))
+            connection.execute('DELETE FROM jobs WHERE id NOT IN '
+                               '(SELECT id FROM jobs ORDER BY finished_at DESC LIMIT ?)', (history_size,))
+
+    def load_job(self, job_id: str) -> typing.Optional[JobRecord]:
+        with self._lock:
+            row = self._connection.execute('SELECT record FROM jobs WHERE id = ?', (job_id,)).fetchone()
+
+        return json.loads(row[0]) if row is not None else None
+
+    def load_jobs(self, repo: typing.Optional[str] = None, limit: int = 20) -> typing.List[JobRecord]:
+        """
+        Returns records of the last finished jobs, the newest first.
+
+        :param repo: Return only jobs of this repo
+        :param limit:
+        :return:
+        """
+        query = 'SELECT record FROM jobs {} ORDER BY finished_at DESC LIMIT ?'.format(
+            'WHERE repo = ?' if repo is not None else '')
+        params = (repo, limit) if repo is not None else (limit,)
+
+        with self._lock:
+            rows = self._connection.execute(query, params).fetchall()
+
+        return [json.loads(row[0]) for row in rows]
+
+    def _transaction(self) -> '_Transaction':
+        return _Transaction(self._connection)
+
+
+class _Transaction:
+    def __init__(self, connection: sqlite3.Connection):
+        self.connection = connection
+
+    def __enter__(self) -> sqlite3.Connection:
+        # The write lock is taken at the start, so concurrent writers wait instead of failing on upgrade of the lock
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.connection.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+
+
+def _version(cid: str, commit: typing.Optional[str], published_at: int) -> dict:
+    version = {'cid': cid, 'published_at': published_at}
+    if commit is not None:
+        version['commit'] = commit
+
+    return version
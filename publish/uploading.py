@@ -0,0 +1,228 @@
+from __future__ import annotations
+
+import concurrent.futures
+import logging
+import os
+import pathlib
+import threading
+import typing
+
+from publish import helpers
+
+ipfshttpclient = helpers.lazy_import('ipfshttpclient')
+
+
+logger = logging.getLogger('publish.uploading')
+
+EMPTY_DIR_CID = 'QmUNLLsPACCz1vLxQVkXqqLX5R1X345qqfHbsf67hvA3Nn'
+"""
+CID of empty UnixFS directory, that is used for adding empty directories into the published tree.
+"""
+
+SHARDS_PER_WORKER = 4
+"""
+Target number of shards per upload worker, so the workers stay busy even when the shards' sizes differ.
+"""
+
+MAX_SHARDS = 1000
+"""
+Maximal number of shards, as every shard has to be linked into the root with separate call.
+"""
+
+MAX_EXPANDED_ENTRIES = 1000
+"""
+Directories with more entries are not split into shards, as IPFS could represent them as HAMT sharded directories
+which can't be assembled by patching.
+"""
+
+ProgressCallback = typing.Callable[[dict], None]
+"""
+Callback that is called with every entry (dict with 'Name', 'Hash' and 'Size' keys) of the add's response.
+"""
+
+
+def add_directory(ipfs: ipfshttpclient.Client, directory: pathlib.Path, pin: bool = True,
+                  progress: typing.Optional[ProgressCallback] = None) -> str:
+    """
+    Adds the directory recursively to IPFS and returns the CID of its root.
+
+    The add's response is consumed as a stream, so only the current entry is held in memory, no matter how many
+    files the directory has. The root directory is the last entry of the response.
+
+    :param ipfs:
+    :param directory:
+    :param pin:
+    :param progress: Callback called for every added file and directory
+    :return:
+    """
+    logger.info(f'Adding directory {directory} to IPFS')
+
+    last_entry = None
+    for entry in ipfs.add(directory, recursive=True, pin=pin, stream=True):
+        if progress is not None:
+            progress(entry)
+
+        last_entry = entry
+
+    if last_entry is None:
+        raise ipfshttpclient.exceptions.ProtocolError(f'IPFS returned empty response for adding {directory}!')
+
+    return last_entry['Hash']
+
+
+class ProgressCounter:
+    """
+    Progress callback that counts the added entries and reports them every `interval` entries.
+    """
+
+    count: int = 0
+    """
+    Number of entries added so far.
+    """
+
+    def __init__(self, report: typing.Callable[[int], None], interval: int = 1000):
+        self.report = report
+        self.interval = interval
+        self.count = 0
+
+    def __call__(self, entry: dict) -> None:
+        self.count += 1
+
+        if self.count % self.interval == 0:
+            self.report(self.count)
+
+
+class _Entry:
+    __slots__ = ('path', 'size', 'is_dir', 'children')
+
+    def __init__(self, path: str, size: int, is_dir: bool = False,
+                 children: typing.Optional[typing.List['_Entry']] = None):
+        self.path = path
+        self.size = size
+        self.is_dir = is_dir
+        self.children = children
+
+    @property
+    def is_expandable(self) -> bool:
+        return self.children is not None and 0 < len(self.children) <= MAX_EXPANDED_ENTRIES
+
+
+def _scan(directory: pathlib.Path, relative_path: str = '') -> _Entry:
+    """
+    Scans the directory's tree with sizes of all subdirectories. Directories containing symlinks are marked as
+    not expandable, as symlinks are added to IPFS differently on their own.
+
+    :param directory:
+    :param relative_path:
+    :return:
+    """
+    children = []
+    has_symlink = False
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            child_path = f'{relative_path}/{entry.name}' if relative_path else entry.name
+
+            if entry.is_symlink():
+                has_symlink = True
+                children.append(_Entry(child_path, 0))
+            elif entry.is_dir():
+                children.append(_scan(pathlib.Path(entry.path), child_path))
+            else:
+                children.append(_Entry(child_path, entry.stat().st_size))
+
+    size = sum(child.size for child in children)
+    return _Entry(relative_path, size, True, None if has_symlink else children)
+
+
+def plan_shards(directory: pathlib.Path, concurrency: int) -> typing.Optional[typing.List[typing.Tuple[str, bool]]]:
+    """
+    Splits the directory into subtrees of roughly similar size, that can be added to IPFS independently.
+
+    The biggest directories are split into their entries until all shards are smaller than the target size
+    (total size divided by the number of wanted shards).
+
+    :param directory:
+    :param concurrency:
+    :return: List of the shards' paths relative to the directory with flag whether the shard is directory,
+             or None if the directory can't be split
+    """
+    root = _scan(directory)
+    if not root.is_expandable:
+        return None
+
+    target_size = root.size / (concurrency * SHARDS_PER_WORKER)
+    shards = list(root.children)
+
+    while len(shards) < MAX_SHARDS:
+        biggest = max((shard for shard in shards if shard.is_expandable), key=lambda x: x.size, default=None)
+        if biggest is None or biggest.size <= target_size \
+                or len(shards) + len(biggest.children) - 1 > MAX_SHARDS:
+            break
+
+        shards.remove(biggest)
+        shards.extend(biggest.children)
+
+    return sorted((shard.path, shard.is_dir) for shard in shards)
+
+
+def add_directory_sharded(ipfs: ipfshttpclient.Client, connect: typing.Callable[[], ipfshttpclient.Client],
+                          directory: pathlib.Path, concurrency: int, pin: bool = True,
+                          progress: typing.Optional[ProgressCallback] = None) -> str:
+    """
+    Adds the directory to IPFS by splitting it into subtrees that are added concurrently, each worker using its own
+    connection to the IPFS API. The root is then assembled by linking the subtrees' CIDs into empty directory.
+
+    With the default add's options the assembled root has the same CID as if the directory was added at once.
+
+    :param ipfs: Client used for assembling of the root
+    :param connect: Factory of the workers' clients
+    :param directory:
+    :param concurrency: Number of the workers
+    :param pin:
+    :param progress: Callback called for every added file and directory, it is called from the workers' threads
+    :return:
+    """
+    shards = plan_shards(directory, concurrency) if concurrency > 1 else None
+    if not shards:
+        return add_directory(ipfs, directory, pin, progress)
+
+    logger.info(f'Adding directory {directory} to IPFS in {len(shards)} shards with {concurrency} workers')
+    local = threading.local()
+    clients = []
+    progress_lock = threading.Lock()
+
+    def locked_progress(entry: dict) -> None:
+        with progress_lock:
+            progress(entry)
+
+    def add_shard(shard: typing.Tuple[str, bool]) -> str:
+        if not hasattr(local, 'client'):
+            local.client = connect()
+            clients.append(local.client)
+
+        path, is_dir = shard
+        if is_dir:
+            return add_directory(local.client, directory / path, pin=False,
+                                 progress=locked_progress if progress is not None else None)
+
+        result = local.client.add(directory / path, pin=False)
+        if progress is not None:
+            locked_progress(result)
+
+        return result['Hash']
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            cids = list(executor.map(add_shard, shards))
+    finally:
+        for client in clients:
+            client.close()
+
+    root = EMPTY_DIR_CID
+    for (path, _), cid in zip(shards, cids):
+        root = ipfs.object.patch.add_link(root, path, cid, create=True)['Hash']
+
+    if pin:
+        ipfs.pin.add(root)
+
+    return root
@@ -2,7 +2,14 @@ import pathlib
 
 import pytest
 
-from publish import config as config_module
+from publish import config as config_module, ENV_NAME_DATA_DIR
+
+
+@pytest.fixture(autouse=True)
+def data_dir(tmp_path_factory, monkeypatch):
+    path = tmp_path_factory.mktemp('data')
+    monkeypatch.setenv(ENV_NAME_DATA_DIR, str(path))
+    return path
 
 
 @pytest.fixture
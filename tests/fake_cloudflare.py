@@ -0,0 +1,70 @@
+import threading
+import time
+import typing
+
+import CloudFlare
+
+
+class FakeCloudFlare:
+    """
+    Local stand-in for the CloudFlare's client, that keeps the DNS records in memory and records all the requests.
+    When `rate_limit` is set, requests over the limit of requests per second fail with rate limiting error, as with
+    the real API.
+    """
+
+    def __init__(self, records: typing.Optional[typing.Dict[typing.Tuple[str, str], dict]] = None,
+                 rate_limit: typing.Optional[float] = None, valid_token: bool = True):
+        self.records = records or {}
+        self.rate_limit = rate_limit
+        self.valid_token = valid_token
+        self.requests: typing.List[tuple] = []
+        self._lock = threading.Lock()
+
+        self.user = _Namespace(tokens=_Namespace(verify=self._verify))
+        self.zones = _Namespace(dns_records=_Namespace(get=self._get, put=self._put, patch=self._patch))
+
+    def requests_of(self, method: str) -> typing.List[tuple]:
+        return [request for request in self.requests if request[0] == method]
+
+    def _request(self, *request) -> None:
+        with self._lock:
+            now = time.monotonic()
+            self.requests.append(request + (now,))
+
+            if self.rate_limit is not None:
+                recent = [r for r in self.requests if now - r[-1] < 1]
+                if len(recent) > self.rate_limit:
+                    raise CloudFlare.exceptions.CloudFlareAPIError(10000, 'Rate limited')
+
+    def _record(self, zone_id: str, dns_id: str) -> dict:
+        if (zone_id, dns_id) not in self.records:
+            raise CloudFlare.exceptions.CloudFlareAPIError(81044, 'Record does not exist.')
+
+        return self.records[(zone_id, dns_id)]
+
+    def _verify(self):
+        self._request('verify')
+        if not self.valid_token:
+            raise CloudFlare.exceptions.CloudFlareAPIError(1000, 'Invalid API Token')
+
+        return {'status': 'active'}
+
+    def _get(self, zone_id: str, dns_id: str) -> dict:
+        self._request('get', zone_id, dns_id)
+        return dict(self._record(zone_id, dns_id))
+
+    def _put(self, zone_id: str, dns_id: str, data: dict) -> dict:
+        self._request('put', zone_id, dns_id)
+        self._record(zone_id, dns_id)
+        self.records[(zone_id, dns_id)] = dict(data)
+        return data
+
+    def _patch(self, zone_id: str, dns_id: str, data: dict) -> dict:
+        self._request('patch', zone_id, dns_id)
+        self._record(zone_id, dns_id).update(data)
+        return self.records[(zone_id, dns_id)]
+
+
+class _Namespace:
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
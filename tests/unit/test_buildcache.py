@@ -0,0 +1,59 @@
+import pathlib
+
+import pytest
+
+from publish import buildcache, exceptions
+
+
+def make_tree(path: pathlib.Path, files: dict) -> pathlib.Path:
+    for name, content in files.items():
+        (path / name).parent.mkdir(parents=True, exist_ok=True)
+        (path / name).write_text(content)
+
+    return path
+
+
+class TestBuildCache:
+    def test_output_roundtrip(self, tmp_path):
+        cache = buildcache.BuildCache(tmp_path / 'cache', keep=2)
+        output = make_tree(tmp_path / 'output', {'index.html': 'built', 'css/style.css': 'style', '.git': 'worktree'})
+
+        assert not cache.restore_output('key1', tmp_path / 'restored')
+        cache.store_output('key1', output)
+
+        restored = make_tree(tmp_path / 'restored', {'stale.html': 'stale'})
+        assert cache.restore_output('key1', restored)
+        assert sorted(path.relative_to(restored).as_posix() for path in restored.rglob('*')) == \
+            ['css', 'css/style.css', 'index.html']
+
+    def test_output_limit(self, tmp_path):
+        cache = buildcache.BuildCache(tmp_path / 'cache', keep=2)
+        output = make_tree(tmp_path / 'output', {'index.html': 'built'})
+
+        for key in ('key1', 'key2', 'key3'):
+            cache.store_output(key, output)
+
+        assert sorted(path.name for path in (cache.path / buildcache.OUTPUTS_DIR).iterdir()) == ['key2', 'key3']
+
+    def test_dependencies(self, tmp_path):
+        cache = buildcache.BuildCache(tmp_path / 'cache')
+        first = make_tree(tmp_path / 'first', {'vendor/lib.js': 'committed'})
+
+        managed = cache.restore_dependencies(first, ['node_modules', 'vendor'])
+        assert managed == ['node_modules']
+
+        # Simulates the build
+        make_tree(first, {'node_modules/dep/index.js': 'dep'})
+
+        cache.save_dependencies(first, managed)
+        assert not (first / 'node_modules').exists()
+        assert (first / 'vendor' / 'lib.js').exists()
+
+        second = make_tree(tmp_path / 'second', {'index.html': 'site'})
+        cache.restore_dependencies(second, ['node_modules'])
+        assert (second / 'node_modules' / 'dep' / 'index.js').read_text() == 'dep'
+
+    @pytest.mark.parametrize('path', ('../outside', '/', 'some/../../outside'))
+    def test_invalid_cache_path(self, path):
+        with pytest.raises(exceptions.ConfigException):
+            buildcache.validate_cache_path(path)
@@ -0,0 +1,46 @@
+from publish import buildlog
+from .. import factories
+
+
+class TestBuildLog:
+    def test_rotation(self, tmp_path):
+        log = buildlog.BuildLog(tmp_path / 'job.log', max_bytes=10, backup_count=2)
+
+        for chunk in (b'a' * 8, b'b' * 8, b'c' * 8, b'd' * 8):
+            log.write(chunk)
+        log.close()
+
+        assert log.path.read_bytes() == b'd' * 8
+        assert (tmp_path / 'job.log.1').read_bytes() == b'c' * 8
+        assert (tmp_path / 'job.log.2').read_bytes() == b'b' * 8
+        assert not (tmp_path / 'job.log.3').exists()
+        assert log.finished
+
+    def test_tail_and_read(self, tmp_path):
+        log = buildlog.BuildLog(tmp_path / 'job.log')
+        log.write(b''.join(f'line {x}\n'.encode() for x in range(100)))
+
+        data, offset = log.tail(2)
+        assert data == b'line 98\nline 99\n'
+        assert log.tail(0) == (b'', offset)
+
+        log.write(b'new line\n')
+        assert log.read(offset) == (b'new line\n', offset + 9)
+        log.close()
+
+        assert list(log.follow(offset, poll_interval=0)) == [b'new line\n']
+
+    def test_cleanup(self):
+        config = factories.ConfigFactory()
+        config['logs'] = {'keep': 2}
+
+        for index in range(4):
+            log = buildlog.BuildLog.for_job(config, 'some_repo', f'{index:032x}')
+            log.write(b'output')
+            log.close()
+
+        buildlog.BuildLog.cleanup(config, 'some_repo')
+
+        remaining = sorted(path.name for path in buildlog.BuildLog.repo_dir(config, 'some_repo').iterdir())
+        assert len(remaining) == 4
+        assert buildlog.BuildLog.latest(config, 'some_repo').path.exists()
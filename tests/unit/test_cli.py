@@ -0,0 +1,36 @@
+import os
+import subprocess
+import sys
+
+import pytest
+import toml
+
+from benchmarks import bench_startup
+from publish import ENV_NAME_CONFIG_PATH, ENV_NAME_DATA_DIR
+
+
+def run_cli(tmp_path, *args):
+    config_path = tmp_path / 'config.toml'
+    config_path.write_text(toml.dumps({'host': 'localhost', 'port': 8070, 'repos': {'repo': {
+        'name': 'repo', 'git_repo_url': 'https://github.com/AuHau/ipfs-publish', 'secret': 'secret',
+        'ipns': {'ipns_key': 'ipfs_publish_repo', 'ipns_addr': '/ipns/some-key/'},
+        'cloudflare': {'zone_id': 'zone', 'dns_id': 'dns'},
+    }}}))
+
+    env = dict(os.environ, **{ENV_NAME_CONFIG_PATH: str(config_path), ENV_NAME_DATA_DIR: str(tmp_path / 'data')})
+    script = bench_startup.COMMAND_SCRIPT.format(modules=bench_startup.HEAVY_MODULES)
+    result = subprocess.run([sys.executable, '-c', script, *args],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, check=True)
+    loaded_modules = result.stderr.decode('utf-8').splitlines()[-1]
+    return result.stdout.decode('utf-8').splitlines(), [name for name in loaded_modules.split(',') if name]
+
+
+@pytest.mark.parametrize(('args', 'expected_output'), (
+    (('list',), 'repo'),
+    (('show', 'repo'), 'https://github.com/AuHau/ipfs-publish'),
+))
+def test_command_does_not_load_heavy_modules(tmp_path, args, expected_output):
+    output, loaded_modules = run_cli(tmp_path, *args)
+
+    assert any(expected_output in line for line in output)
+    assert loaded_modules == []
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from publish import cloudflare, exceptions
+from .. import factories
+from ..fake_cloudflare import FakeCloudFlare
+
+
+def make_cf(mocker, records=('dns',), zones=('zone',), **kwargs) -> FakeCloudFlare:
+    cloudflare.clear_cache()
+    cf = FakeCloudFlare({(zone, dns): {'id': dns, 'type': 'TXT', 'content': 'dnslink=/ipfs/old/'}
+                         for zone in zones for dns in records}, **kwargs)
+    mocker.patch.object(cloudflare, '_client', cf)
+    return cf
+
+
+def make_repo(zone_id='zone', dns_id='dns'):
+    repo = factories.RepoFactory(zone_id=zone_id, dns_id=dns_id)
+    repo.config['cloudflare'] = {'batch_delay': 0.01, 'rate_limit': 100}
+    return repo
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    yield
+    cloudflare.clear_cache()
+
+
+class TestUpdateDns:
+    def test_update(self, mocker):
+        cf = make_cf(mocker)
+        asyncio.run(make_repo().update_dns('/ipfs/new/'))
+
+        assert cf.records[('zone', 'dns')] == {'id': 'dns', 'type': 'TXT', 'content': 'dnslink=/ipfs/new/'}
+        assert len(cf.requests_of('patch')) == 1
+
+    def test_unchanged_record_is_skipped(self, mocker):
+        cf = make_cf(mocker)
+        repo = make_repo()
+        asyncio.run(repo.update_dns('/ipfs/new/'))
+        asyncio.run(repo.update_dns('/ipfs/new/'))
+
+        assert len(cf.requests_of('verify')) == 1
+        assert len(cf.requests_of('patch')) == 1
+
+    def test_token_verification_cached(self, mocker):
+        cf = make_cf(mocker)
+        repo = make_repo()
+        asyncio.run(repo.update_dns('/ipfs/new/'))
+        asyncio.run(repo.update_dns('/ipfs/newer/'))
+        assert len(cf.requests_of('verify')) == 1
+
+        mocker.patch.object(cloudflare, '_token_verified_at', cloudflare._token_verified_at - cloudflare.TOKEN_VERIFY_TTL)
+        asyncio.run(repo.update_dns('/ipfs/newest/'))
+        assert len(cf.requests_of('verify')) == 2
+
+    def test_invalid_token(self, mocker):
+        cf = make_cf(mocker, valid_token=False)
+
+        with pytest.raises(exceptions.PublishingException):
+            asyncio.run(make_repo().update_dns('/ipfs/new/'))
+
+        assert cf.requests_of('patch') == []
+
+    def test_missing_record(self, mocker):
+        make_cf(mocker)
+
+        with pytest.raises(exceptions.PublishingException):
+            asyncio.run(make_repo(dns_id='missing').update_dns('/ipfs/new/'))
+
+
+class TestDnsUpdateQueue:
+    def test_updates_are_coalesced(self, mocker):
+        cf = make_cf(mocker, records=('first', 'second'))
+
+        async def run():
+            queue = cloudflare.DnsUpdateQueue(batch_delay=0.01)
+            return await asyncio.gather(queue.update('zone', 'first', '/ipfs/a/'),
+                                        queue.update('zone', 'first', '/ipfs/b/'),
+                                        queue.update('zone', 'second', '/ipfs/c/'))
+
+        assert asyncio.run(run()) == ['/ipfs/b/', '/ipfs/b/', '/ipfs/c/']
+        assert len(cf.requests_of('patch')) == 2
+        assert cf.records[('zone', 'first')]['content'] == 'dnslink=/ipfs/b/'
+
+    def test_rate_limit(self, mocker):
+        records = [f'dns{i}' for i in range(5)]
+        cf = make_cf(mocker, records=records, zones=('zone1', 'zone2'), rate_limit=10)
+
+        async def run():
+            queue = cloudflare.DnsUpdateQueue(rate_limit=5, concurrency=4, batch_delay=0)
+            await asyncio.gather(*(queue.update(zone, dns, '/ipfs/new/')
+                                   for zone in ('zone1', 'zone2') for dns in records))
+
+        asyncio.run(run())
+
+        # Verify and 10 patches at 5 requests per second with burst of 4, none of them was rate limited
+        assert len(cf.requests) == 11
+        assert all(record['content'] == 'dnslink=/ipfs/new/' for record in cf.records.values())
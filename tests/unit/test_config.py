@@ -0,0 +1,146 @@
+import asyncio
+import threading
+
+import pytest
+import toml
+
+from publish import ENV_NAME_DATA_DIR, config as config_module, exceptions
+
+
+class TestConfigState:
+    def test_state_migrated_from_toml(self, tmp_path, monkeypatch):
+        monkeypatch.setenv(ENV_NAME_DATA_DIR, str(tmp_path / 'data'))
+        path = tmp_path / 'config.toml'
+        path.write_text(toml.dumps({'host': 'localhost', 'port': 8070, 'repos': {'repo': {
+            'name': 'repo', 'git_repo_url': 'https://example.com/repo.git', 'secret': 'secret',
+            'last_ipfs_addr': '/ipfs/some-hash/', 'last_commit_sha': 'sha',
+        }}}))
+
+        config = config_module.Config(path)
+
+        assert 'last_ipfs_addr' not in toml.load(path)['repos']['repo']
+        assert config.state.load('repo')['last_ipfs_addr'] == '/ipfs/some-hash/'
+
+        config.repos['repo'].last_ipfs_addr = '/ipfs/other-hash/'
+        config.repos['repo'].save_state()
+
+        reloaded = config_module.Config(path)
+        assert not reloaded.repos.is_built('repo')
+        assert reloaded.repos['repo'].last_ipfs_addr == '/ipfs/other-hash/'
+        assert reloaded.repos['repo'].last_commit_sha == 'sha'
+
+
+class TestConfigReload:
+    @staticmethod
+    def write_config(path, repos, **data):
+        path.write_text(toml.dumps(dict(host='localhost', port=8070, repos={
+            name: dict(name=name, git_repo_url=f'https://example.com/{name}.git', secret='secret', **values)
+            for name, values in repos.items()
+        }, **data)))
+
+    def test_reload(self, tmp_path, monkeypatch):
+        monkeypatch.setenv(ENV_NAME_DATA_DIR, str(tmp_path / 'data'))
+        path = tmp_path / 'config.toml'
+        self.write_config(path, {'kept': {}, 'changed': {'branch': 'master'}, 'removed': {}})
+
+        config = config_module.Config(path)
+        changed = config.repos['changed']
+        changed.last_ipfs_addr = '/ipfs/some-hash/'
+        ipfs = config._ipfs = object()
+        assert not config.is_changed
+
+        self.write_config(path, {'kept': {}, 'changed': {'branch': 'gh-pages'}, 'added': {}}, watch_interval=5)
+        assert config.is_changed
+
+        assert config.reload() == (['added'], ['removed'], ['changed'])
+        assert set(config.repos) == {'kept', 'changed', 'added'}
+        assert config.repos['changed'] is changed
+        assert changed.branch == 'gh-pages'
+        assert changed.last_ipfs_addr == '/ipfs/some-hash/'
+        assert config['watch_interval'] == 5
+        assert config._ipfs is ipfs
+        assert not config.is_changed
+
+    def test_invalid_config_is_not_applied(self, tmp_path, monkeypatch):
+        monkeypatch.setenv(ENV_NAME_DATA_DIR, str(tmp_path / 'data'))
+        path = tmp_path / 'config.toml'
+        self.write_config(path, {'repo': {}})
+
+        config = config_module.Config(path)
+        path.write_text('host = ')
+
+        with pytest.raises(exceptions.ConfigException):
+            config.reload()
+
+        assert set(config.repos) == {'repo'}
+        assert not config.is_changed
+
+    def test_watch_reloads_in_executor(self, tmp_path, monkeypatch, mocker):
+        monkeypatch.setenv(ENV_NAME_DATA_DIR, str(tmp_path / 'data'))
+        path = tmp_path / 'config.toml'
+        self.write_config(path, {'repo': {}})
+
+        config = config_module.Config(path)
+        threads = []
+        mocker.patch.object(config, 'reload', side_effect=lambda: threads.append(threading.current_thread()) or
+                            ([], [], []))
+        self.write_config(path, {'repo': {}, 'added': {}})
+
+        async def run():
+            watcher = asyncio.ensure_future(config_module.watch(config, 0.01))
+            while not threads:
+                await asyncio.sleep(0.01)
+            watcher.cancel()
+
+        asyncio.run(asyncio.wait_for(run(), 5))
+        assert threads[0] is not threading.main_thread()
+
+
+class TestRepoRegistry:
+    def test_repos_built_on_access(self, tmp_path, mocker):
+        path = tmp_path / 'config.toml'
+        TestConfigReload.write_config(path, {'first': {}, 'second': {}})
+        build = mocker.spy(config_module.RepoRegistry, '_build')
+
+        config = config_module.Config(path)
+        assert set(config.repos) == {'first', 'second'}
+        assert 'first' in config.repos
+        assert build.call_count == 0
+
+        assert config.repos['first'] is config.repos['first']
+        assert build.call_count == 1
+        assert config.repos.is_built('first')
+        assert not config.repos.is_built('second')
+
+    def test_save_serializes_only_changed_repos(self, tmp_path, mocker):
+        path = tmp_path / 'config.toml'
+        TestConfigReload.write_config(path, {'changed': {'branch': 'master'}, 'kept': {}, 'unused': {}})
+
+        config = config_module.Config(path)
+        config.repos['changed'].branch = 'gh-pages'
+        config.repos['kept']
+        config.save()
+
+        dumps = mocker.spy(config_module.toml, 'dumps')
+        config.repos['changed'].branch = 'master'
+        config.save()
+
+        # Config's top-level data and the changed repo
+        assert dumps.call_count == 2
+
+        data = toml.load(path)
+        assert data['repos']['changed']['branch'] == 'master'
+        assert set(data['repos']) == {'changed', 'kept', 'unused'}
+        assert data['host'] == 'localhost'
+
+    def test_reload_compares_tables(self, tmp_path):
+        path = tmp_path / 'config.toml'
+        TestConfigReload.write_config(path, {'repo': {'branch': 'master'}})
+        config = config_module.Config(path)
+
+        TestConfigReload.write_config(path, {'repo': {'branch': 'gh-pages'}, 'other': {}})
+        assert config.reload() == (['other'], [], ['repo'])
+        assert config.repos['repo'].branch == 'gh-pages'
+
+        TestConfigReload.write_config(path, {'repo': {'branch': 'gh-pages'}, 'other': {}}, watch_interval=5)
+        assert config.reload() == ([], [], [])
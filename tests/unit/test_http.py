@@ -0,0 +1,139 @@
+import asyncio
+import hashlib
+import hmac
+import json
+
+import pytest
+
+from publish import http, jobs, state, buildlog, config as config_module
+from .. import factories
+
+
+@pytest.fixture
+def repo(mocker):
+    async def publish(cancel=None, job_id=None, commit=None, stage=None):
+        return None
+
+    repo = factories.RepoFactory(name='repo', secret='secret')
+    # Coroutine function as side effect, as AsyncMock is not available on Python 3.7
+    mocker.patch.object(repo, 'publish_repo', side_effect=publish)
+
+    config = factories.ConfigFactory()
+    config.repos[repo.name] = repo
+    config.repos['other'] = factories.RepoFactory(name='other', secret='other-secret')
+    mocker.patch.object(config_module.Config, '_instance', config, create=True)
+    return repo
+
+
+@pytest.fixture
+def scheduler(mocker, tmp_path):
+    scheduler = jobs.Scheduler(store=state.StateStore(tmp_path / state.STATE_FILENAME))
+    mocker.patch.object(jobs, '_scheduler', scheduler)
+    return scheduler
+
+
+async def get(path, **query_string):
+    response = await http.app.test_client().get(path, query_string=query_string)
+    return response.status_code, (await response.get_json() if response.status_code in (200, 202) else None)
+
+
+class TestJobsEndpoints:
+    def test_jobs_require_secret(self, repo, scheduler):
+        async def run():
+            job = scheduler.submit(repo)
+            await job.done
+
+            return [
+                await get('/jobs'),
+                await get('/jobs', repo='repo', secret='other-secret'),
+                await get('/jobs', repo='repo', secret='secret'),
+                await get(f'/jobs/{job.id}'),
+                await get(f'/jobs/{job.id}', secret='other-secret'),
+                await get(f'/jobs/{job.id}', secret='secret'),
+                await get(f'/jobs/{job.id}/wait', secret='other-secret'),
+                await get('/jobs/history', repo='other', secret='secret'),
+            ], job
+
+        responses, job = asyncio.run(run())
+
+        assert [status for status, _ in responses] == [400, 403, 200, 403, 403, 200, 403, 403]
+        assert [record['id'] for record in responses[2][1]['finished']] == [job.id]
+        assert responses[5][1]['status'] == jobs.STATUS_SKIPPED
+
+    def test_wait_timeout(self, repo, scheduler):
+        async def run():
+            release = asyncio.Event()
+
+            async def publish(cancel=None, job_id=None, commit=None, stage=None):
+                await release.wait()
+
+            repo.publish_repo.side_effect = publish
+            job = scheduler.submit(repo)
+            timed_out = await get(f'/jobs/{job.id}/wait', secret='secret', timeout='0.05')
+
+            asyncio.get_event_loop().call_later(0.05, release.set)
+            finished = await get(f'/jobs/{job.id}/wait', secret='secret', timeout='5')
+            return timed_out, finished
+
+        (timed_out_status, timed_out), (finished_status, finished) = asyncio.run(run())
+
+        assert (timed_out_status, timed_out['status']) == (202, jobs.STATUS_RUNNING)
+        assert (finished_status, finished['status']) == (200, jobs.STATUS_SKIPPED)
+
+
+class TestLogsEndpoint:
+    def test_lines(self, repo):
+        log = buildlog.BuildLog.for_job(repo.config, repo.name, 'a' * 32)
+        log.write(b'first\nsecond\n')
+        log.close()
+
+        async def run():
+            responses = []
+            for lines in ('1', '0', '-1', 'x'):
+                response = await http.app.test_client().get('/logs/repo', query_string={'secret': 'secret',
+                                                                                        'lines': lines})
+                responses.append((response.status_code, await response.get_data()))
+
+            return responses
+
+        responses = asyncio.run(run())
+        assert [status for status, _ in responses] == [200, 200, 400, 400]
+        assert [data for _, data in responses[:2]] == [b'second\n', b'']
+
+
+class TestGenericHandler:
+    def test_secret(self, repo, scheduler):
+        async def run():
+            statuses = []
+            for query_string in ({}, {'secret': 'other-secret'}, {'secret': 'secret'}):
+                response = await http.app.test_client().post('/publish/repo', query_string=query_string)
+                statuses.append(response.status_code)
+
+            await scheduler.get_job((await response.get_json())['job_id']).done
+            return statuses
+
+        assert asyncio.run(run()) == [403, 403, 200]
+
+
+class TestGithubHandler:
+    def test_skipped_requests_return_job_status(self, mocker, scheduler):
+        repo = factories.GithubRepoFactory(name='site', git_repo_url='https://github.com/org/site', secret='secret',
+                                           branch='master', last_commit_sha='a' * 40)
+        config = factories.ConfigFactory()
+        config.repos[repo.name] = repo
+        mocker.patch.object(config_module.Config, '_instance', config, create=True)
+
+        async def post(delivery_id, commit):
+            body = json.dumps({'ref': 'refs/heads/master', 'after': commit}).encode('utf-8')
+            signature = hmac.new(b'secret', msg=body, digestmod=hashlib.sha1).hexdigest()
+            response = await http.app.test_client().post('/publish/site', data=body, headers={
+                'Content-Type': 'application/json', 'X-Hub-Signature': f'sha1={signature}',
+                'X-GitHub-Event': 'push', 'X-GitHub-Delivery': delivery_id,
+            })
+            return await response.get_json()
+
+        expected = {'job_id': None, 'status': jobs.STATUS_SKIPPED}
+        assert asyncio.run(post('published', 'a' * 40)) == expected
+
+        scheduler.remember_delivery(repo, 'repeated')
+        assert asyncio.run(post('repeated', 'b' * 40)) == expected
@@ -0,0 +1,111 @@
+import subprocess
+
+import git
+import pytest
+import toml
+
+from publish import importing, publishing, exceptions
+from .. import factories
+
+
+@pytest.fixture(autouse=True)
+def clear_refs_cache():
+    publishing.ls_remote.cache_clear()
+    yield
+    publishing.ls_remote.cache_clear()
+
+
+@pytest.fixture
+def refs(mocker):
+    return mocker.patch.object(publishing, 'ls_remote',
+                               return_value=publishing.RemoteRefs(['master', 'gh-pages'], 'master'))
+
+
+@pytest.fixture
+def config(mocker):
+    config = factories.ConfigFactory()
+    config._ipfs = mocker.Mock()
+    config._ipfs.key.list.return_value = {'Keys': [{'Name': 'ipfs_publish_existing', 'Id': 'existing-id'}]}
+
+    client = mocker.Mock()
+    client.key.gen.side_effect = lambda name, _: {'Name': name, 'Id': f'{name}-id'}
+    mocker.patch.object(config, 'connect_ipfs', return_value=client)
+    return config
+
+
+def test_remote_refs_fetched_once(tmp_path, mocker):
+    origin = git.Repo.init(str(tmp_path / 'origin'))
+    origin.index.commit('first')
+    origin.create_head('feature/x')
+    run_spy = mocker.spy(subprocess, 'run')
+
+    url = origin.working_tree_dir
+    assert publishing.validate_branch(url, 'feature/x')
+    assert not publishing.validate_branch(url, 'other')
+    assert publishing.get_default_branch(url) == origin.active_branch.name
+    assert run_spy.call_count == 1
+
+
+def test_load_specs(tmp_path):
+    path = tmp_path / 'repos.toml'
+    path.write_text(toml.dumps({'defaults': {'pin': False}, 'repos': [
+        {'git_repo_url': 'https://example.com/a'}, {'git_repo_url': 'https://example.com/b', 'pin': True},
+    ]}))
+
+    assert importing.load_specs(path) == [{'git_repo_url': 'https://example.com/a', 'pin': False},
+                                          {'git_repo_url': 'https://example.com/b', 'pin': True}]
+
+    path.write_text('[defaults]\npin = false\n')
+    with pytest.raises(exceptions.ConfigException):
+        importing.load_specs(path)
+
+
+def test_import_repos(config, refs):
+    repos = importing.import_repos(config, [
+        {'git_repo_url': 'https://github.com/org/site', 'name': 'Site'},
+        {'git_repo_url': 'https://example.com/docs', 'branch': 'gh-pages', 'secret': 'secret'},
+        {'git_repo_url': 'https://example.com/existing', 'ipns_key': 'ipfs_publish_existing'},
+        {'git_repo_url': 'https://example.com/no-ipns', 'ipns': False, 'after_publish_bin': 'true'},
+    ])
+
+    site, docs, existing, no_ipns = repos
+    assert isinstance(site, publishing.GithubRepo)
+    assert (site.name, site.branch, site.ipns_addr) == ('site', 'master', '/ipns/ipfs_publish_site-id/')
+    assert len(site.secret) == 25
+    assert (docs.branch, docs.secret) == ('gh-pages', 'secret')
+    assert existing.ipns_addr == '/ipns/existing-id/'
+    assert (no_ipns.ipns_key, no_ipns.ipns_addr) == (None, None)
+
+    config._ipfs.key.list.assert_called_once()
+    assert config.connect_ipfs.return_value.key.gen.call_count == 2
+    assert not config.repos
+
+
+def test_import_repos_invalid(config, refs):
+    with pytest.raises(exceptions.RepoException) as e:
+        importing.import_repos(config, [
+            {'git_repo_url': 'https://example.com/site'},
+            {'git_repo_url': 'https://example.com/site'},
+            {'git_repo_url': 'https://example.com/other', 'branch': 'missing'},
+            {'git_repo_url': 'https://example.com/other', 'unknown': 1},
+            {'git_repo_url': 'not-url'},
+        ])
+
+    errors = str(e.value).splitlines()[1:]
+    assert [error.split(' ')[1] for error in errors] == ['#2', '#3', '#4', '#5']
+    assert 'already exists' in errors[0]
+    config._ipfs.key.list.assert_not_called()
+
+
+def test_import_repos_invalid_options(config, refs):
+    with pytest.raises(exceptions.RepoException) as e:
+        importing.import_repos(config, [
+            {'git_repo_url': 'https://example.com/site'},
+            {'git_repo_url': 'https://example.com/docs', 'clone_strategy': 'unknown'},
+            {'git_repo_url': 'https://example.com/other', 'zone_id': 'zone'},
+        ])
+
+    errors = str(e.value).splitlines()[1:]
+    assert [error.split(' ')[1] for error in errors] == ['#2', '#3']
+    config._ipfs.key.list.assert_not_called()
+    config.connect_ipfs.return_value.key.gen.assert_not_called()
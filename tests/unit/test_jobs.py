@@ -0,0 +1,200 @@
+import asyncio
+
+import pytest
+
+from publish import jobs, publishing, replication, state, exceptions
+from .. import factories
+
+
+def make_repo(mocker, name, publish=None, **kwargs) -> publishing.GenericRepo:
+    repo: publishing.GenericRepo = factories.RepoFactory(name=name, **kwargs)
+    mocker.patch.object(repo, 'publish_repo', side_effect=publish)
+    return repo
+
+
+async def wait_for_all(submitted):
+    await asyncio.gather(*(job.done for job in submitted))
+
+
+class TestScheduler:
+    def test_burst_is_coalesced(self, mocker):
+        async def run():
+            release = asyncio.Event()
+
+            async def publish(cancel=None, job_id=None, commit=None, stage=None):
+                await release.wait()
+                return '/ipfs/some-hash/'
+
+            repo = make_repo(mocker, 'repo', publish)
+            scheduler = jobs.Scheduler()
+            submitted = [scheduler.submit(repo) for _ in range(10)]
+            release.set()
+            await wait_for_all(submitted)
+            return repo, submitted
+
+        repo, submitted = asyncio.run(run())
+
+        assert repo.publish_repo.call_count == 2
+        assert len({job.id for job in submitted}) == 2
+        assert all(job.status == jobs.STATUS_FINISHED for job in submitted)
+
+    def test_concurrency_limit(self, mocker):
+        counters = {'running': 0, 'max': 0}
+
+        async def publish(cancel=None, job_id=None, commit=None, stage=None):
+            counters['running'] += 1
+            counters['max'] = max(counters['max'], counters['running'])
+            await asyncio.sleep(0.01)
+            counters['running'] -= 1
+
+        async def run():
+            scheduler = jobs.Scheduler(concurrency=2)
+            await wait_for_all([scheduler.submit(make_repo(mocker, f'repo{i}', publish)) for i in range(6)])
+
+        asyncio.run(run())
+        assert counters['max'] == 2
+
+    def test_fair_queuing(self, mocker):
+        order = []
+
+        def publisher(name):
+            async def publish(cancel=None, job_id=None, commit=None, stage=None):
+                order.append(name)
+
+            return publish
+
+        async def run():
+            scheduler = jobs.Scheduler(concurrency=1)
+            scheduler._costs = {'slow': 1200.0, 'small': 10.0}
+
+            blocker = scheduler.submit(make_repo(mocker, 'blocker', publisher('blocker')))
+            submitted = [scheduler.submit(make_repo(mocker, 'slow', publisher('slow'))),
+                         scheduler.submit(make_repo(mocker, 'small', publisher('small')))]
+            await wait_for_all([blocker] + submitted)
+
+        asyncio.run(run())
+        assert order == ['blocker', 'small', 'slow']
+
+    def test_superseded_build_is_cancelled(self, mocker):
+        calls = []
+
+        async def publish(cancel=None, job_id=None, commit=None, stage=None):
+            calls.append(cancel)
+            if len(calls) == 1:
+                await cancel.wait()
+                raise exceptions.BuildCancelledException('cancelled')
+
+            return '/ipfs/some-hash/'
+
+        async def run():
+            repo = make_repo(mocker, 'repo', publish)
+            scheduler = jobs.Scheduler()
+            first = scheduler.submit(repo)
+            await asyncio.sleep(0)
+            second = scheduler.submit(repo)
+            await wait_for_all([first, second])
+            return first, second
+
+        first, second = asyncio.run(run())
+        assert first.status == jobs.STATUS_CANCELLED
+        assert second.status == jobs.STATUS_FINISHED
+
+    def test_failed_publish(self, mocker):
+        async def run():
+            scheduler = jobs.Scheduler()
+            job = scheduler.submit(make_repo(mocker, 'repo', RuntimeError('boom')))
+            await job.done
+            return scheduler, job
+
+        scheduler, job = asyncio.run(run())
+        assert job.status == jobs.STATUS_FAILED
+        assert job.error == 'boom'
+        assert not scheduler.running
+
+    def test_queue_full(self, mocker):
+        async def run():
+            release = asyncio.Event()
+
+            async def publish(cancel=None, job_id=None, commit=None, stage=None):
+                await release.wait()
+                return '/ipfs/some-hash/'
+
+            scheduler = jobs.Scheduler(concurrency=1, max_queued=1)
+            running = scheduler.submit(make_repo(mocker, 'running', publish))
+            queued = scheduler.submit(make_repo(mocker, 'queued'))
+
+            with pytest.raises(exceptions.QueueFullException):
+                scheduler.submit(make_repo(mocker, 'rejected'))
+
+            release.set()
+            await wait_for_all([running, queued])
+
+        asyncio.run(run())
+
+    def test_duplicate_delivery(self):
+        scheduler = jobs.Scheduler()
+        repo = factories.RepoFactory()
+
+        assert not scheduler.is_duplicate(repo, 'delivery-1')
+        # Delivery that was not enqueued (eq. rejected as the queue was full) is not a duplicate
+        assert not scheduler.is_duplicate(repo, 'delivery-1')
+
+        scheduler.remember_delivery(repo, 'delivery-1')
+        scheduler.remember_delivery(repo, None)
+        assert scheduler.is_duplicate(repo, 'delivery-1')
+        assert not scheduler.is_duplicate(repo, 'delivery-2')
+        assert not scheduler.is_duplicate(repo, None)
+
+    def test_same_commit_does_not_supersede(self, mocker):
+        async def publish(cancel=None, job_id=None, commit=None, stage=None):
+            await asyncio.sleep(0.01)
+            return '/ipfs/some-hash/'
+
+        async def run():
+            repo = make_repo(mocker, 'repo', publish)
+            scheduler = jobs.Scheduler()
+            first = scheduler.submit(repo, 'some-sha')
+            await asyncio.sleep(0)
+
+            second = scheduler.submit(repo, 'some-sha')
+            assert not first.superseded.is_set()
+
+            third = scheduler.submit(repo, 'other-sha')
+            assert first.superseded.is_set()
+
+            await wait_for_all([first, second])
+            return repo, second, third
+
+        repo, second, third = asyncio.run(run())
+        assert second is third
+        assert repo.publish_repo.call_args[1]['commit'] == 'other-sha'
+
+    def test_job_record_and_history(self, mocker, tmp_path):
+        async def publish(cancel=None, job_id=None, commit=None, stage=None):
+            stage(publishing.STAGE_CLONING)
+            stage(publishing.STAGE_ADDING)
+            return replication.PublishResult('some-cid', 'some-sha', [replication.NodeResult('/ip4/node', 0.5)])
+
+        async def run():
+            scheduler = jobs.Scheduler(store=store, recent_jobs=1)
+            submitted = [scheduler.submit(make_repo(mocker, f'repo{i}', publish)) for i in range(2)]
+            await wait_for_all(submitted)
+            # The record is saved after the job is finished
+            await asyncio.sleep(0.1)
+            return scheduler, submitted
+
+        store = state.StateStore(tmp_path / state.STATE_FILENAME)
+        scheduler, (first, second) = asyncio.run(run())
+
+        assert scheduler.get_job(first.id) is None
+        assert scheduler.get_job(second.id) is second
+
+        record = second.to_dict()
+        assert (record['status'], record['stage'], record['cid'], record['commit']) == \
+               (jobs.STATUS_FINISHED, publishing.STAGE_ADDING, 'some-cid', 'some-sha')
+        assert [stage['stage'] for stage in record['stages']] == [publishing.STAGE_CLONING, publishing.STAGE_ADDING]
+        assert all(stage['duration'] is not None for stage in record['stages'])
+        assert record['nodes'] == [{'node': '/ip4/node', 'duration': 0.5, 'error': None}]
+
+        assert store.load_job(first.id)['repo'] == 'repo0'
+        assert [record['id'] for record in store.load_jobs()] == [second.id, first.id]
@@ -0,0 +1,75 @@
+import pathlib
+
+import ipfshttpclient
+import pytest
+
+from publish import manifest
+
+
+@pytest.fixture
+def site(tmp_path: pathlib.Path):
+    path = tmp_path / 'site'
+    (path / 'css').mkdir(parents=True)
+    (path / 'index.html').write_text('index')
+    (path / 'css' / 'style.css').write_text('style')
+
+    for i in range(4):
+        (path / f'page{i}.html').write_text(f'page {i}')
+
+    return path
+
+
+@pytest.fixture
+def ipfs_client(mocker):
+    client = mocker.Mock(spec=ipfshttpclient.Client)
+    client.add.return_value = [
+        {'Name': 'site/css/style.css', 'Hash': 'style-hash'},
+        {'Name': 'site/index.html', 'Hash': 'index-hash'},
+        *({'Name': f'site/page{i}.html', 'Hash': f'page{i}-hash'} for i in range(4)),
+        {'Name': 'site/css', 'Hash': 'css-hash'},
+        {'Name': 'site', 'Hash': 'root-hash'},
+    ]
+    return client
+
+
+class TestManifest:
+    def test_first_publish_adds_whole_directory(self, site, ipfs_client, tmp_path):
+        site_manifest = manifest.Manifest.load(tmp_path / 'manifest.json')
+
+        assert site_manifest.add_directory(ipfs_client, site) == 'root-hash'
+        ipfs_client.add.assert_called_once_with(site, recursive=True, pin=False, stream=True)
+        assert site_manifest.files['css/style.css']['cid'] == 'style-hash'
+        assert site_manifest.dirs == {'css'}
+
+        site_manifest.save()
+        loaded = manifest.Manifest.load(tmp_path / 'manifest.json')
+        assert loaded.root == 'root-hash'
+        assert loaded.files == site_manifest.files
+
+    def test_only_changed_files_are_added(self, site, ipfs_client, tmp_path, mocker):
+        site_manifest = manifest.Manifest(tmp_path / 'manifest.json')
+        site_manifest.add_directory(ipfs_client, site)
+
+        ipfs_client.reset_mock()
+        ipfs_client.add.return_value = {'Hash': 'new-index-hash'}
+        ipfs_client.object.patch.add_link.return_value = {'Hash': 'new-root-hash'}
+        ipfs_client.object.patch.rm_link.return_value = {'Hash': 'removed-root-hash'}
+        (site / 'index.html').write_text('new index')
+        (site / 'css' / 'style.css').unlink()
+
+        assert site_manifest.add_directory(ipfs_client, site, base_root='root-hash') == 'new-root-hash'
+        ipfs_client.add.assert_called_once_with(site / 'index.html', pin=False)
+        ipfs_client.object.patch.rm_link.assert_called_once_with('root-hash', 'css/style.css')
+        ipfs_client.object.patch.add_link.assert_called_once_with('removed-root-hash', 'index.html',
+                                                                  'new-index-hash', create=True)
+        assert 'css/style.css' not in site_manifest.files
+
+    def test_different_base_root_adds_whole_directory(self, site, ipfs_client, tmp_path):
+        site_manifest = manifest.Manifest(tmp_path / 'manifest.json')
+        site_manifest.add_directory(ipfs_client, site)
+        (site / 'index.html').write_text('new index')
+
+        site_manifest.add_directory(ipfs_client, site, base_root='other-root-hash')
+
+        assert ipfs_client.add.call_count == 2
+        ipfs_client.object.patch.add_link.assert_not_called()
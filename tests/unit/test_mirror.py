@@ -0,0 +1,128 @@
+import pathlib
+import shutil
+import subprocess
+
+import git
+import pytest
+
+from publish import mirror, exceptions
+
+
+@pytest.fixture
+def origin(tmp_path: pathlib.Path):
+    path = tmp_path / 'origin'
+    repo = git.Repo.init(str(path))
+    (path / 'index.html').write_text('first')
+    repo.index.add(['index.html'])
+    repo.index.commit('first')
+    return repo
+
+
+def commit_file(repo: git.Repo, name: str, content: str) -> str:
+    (pathlib.Path(repo.working_tree_dir) / name).write_text(content)
+    repo.index.add([name])
+    return repo.index.commit(name).hexsha
+
+
+class TestRepoMirror:
+    def test_fetch_creates_mirror_once(self, origin, tmp_path, mocker):
+        repo_mirror = mirror.RepoMirror(tmp_path / 'mirror', origin.working_tree_dir)
+        init_spy = mocker.spy(git.Repo, 'init')
+
+        assert repo_mirror.fetch() == origin.head.commit.hexsha
+        assert repo_mirror.exists
+
+        new_commit = commit_file(origin, 'other.html', 'second')
+        assert repo_mirror.fetch() == new_commit
+        assert init_spy.call_count == 1
+
+    def test_fetch_branch(self, origin, tmp_path):
+        default_branch = origin.active_branch.name
+        origin.create_head('gh-pages').checkout()
+        branch_commit = commit_file(origin, 'page.html', 'page')
+        origin.heads[default_branch].checkout()
+
+        repo_mirror = mirror.RepoMirror(tmp_path / 'mirror', origin.working_tree_dir, 'gh-pages')
+        assert repo_mirror.fetch() == branch_commit
+
+    def test_fetch_unknown_branch(self, origin, tmp_path):
+        repo_mirror = mirror.RepoMirror(tmp_path / 'mirror', origin.working_tree_dir, 'non-existing')
+
+        with pytest.raises(exceptions.RepoException):
+            repo_mirror.fetch()
+
+    def test_remote_head(self, origin, tmp_path):
+        repo_mirror = mirror.RepoMirror(tmp_path / 'mirror', origin.working_tree_dir)
+
+        assert repo_mirror.remote_head() == origin.head.commit.hexsha
+        assert not repo_mirror.exists
+
+    def test_remote_head_does_not_hang(self, tmp_path, mocker):
+        run = mocker.patch.object(mirror.subprocess, 'run', side_effect=subprocess.TimeoutExpired('git', 1))
+        repo_mirror = mirror.RepoMirror(tmp_path / 'mirror', 'https://example.com/private')
+
+        with pytest.raises(exceptions.RepoException):
+            repo_mirror.remote_head()
+
+        assert run.call_args[1]['timeout'] == mirror.LS_REMOTE_TIMEOUT
+        assert run.call_args[1]['env']['GIT_TERMINAL_PROMPT'] == '0'
+
+    def test_fetch_specific_commit(self, origin, tmp_path):
+        origin.git.config('uploadpack.allowAnySHA1InWant', 'true')
+        first_commit = origin.head.commit.hexsha
+        commit_file(origin, 'other.html', 'second')
+
+        repo_mirror = mirror.RepoMirror(tmp_path / 'mirror', f'file://{origin.working_tree_dir}', strategy='shallow')
+        assert repo_mirror.fetch(first_commit) == first_commit
+        git.Repo(str(repo_mirror.path)).git.cat_file('-e', first_commit)
+
+    def test_fetch_invalid_commit(self, origin, tmp_path):
+        repo_mirror = mirror.RepoMirror(tmp_path / 'mirror', origin.working_tree_dir)
+
+        with pytest.raises(exceptions.RepoException):
+            repo_mirror.fetch('--upload-pack=touch /tmp/pwned')
+
+    def test_checkout(self, origin, tmp_path):
+        repo_mirror = mirror.RepoMirror(tmp_path / 'mirror', origin.working_tree_dir)
+        commit = repo_mirror.fetch()
+
+        worktree = tmp_path / 'worktree'
+        worktree.mkdir()
+        repo_mirror.checkout(commit, worktree)
+        assert (worktree / 'index.html').read_text() == 'first'
+
+        shutil.rmtree(worktree)
+        repo_mirror.prune()
+        assert not (repo_mirror.path / 'worktrees').exists()
+
+    def test_shallow_fetch(self, origin, tmp_path):
+        commit_file(origin, 'other.html', 'second')
+        repo_mirror = mirror.RepoMirror(tmp_path / 'mirror', f'file://{origin.working_tree_dir}', strategy='shallow')
+        repo_mirror.fetch()
+
+        assert (repo_mirror.path / 'shallow').exists()
+        assert git.Repo(str(repo_mirror.path)).git.rev_list('--count', mirror.FETCHED_REF) == '1'
+
+    def test_sparse_checkout(self, origin, tmp_path):
+        origin.git.config('uploadpack.allowFilter', 'true')
+        (pathlib.Path(origin.working_tree_dir) / 'docs').mkdir()
+        commit_file(origin, 'docs/index.html', 'docs')
+
+        repo_mirror = mirror.RepoMirror(tmp_path / 'mirror', f'file://{origin.working_tree_dir}', strategy='sparse')
+        commit = repo_mirror.fetch()
+
+        worktree = tmp_path / 'worktree'
+        worktree.mkdir()
+        repo_mirror.checkout(commit, worktree, ['docs', 'non-existing'])
+
+        assert (worktree / 'docs' / 'index.html').read_text() == 'docs'
+        assert not (worktree / 'index.html').exists()
+
+    def test_changed_strategy_recreates_mirror(self, origin, tmp_path, mocker):
+        mirror.RepoMirror(tmp_path / 'mirror', f'file://{origin.working_tree_dir}').fetch()
+
+        remove_spy = mocker.spy(mirror.RepoMirror, 'remove')
+        mirror.RepoMirror(tmp_path / 'mirror', f'file://{origin.working_tree_dir}', strategy='shallow').fetch()
+
+        assert remove_spy.call_count == 1
+        assert (tmp_path / 'mirror' / 'shallow').exists()
@@ -1,30 +1,32 @@
-import inspect
+import asyncio
 import pathlib
 import shutil
-import subprocess
+import tempfile
 
-import git
 import ipfshttpclient
 import pytest
 
-from publish import publishing, exceptions, PUBLISH_IGNORE_FILENAME
+from publish import publishing, exceptions, mirror, buildlog, PUBLISH_IGNORE_FILENAME
 from .. import factories
 
 IGNORE_FILE_TEST_SET = (
-    ('*.a', ('some.a', 'a', 'folder/b.a'), 1, 0),
+    ('*.a', ('some.a', 'a', 'folder/b.a'), 2, 0),
     ('**/*.b', ('b', 'some.b', 'folder/b', 'folder/some.b', 'some/other/folder/some.b'), 3, 0),
-    ('/another_file', (), NotImplementedError, 0),
+    ('/another_file', ('another_file', 'folder/another_file'), 1, 0),
     ('some_dir', ('some_dir/file',), 0, 1),
+    ('some_dir/', ('some_dir/file', 'other_dir/some_dir'), 0, 1),
+    ('*.c\n!keep.c', ('some.c', 'keep.c', 'folder/keep.c'), 1, 0),
+    ('# comment\n\nfolder/**', ('folder/some/file', 'folder/file', 'comment'), 1, 1),
     ('non_existing_file', (), 0, 0),
+    ('/../../outside_file', (), 0, 0),
 )
-"""
-/../../outside_file
-non_existing_file"""
 
 
 class TestRepo:
     def test_publish_repo_basic(self, mocker):
-        mocker.patch.object(git.Repo, 'clone_from')
+        mocker.patch.object(mirror.RepoMirror, 'fetch', return_value='some-sha')
+        mocker.patch.object(mirror.RepoMirror, 'checkout')
+        mocker.patch.object(mirror.RepoMirror, 'prune')
         mocker.patch.object(shutil, 'rmtree')
 
         ipfs_client_mock = mocker.Mock(spec=ipfshttpclient.Client)
@@ -34,14 +36,28 @@ class TestRepo:
         ipfshttpclient.connect.return_value = ipfs_client_mock
 
         repo: publishing.GenericRepo = factories.RepoFactory()
-        repo.publish_repo()
+        asyncio.run(repo.publish_repo())
 
-        ipfs_client_mock.add.assert_called_once_with(mocker.ANY, recursive=True, pin=True)
+        ipfs_client_mock.add.assert_called_once_with(mocker.ANY, recursive=True, pin=False, stream=True)
+        ipfs_client_mock.pin.add.assert_called_once_with('/ipfs/some-hash/')
         ipfs_client_mock.pin.rm.assert_not_called()
         assert repo.last_ipfs_addr == '/ipfs/some-hash/'
 
-    def test_publish_repo_bins(self, mocker):
-        mocker.patch.object(git.Repo, 'clone_from')
+    def test_publish_repo_skips_published_commit(self, mocker):
+        mocker.patch.object(mirror.RepoMirror, 'remote_head', return_value='some-sha')
+        fetch = mocker.patch.object(mirror.RepoMirror, 'fetch')
+
+        repo: publishing.GenericRepo = factories.RepoFactory(last_ipfs_addr='/ipfs/some-hash/',
+                                                             last_commit_sha='some-sha')
+
+        assert asyncio.run(repo.publish_repo()) is None
+        assert asyncio.run(repo.publish_repo(commit='some-sha')) is None
+        fetch.assert_not_called()
+
+    def test_publish_repo_commit(self, mocker):
+        mocker.patch.object(mirror.RepoMirror, 'fetch', side_effect=lambda commit: commit)
+        checkout = mocker.patch.object(mirror.RepoMirror, 'checkout')
+        mocker.patch.object(mirror.RepoMirror, 'prune')
         mocker.patch.object(shutil, 'rmtree')
 
         ipfs_client_mock = mocker.Mock(spec=ipfshttpclient.Client)
@@ -50,18 +66,89 @@ class TestRepo:
         mocker.patch.object(ipfshttpclient, 'connect')
         ipfshttpclient.connect.return_value = ipfs_client_mock
 
-        mocker.patch.object(subprocess, 'run')
-        subprocess.run.return_value = subprocess.CompletedProcess(None, 0)
+        repo: publishing.GenericRepo = factories.RepoFactory(last_ipfs_addr='/ipfs/old-hash/',
+                                                             last_commit_sha='old-sha')
+
+        assert asyncio.run(repo.publish_repo(commit='new-sha')).cid == '/ipfs/some-hash/'
+        assert checkout.call_args[0][0] == 'new-sha'
+        assert repo.last_commit_sha == 'new-sha'
+
+    def test_publish_repo_replicas(self, mocker):
+        mocker.patch.object(mirror.RepoMirror, 'fetch', return_value='some-sha')
+        mocker.patch.object(mirror.RepoMirror, 'checkout')
+        mocker.patch.object(mirror.RepoMirror, 'prune')
+        mocker.patch.object(shutil, 'rmtree')
+
+        ipfs_client_mock = mocker.Mock(spec=ipfshttpclient.Client)
+        ipfs_client_mock.add.return_value = [{'Hash': 'some-hash'}]
+        replica_mock = mocker.Mock(spec=ipfshttpclient.Client)
+        replica_mock.pin.add.side_effect = ipfshttpclient.exceptions.TimeoutError('timeout')
+
+        mocker.patch.object(ipfshttpclient, 'connect',
+                            side_effect=lambda addr, **kwargs: replica_mock if addr == 'replica' else ipfs_client_mock)
+
+        repo: publishing.GenericRepo = factories.RepoFactory()
+        repo.config['ipfs'] = {'multiaddr': 'primary', 'replicas': ['replica']}
+        result = asyncio.run(repo.publish_repo())
+
+        # Content is added only to the primary node, failure of the replica does not fail the publish
+        replica_mock.add.assert_not_called()
+        replica_mock.pin.add.assert_called_once_with('/ipfs/some-hash/')
+        assert [(node.node, node.success) for node in result.nodes] == [('primary', True), ('replica', False)]
+
+    def test_publish_repo_bins(self, mocker, tmp_path):
+        mocker.patch.object(mirror.RepoMirror, 'fetch', return_value='some-sha')
+        mocker.patch.object(mirror.RepoMirror, 'checkout')
+        mocker.patch.object(mirror.RepoMirror, 'prune')
+        mocker.patch.object(shutil, 'rmtree')
+        mocker.patch.object(tempfile, 'mkdtemp', return_value=str(tmp_path))
+
+        ipfs_client_mock = mocker.Mock(spec=ipfshttpclient.Client)
+        ipfs_client_mock.add.return_value = [{'Hash': 'some-hash'}]
+
+        mocker.patch.object(ipfshttpclient, 'connect')
+        ipfshttpclient.connect.return_value = ipfs_client_mock
 
-        repo: publishing.GenericRepo = factories.RepoFactory(build_bin='some_cmd', after_publish_bin='some_other_cmd')
-        repo.publish_repo()
+        repo: publishing.GenericRepo = factories.RepoFactory(build_bin='echo built > build.txt; echo building',
+                                                             after_publish_bin='echo > published.txt')
+        asyncio.run(repo.publish_repo())
 
-        assert subprocess.run.call_count == 2
-        subprocess.run.assert_called_with(f'some_other_cmd /ipfs/some-hash/', shell=True, capture_output=True)
-        subprocess.run.assert_any_call(f'some_cmd ', shell=True, capture_output=True)
+        assert (tmp_path / 'build.txt').read_text() == 'built\n'
+        assert (tmp_path / 'published.txt').read_text() == '/ipfs/some-hash/\n'
+
+        log = buildlog.BuildLog.latest(repo.config, repo.name)
+        assert log.finished
+        assert b'building\n' in log.path.read_bytes()
+
+    def test_publish_repo_build_cache(self, mocker, tmp_path):
+        mocker.patch.object(mirror.RepoMirror, 'fetch', return_value='some-sha')
+        mocker.patch.object(mirror.RepoMirror, 'checkout')
+        mocker.patch.object(mirror.RepoMirror, 'tree_hashes', return_value='some-tree')
+        checkouts = iter([tmp_path / 'first', tmp_path / 'second'])
+        mocker.patch.object(tempfile, 'mkdtemp', side_effect=lambda: str(next(checkouts)))
+        (tmp_path / 'first').mkdir()
+        (tmp_path / 'second').mkdir()
+
+        ipfs_client_mock = mocker.Mock(spec=ipfshttpclient.Client)
+        ipfs_client_mock.add.return_value = [{'Hash': 'some-hash'}]
+
+        mocker.patch.object(ipfshttpclient, 'connect')
+        ipfshttpclient.connect.return_value = ipfs_client_mock
+
+        repo: publishing.GenericRepo = factories.RepoFactory(build_bin='echo built > build.txt', build_cache=True,
+                                                             publish_dir='/')
+        mocker.patch.object(repo, '_cleanup_repo')
+        run_bin = mocker.spy(repo, '_run_bin')
+        asyncio.run(repo.publish_repo())
+        asyncio.run(repo.publish_repo(force=True))
+
+        assert run_bin.call_count == 1
+        assert (tmp_path / 'second' / 'build.txt').read_text() == 'built\n'
 
     def test_publish_repo_bins_fails(self, mocker):
-        mocker.patch.object(git.Repo, 'clone_from')
+        mocker.patch.object(mirror.RepoMirror, 'fetch', return_value='some-sha')
+        mocker.patch.object(mirror.RepoMirror, 'checkout')
+        mocker.patch.object(mirror.RepoMirror, 'prune')
         mocker.patch.object(shutil, 'rmtree')
 
         ipfs_client_mock = mocker.Mock(spec=ipfshttpclient.Client)
@@ -70,16 +157,48 @@ class TestRepo:
         mocker.patch.object(ipfshttpclient, 'connect')
         ipfshttpclient.connect.return_value = ipfs_client_mock
 
-        mocker.patch.object(subprocess, 'run')
-        subprocess.run.return_value = subprocess.CompletedProcess(None, 1)
+        repo: publishing.GenericRepo = factories.RepoFactory(build_bin='exit 1', after_publish_bin='true')
+
+        with pytest.raises(exceptions.RepoException):
+            asyncio.run(repo.publish_repo())
 
-        repo: publishing.GenericRepo = factories.RepoFactory(build_bin='some_cmd', after_publish_bin='some_other_cmd')
+        ipfs_client_mock.add.assert_not_called()
+
+    def test_run_bin_timeout(self, tmp_path):
+        repo: publishing.GenericRepo = factories.RepoFactory(timeout='1s')
 
         with pytest.raises(exceptions.RepoException):
-            repo.publish_repo()
+            asyncio.run(asyncio.wait_for(repo._run_bin(tmp_path, 'sleep 30'), 10))
+
+    def test_run_bin_cancel(self, tmp_path):
+        repo: publishing.GenericRepo = factories.RepoFactory()
+
+        async def run():
+            cancel = asyncio.Event()
+            asyncio.get_event_loop().call_later(0.1, cancel.set)
+            await asyncio.wait_for(repo._run_bin(tmp_path, 'sleep 30', cancel=cancel), 10)
+
+        with pytest.raises(exceptions.BuildCancelledException):
+            asyncio.run(run())
+
+    def test_run_bin_cwd_per_process(self, tmp_path):
+        repo: publishing.GenericRepo = factories.RepoFactory()
+        first, second = tmp_path / 'first', tmp_path / 'second'
+        first.mkdir()
+        second.mkdir()
+
+        async def run():
+            await asyncio.gather(repo._run_bin(first, 'sleep 0.1; pwd > cwd.txt'),
+                                 repo._run_bin(second, 'pwd > cwd.txt'))
+
+        asyncio.run(run())
+        assert (first / 'cwd.txt').read_text().strip() == str(first)
+        assert (second / 'cwd.txt').read_text().strip() == str(second)
 
     def test_publish_rm_old_pin(self, mocker):
-        mocker.patch.object(git.Repo, 'clone_from')
+        mocker.patch.object(mirror.RepoMirror, 'fetch', return_value='some-sha')
+        mocker.patch.object(mirror.RepoMirror, 'checkout')
+        mocker.patch.object(mirror.RepoMirror, 'prune')
         mocker.patch.object(shutil, 'rmtree')
 
         ipfs_client_mock = mocker.Mock(spec=ipfshttpclient.Client)
@@ -88,10 +207,103 @@ class TestRepo:
         mocker.patch.object(ipfshttpclient, 'connect')
         ipfshttpclient.connect.return_value = ipfs_client_mock
 
-        repo: publishing.GenericRepo = factories.RepoFactory(last_ipfs_addr='some_hash')
-        repo.publish_repo()
+        repo: publishing.GenericRepo = factories.RepoFactory(last_ipfs_addr='some_hash', ipns_key='some-key')
+        asyncio.run(repo.publish_repo())
 
+        # Old pin is removed only after the new version is pinned and published
+        assert [call[0] for call in ipfs_client_mock.mock_calls if call[0].startswith(('pin', 'name'))] == \
+            ['pin.update', 'name.publish', 'pin.rm']
+        ipfs_client_mock.pin.update.assert_called_once_with('some_hash', '/ipfs/some-hash/', unpin=False)
         ipfs_client_mock.pin.rm.assert_called_once_with('some_hash')
+        ipfs_client_mock.pin.add.assert_not_called()
+
+    def test_publish_repo_ipns_up_to_date(self, mocker):
+        mocker.patch.object(mirror.RepoMirror, 'fetch', return_value='some-sha')
+        mocker.patch.object(mirror.RepoMirror, 'checkout')
+        mocker.patch.object(mirror.RepoMirror, 'prune')
+        mocker.patch.object(shutil, 'rmtree')
+        mocker.patch('time.time', return_value=1000.0)
+
+        ipfs_client_mock = mocker.Mock(spec=ipfshttpclient.Client)
+        ipfs_client_mock.add.return_value = [{'Hash': 'some-hash'}]
+        mocker.patch.object(ipfshttpclient, 'connect').return_value = ipfs_client_mock
+
+        repo: publishing.GenericRepo = factories.RepoFactory(ipns_key='some-key', ipns_published_at=0.0,
+                                                             ipns_published_addr='/ipfs/some-hash/')
+        result = asyncio.run(repo.publish_repo(force=True))
+
+        ipfs_client_mock.name.publish.assert_not_called()
+        assert result.ipns_duration is None
+
+        # Record with less than half of its lifetime left is published again
+        repo.ipns_published_at = 1000.0 - 13 * 60 * 60
+        result = asyncio.run(repo.publish_repo(force=True))
+
+        ipfs_client_mock.name.publish.assert_called_once_with('/ipfs/some-hash/', key='some-key', lifetime='24h',
+                                                              ttl='15m')
+        assert result.ipns_duration is not None
+        assert repo.ipns_published_at == 1000.0
+
+    def test_publish_failed_dns_keeps_previous_pin(self, mocker):
+        mocker.patch.object(mirror.RepoMirror, 'fetch', return_value='some-sha')
+        mocker.patch.object(mirror.RepoMirror, 'checkout')
+        mocker.patch.object(mirror.RepoMirror, 'prune')
+        mocker.patch.object(shutil, 'rmtree')
+
+        ipfs_client_mock = mocker.Mock(spec=ipfshttpclient.Client)
+        ipfs_client_mock.add.return_value = [{'Hash': 'some-hash'}]
+        ipfs_client_mock.name.publish.side_effect = ipfshttpclient.exceptions.Error('IPNS failed')
+        mocker.patch.object(ipfshttpclient, 'connect').return_value = ipfs_client_mock
+
+        repo: publishing.GenericRepo = factories.RepoFactory(last_ipfs_addr='some_hash', ipns_key='some-key',
+                                                             keep_versions=1)
+        mocker.patch.object(repo, '_update_dns', side_effect=exceptions.PublishingException('DNS failed'))
+
+        with pytest.raises(exceptions.PublishingException, match='DNS failed'):
+            asyncio.run(repo.publish_repo())
+
+        # DNSLink still points to the previous version, so it stays pinned, the new one is recorded for retention
+        ipfs_client_mock.pin.rm.assert_not_called()
+        assert [version['cid'] for version in repo.versions] == ['some_hash', '/ipfs/some-hash/']
+        assert repo.config.state.load(repo.name)['last_ipfs_addr'] == '/ipfs/some-hash/'
+
+    def test_publish_failed_after_publish_bin_is_retried(self, mocker):
+        mocker.patch.object(mirror.RepoMirror, 'remote_head', return_value='some-sha')
+        mocker.patch.object(mirror.RepoMirror, 'fetch', return_value='some-sha')
+        mocker.patch.object(mirror.RepoMirror, 'checkout')
+        mocker.patch.object(mirror.RepoMirror, 'prune')
+
+        ipfs_client_mock = mocker.Mock(spec=ipfshttpclient.Client)
+        ipfs_client_mock.add.return_value = [{'Hash': 'some-hash'}]
+        mocker.patch.object(ipfshttpclient, 'connect').return_value = ipfs_client_mock
+
+        repo: publishing.GenericRepo = factories.RepoFactory(last_ipfs_addr='some_hash', last_commit_sha='old-sha',
+                                                             after_publish_bin='false')
+
+        with pytest.raises(exceptions.RepoException):
+            asyncio.run(repo.publish_repo())
+        assert repo.last_commit_sha == 'old-sha'
+        assert repo.config.state.load(repo.name)['last_commit_sha'] == 'old-sha'
+
+        repo.after_publish_bin = 'true'
+        assert asyncio.run(repo.publish_repo()) is not None
+        assert repo.last_commit_sha == 'some-sha'
+        assert asyncio.run(repo.publish_repo()) is None
+
+    def test_apply_retention(self, mocker):
+        ipfs_client_mock = mocker.Mock(spec=ipfshttpclient.Client)
+        mocker.patch.object(ipfshttpclient, 'connect')
+        ipfshttpclient.connect.return_value = ipfs_client_mock
+
+        repo: publishing.GenericRepo = factories.RepoFactory(keep_versions=2, versions=[
+            {'cid': '/ipfs/old/', 'published_at': 1}, {'cid': '/ipfs/previous/', 'published_at': 2},
+        ])
+        repo._record_version('/ipfs/previous/', '/ipfs/new/', 'a' * 40)
+        repo._apply_retention()
+
+        assert [version['cid'] for version in repo.versions] == ['/ipfs/previous/', '/ipfs/new/']
+        assert repo.versions[-1]['commit'] == 'a' * 40
+        ipfs_client_mock.pin.rm.assert_called_once_with('/ipfs/old/')
 
     @pytest.mark.parametrize(('glob', 'paths_to_make', 'expected_unlink', 'expected_rmtree'), IGNORE_FILE_TEST_SET)
     def test_remove_ignored_files(self, glob, paths_to_make, expected_unlink, expected_rmtree, tmp_path: pathlib.Path, mocker):
@@ -107,16 +319,11 @@ class TestRepo:
             path.parent.mkdir(parents=True, exist_ok=True)
             path.touch()
 
-        if inspect.isclass(expected_unlink) and issubclass(expected_unlink, Exception):
-            with pytest.raises(expected_unlink):
-                repo: publishing.GenericRepo = factories.RepoFactory()
-                repo._remove_ignored_files(tmp_path)
-        else:
-            repo: publishing.GenericRepo = factories.RepoFactory()
-            repo._remove_ignored_files(tmp_path)
+        repo: publishing.GenericRepo = factories.RepoFactory()
+        repo._remove_ignored_files(tmp_path)
 
-            # -1 because the method removes the ignore file on its own
-            assert pathlib.Path.unlink.call_count - 1 == expected_unlink
+        # -1 because the method removes the ignore file on its own
+        assert pathlib.Path.unlink.call_count - 1 == expected_unlink
 
-            # =1 because of removing .git folder
-            assert shutil.rmtree.call_count - 1 == expected_rmtree
+        # =1 because of removing .git folder
+        assert shutil.rmtree.call_count - 1 == expected_rmtree
@@ -0,0 +1,38 @@
+import ipfshttpclient
+
+from publish import replication
+
+
+class TestReplicaPool:
+    def test_run(self, mocker):
+        clients = {}
+
+        def connect(node, session=False):
+            clients[node] = mocker.Mock(spec=ipfshttpclient.Client)
+            if node == 'broken':
+                clients[node].pin.add.side_effect = ipfshttpclient.exceptions.ConnectionError('down')
+            return clients[node]
+
+        connect_mock = mocker.patch.object(ipfshttpclient, 'connect', side_effect=connect)
+        pool = replication.ReplicaPool(['first', 'broken', 'second'])
+
+        results = pool.run(lambda ipfs: ipfs.pin.add('/ipfs/some-hash/'))
+
+        assert [result.node for result in results] == ['first', 'broken', 'second']
+        assert [result.success for result in results] == [True, False, True]
+        assert 'down' in results[1].error
+        clients['first'].pin.add.assert_called_once_with('/ipfs/some-hash/')
+
+        # Clients are reused, only the failed node is reconnected
+        pool.run(lambda ipfs: None)
+        assert connect_mock.call_count == 4
+
+    def test_no_replicas(self):
+        assert replication.ReplicaPool([]).run(lambda ipfs: None) == []
+
+    def test_failed_nodes(self):
+        result = replication.PublishResult('/ipfs/some-hash/', nodes=[
+            replication.NodeResult('first', 1.0), replication.NodeResult('second', 2.0, 'error'),
+        ])
+
+        assert [node.node for node in result.failed_nodes] == ['second']
@@ -0,0 +1,78 @@
+import asyncio
+
+import ipfshttpclient
+import toml
+
+from publish import jobs, republishing, config as config_module
+from .. import factories
+
+HOUR = 60 * 60
+
+
+def make_republisher(mocker, *repos_kwargs, running=()):
+    config = factories.ConfigFactory()
+    for kwargs in repos_kwargs:
+        repo = factories.RepoFactory(config=config, **kwargs)
+        config.repos[repo.name] = repo
+
+    mocker.patch.object(jobs, 'get_scheduler').return_value.running = {name: None for name in running}
+    mocker.patch('random.uniform', side_effect=lambda a, b: b)
+    return republishing.Republisher(config, jitter=0.1)
+
+
+class TestRepublisher:
+    def test_due_repos(self, mocker):
+        republisher = make_republisher(
+            mocker,
+            dict(name='due', republish=True, ipns_key='key', last_ipfs_addr='/ipfs/a/', ipns_published_at=0),
+            dict(name='fresh', republish=True, ipns_key='key', last_ipfs_addr='/ipfs/b/', ipns_published_at=10 * HOUR),
+            dict(name='disabled', republish=False, ipns_key='key', last_ipfs_addr='/ipfs/c/', ipns_published_at=0),
+            dict(name='unpublished', republish=True, ipns_key='key', ipns_published_at=0),
+            dict(name='running', republish=True, ipns_key='key', last_ipfs_addr='/ipfs/d/', ipns_published_at=0),
+            running=('running',),
+        )
+
+        # 24h lifetime is republished after 12h with jitter of 2.4h
+        assert [repo.name for repo in republisher.due_repos(now=9.6 * HOUR)] == ['due']
+        assert [repo.name for repo in republisher.due_repos(now=9.5 * HOUR)] == []
+
+    def test_due_repos_builds_only_republished(self, mocker, tmp_path):
+        path = tmp_path / 'config.toml'
+        path.write_text(toml.dumps({'host': 'localhost', 'port': 8070, 'repos': {
+            name: {'name': name, 'git_repo_url': f'https://example.com/{name}', 'secret': 'secret', 'ipns': ipns}
+            for name, ipns in (('republished', {'republish': True, 'ipns_key': 'key'}),
+                               ('disabled', {'republish': False, 'ipns_key': 'key'}), ('no-ipns', {}))
+        }}))
+        mocker.patch.object(jobs, 'get_scheduler').return_value.running = {}
+        republisher = republishing.Republisher(config_module.Config(path))
+
+        assert republisher.due_repos() == []
+        assert [name for name in republisher.config.repos if republisher.config.repos.is_built(name)] == \
+            ['republished']
+
+    def test_unknown_publish_time_is_spread(self, mocker):
+        republisher = make_republisher(
+            mocker, dict(name='repo', republish=True, ipns_key='key', last_ipfs_addr='/ipfs/a/'),
+        )
+
+        assert republisher.due_repos(now=1000) == []
+        assert republisher.due_repos(now=1000 + republishing.STARTUP_SPREAD)[0].name == 'repo'
+
+    def test_republish(self, mocker):
+        ipfs_client_mock = mocker.Mock(spec=ipfshttpclient.Client)
+        mocker.patch.object(ipfshttpclient, 'connect').return_value = ipfs_client_mock
+        mocker.patch('time.time', return_value=100.0)
+
+        republisher = make_republisher(
+            mocker, dict(name='repo', republish=True, ipns_key='key', last_ipfs_addr='/ipfs/a/', ipns_lifetime='48h',
+                         ipns_published_at=0),
+        )
+        repo = republisher.config.repos['repo']
+        asyncio.run(republisher.republish([repo]))
+
+        ipfs_client_mock.name.publish.assert_called_once_with('/ipfs/a/', key='key', lifetime='48h', ttl='15m')
+        assert repo.ipns_published_at == 100.0
+
+        # New publish time re-plans the republish
+        assert republisher.due_repos(now=100.0 + 19 * HOUR) == []
+        assert republisher.due_repos(now=100.0 + 20 * HOUR) == [repo]
@@ -0,0 +1,65 @@
+import datetime
+
+import ipfshttpclient
+import pytest
+
+from publish import exceptions, retention
+
+DAY = 24 * 60 * 60
+NOW = 100 * DAY
+
+
+def versions(*ages):
+    return [{'cid': f'cid-{age}', 'published_at': NOW - age * DAY} for age in ages]
+
+
+class TestExpiredVersions:
+    def test_no_rules(self):
+        assert retention.expired_versions(versions(10, 5, 1)) == []
+
+    def test_keep_versions(self):
+        expired = retention.expired_versions(versions(10, 5, 1), keep_versions=2, now=NOW)
+        assert [v['cid'] for v in expired] == ['cid-10']
+
+    def test_keep_days(self):
+        expired = retention.expired_versions(versions(10, 5, 1), keep_days=3, now=NOW)
+        assert [v['cid'] for v in expired] == ['cid-10', 'cid-5']
+
+    def test_any_rule_retains(self):
+        expired = retention.expired_versions(versions(10, 5, 1), keep_versions=1, keep_days=7, now=NOW)
+        assert [v['cid'] for v in expired] == ['cid-10']
+
+    def test_latest_always_kept(self):
+        assert retention.expired_versions(versions(20, 10), keep_days=1, now=NOW) == versions(20)
+
+
+class TestUnpinInBatches:
+    def test_batches(self, mocker):
+        ipfs = mocker.Mock()
+        sleep = mocker.patch('time.sleep')
+
+        retention.unpin_in_batches(ipfs, ['a', 'b', 'c', 'd', 'e'], batch_size=2, pause=0.5)
+
+        assert ipfs.pin.rm.call_args_list == [mocker.call('a', 'b'), mocker.call('c', 'd'), mocker.call('e')]
+        assert sleep.call_count == 2
+        sleep.assert_called_with(0.5)
+
+    def test_fallback_to_single_cids(self, mocker):
+        ipfs = mocker.Mock()
+        ipfs.pin.rm.side_effect = [ipfshttpclient.exceptions.ErrorResponse('not pinned', None), None,
+                                   ipfshttpclient.exceptions.ErrorResponse('not pinned', None)]
+
+        retention.unpin_in_batches(ipfs, ['a', 'b'], batch_size=2, pause=0)
+
+        assert ipfs.pin.rm.call_args_list == [mocker.call('a', 'b'), mocker.call('a'), mocker.call('b')]
+
+
+class TestSchedule:
+    def test_next_run(self):
+        now = datetime.datetime(2019, 1, 1, 12, 0)
+        assert retention.seconds_until_next_run(['03:30', '13:00'], now) == 60 * 60
+        assert retention.seconds_until_next_run(['03:30'], now) == 15.5 * 60 * 60
+
+    def test_invalid_time(self):
+        with pytest.raises(exceptions.ConfigException):
+            retention.seconds_until_next_run(['25:00'])
@@ -0,0 +1,36 @@
+from publish import state
+
+
+class TestStateStore:
+    def test_save_load(self, tmp_path):
+        store = state.StateStore(tmp_path / state.STATE_FILENAME)
+        store.save('repo', {'last_ipfs_addr': '/ipfs/b/', 'last_commit_sha': 'sha', 'versions': [
+            {'cid': '/ipfs/a/', 'published_at': 1}, {'cid': '/ipfs/b/', 'commit': 'sha', 'published_at': 2},
+        ]})
+        store.save('other', {'last_ipfs_addr': '/ipfs/c/'})
+
+        loaded = state.StateStore(tmp_path / state.STATE_FILENAME).load('repo')
+        assert loaded['last_ipfs_addr'] == '/ipfs/b/'
+        assert loaded['ipns_published_at'] is None
+        assert loaded['versions'] == [{'cid': '/ipfs/a/', 'published_at': 1},
+                                      {'cid': '/ipfs/b/', 'commit': 'sha', 'published_at': 2}]
+
+        store.save('repo', {'last_ipfs_addr': '/ipfs/d/', 'versions': [{'cid': '/ipfs/d/', 'published_at': 3}]})
+        assert [version['cid'] for version in store.load('repo')['versions']] == ['/ipfs/d/']
+        assert store.load('other')['versions'] == []
+
+        store.remove('repo')
+        assert store.load('repo') is None
+        assert store.load('other') is not None
+
+    def test_jobs_history(self, tmp_path):
+        store = state.StateStore(tmp_path / state.STATE_FILENAME)
+        for index in range(5):
+            store.save_job({'id': f'job{index}', 'repo': 'repo' if index % 2 else 'other', 'finished_at': index,
+                            'status': 'finished'}, history_size=3)
+
+        assert store.load_job('job0') is None
+        assert store.load_job('job4')['status'] == 'finished'
+        assert [record['id'] for record in store.load_jobs()] == ['job4', 'job3', 'job2']
+        assert [record['id'] for record in store.load_jobs(repo='repo')] == ['job3']
+        assert [record['id'] for record in store.load_jobs(limit=1)] == ['job4']
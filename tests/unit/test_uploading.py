@@ -0,0 +1,80 @@
+import ipfshttpclient
+import pytest
+
+from publish import uploading
+
+
+def streamed_entries(count):
+    for index in range(count):
+        yield {'Name': f'site/file{index}', 'Hash': f'hash{index}', 'Size': '10'}
+
+    yield {'Name': 'site', 'Hash': 'root-hash', 'Size': '100'}
+
+
+class TestAddDirectory:
+    def test_returns_root(self, mocker, tmp_path):
+        ipfs_client = mocker.Mock(spec=ipfshttpclient.Client)
+        ipfs_client.add.return_value = streamed_entries(2500)
+        reports = []
+
+        progress = uploading.ProgressCounter(reports.append)
+        assert uploading.add_directory(ipfs_client, tmp_path, pin=False, progress=progress) == 'root-hash'
+
+        ipfs_client.add.assert_called_once_with(tmp_path, recursive=True, pin=False, stream=True)
+        assert progress.count == 2501
+        assert reports == [1000, 2000]
+
+    def test_empty_response(self, mocker, tmp_path):
+        ipfs_client = mocker.Mock(spec=ipfshttpclient.Client)
+        ipfs_client.add.return_value = iter([])
+
+        with pytest.raises(ipfshttpclient.exceptions.ProtocolError):
+            uploading.add_directory(ipfs_client, tmp_path)
+
+
+def make_site(path, sizes):
+    for name, size in sizes.items():
+        (path / name).parent.mkdir(parents=True, exist_ok=True)
+        (path / name).write_bytes(b'x' * size)
+
+    return path
+
+
+class TestShardedAdd:
+    def test_plan_shards_splits_biggest_directories(self, tmp_path):
+        site = make_site(tmp_path, {'index.html': 10, 'media/a/1.mp4': 1000, 'media/a/2.mp4': 1000,
+                                    'media/b/3.mp4': 1000, 'css/style.css': 10})
+
+        assert uploading.plan_shards(site, 2) == [('css', True), ('index.html', False), ('media/a/1.mp4', False),
+                                                  ('media/a/2.mp4', False), ('media/b/3.mp4', False)]
+
+    def test_plan_shards_with_symlink(self, tmp_path):
+        site = make_site(tmp_path, {'index.html': 10})
+        (site / 'link').symlink_to(site / 'index.html')
+
+        assert uploading.plan_shards(site, 2) is None
+
+    def test_add_sharded(self, mocker, tmp_path):
+        site = make_site(tmp_path, {'index.html': 10, 'media/a.mp4': 1000, 'media/b.mp4': 1000})
+
+        ipfs_client = mocker.Mock(spec=ipfshttpclient.Client)
+        ipfs_client.object.patch.add_link.side_effect = lambda root, path, cid, create: {'Hash': f'{root}+{path}'}
+
+        worker_client = mocker.Mock(spec=ipfshttpclient.Client)
+        worker_client.add.side_effect = lambda path, pin: {'Hash': f'hash-{path.name}'}
+
+        root = uploading.add_directory_sharded(ipfs_client, lambda: worker_client, site, 2, pin=True)
+
+        assert root == f'{uploading.EMPTY_DIR_CID}+index.html+media/a.mp4+media/b.mp4'
+        ipfs_client.object.patch.add_link.assert_any_call(mocker.ANY, 'media/a.mp4', 'hash-a.mp4', create=True)
+        ipfs_client.pin.add.assert_called_once_with(root)
+        ipfs_client.add.assert_not_called()
+        worker_client.close.assert_called()
+
+    def test_add_sharded_single_worker(self, mocker, tmp_path):
+        ipfs_client = mocker.Mock(spec=ipfshttpclient.Client)
+        ipfs_client.add.return_value = streamed_entries(1)
+        connect = mocker.Mock()
+
+        assert uploading.add_directory_sharded(ipfs_client, connect, tmp_path, 1) == 'root-hash'
+        connect.assert_not_called()